@@ -1,18 +1,67 @@
-from fastapi import FastAPI
+from fastapi import APIRouter, Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 from pydantic import BaseModel, Field
 from langchain_core.tools import StructuredTool
 
-from langchain_community.tools import DuckDuckGoSearchResults
-
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain.prompts import PromptTemplate
-from langchain_google_genai import GoogleGenerativeAI
+# LangChain's agents and the Gemini SDK are imported where they are first used, so a worker accepts connections and
+# answers its probes within a second while its clients are created in the background
+from langchain_core.agents import AgentAction, AgentFinish
 from dotenv import load_dotenv
-import requests
-import re
-import random
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+import httpx
+import logging
+import os
+
+from utils.sse import formatting_event, aparsing_events
+from utils.intent_router import IntentRouter, GREETING_REPLY
+from utils.web_search import WebSearcher, creating_search_backend
+from utils.shared_state import SharedStore
+from utils.readiness import Readiness
+from utils.singleflight import AsyncSingleFlight, query_key
+from utils.telemetry import TimingCallbackHandler, configuring_logging, counting, exporting_metrics, logging_event, preparing_worker_metrics, timing, timing_requests
+
+# Base URL of the API serving the Vector Database
+API_URL = os.getenv("API_URL", "http://0.0.0.0:8000")
+
+# The document the current request is about, read by the tools since the agent only hands them the query
+current_document_id = ContextVar("current_document_id", default=None)
+
+# Shared HTTP client, its connection pool is reused by every call to the API
+http_client = None
+
+def getting_http_client():
+    """
+    Returns the shared asynchronous HTTP client, creating it on first use.
+
+    Returns:
+        httpx.AsyncClient: A pooled client with connect and read timeouts.
+    """
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(float(os.getenv("API_TIMEOUT", "120")), connect=5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return http_client
+
+def database_params(query):
+    """
+    Builds the query parameters of a call to the Vector Database for the current request.
+
+    Args:
+        query (str): The query to be answered from the document.
+
+    Returns:
+        dict: The query parameters, without the document ID when the request is not about a specific document.
+    """
+    params = {"query": query, "proffesion": "Researcher"}
+    if current_document_id.get() is not None:
+        params["document_id"] = current_document_id.get()
+    return params
 
 # Class to define the schema for the greeting tool
 class GreetingTool(BaseModel):
@@ -36,12 +85,21 @@ def greeting_tool(query: str) -> str:
     Returns:
         str: A response to the user's greeting, or a general introduction if no greeting is found.
     """
-    return llm.invoke(query)
+    with timing("tool_greetings"):
+        return llm.invoke(query)
+
+async def agreeting_tool(query: str) -> str:
+    """
+    Asynchronous version of `greeting_tool`, used when the agent runs on the event loop.
+    """
+    with timing("tool_greetings"):
+        return await llm.ainvoke(query)
 
 
 # Creating a structured tool from the greeting function
 greeting = StructuredTool.from_function(
     func=greeting_tool,
+    coroutine=agreeting_tool,
     name="Greetings",
     description="A tool for handling greeting queries.",
     args_schema=GreetingTool,
@@ -70,14 +128,31 @@ def calling_database(query: str) -> str:
     Returns:
         str: The text response from the Vector Database after processing the query.
     """
-    print("calling_database")
-    response = requests.get(f"http://0.0.0.0:8000/get_response", params={"query": query, "proffesion": "Researcher"}).json()
-    return response
+    with timing("tool_database_call"):
+        response = httpx.get(f"{API_URL}/get_response", params=database_params(query), timeout=float(os.getenv("API_TIMEOUT", "120")))
+    response.raise_for_status()
+    return response.json()
+
+async def acalling_database(query: str) -> str:
+    """
+    Asynchronous version of `calling_database`, going through the shared pooled HTTP client.
+
+    Args:
+        query (str): The user's input query that will be sent to the Vector Database for processing.
+
+    Returns:
+        str: The text response from the Vector Database after processing the query.
+    """
+    with timing("tool_database_call"):
+        response = await getting_http_client().get(f"{API_URL}/get_response", params=database_params(query))
+    response.raise_for_status()
+    return response.json()
 
 
 # Creating a structured tool for calling the database
 db_calling = StructuredTool.from_function(
     func=calling_database,
+    coroutine=acalling_database,
     name="Database Call",
     description="A tool for calling the Vector Database to answer queries related to the provided PDF content. Use this tool if you need any information regarding the pdf file.",
     args_schema=DbCall,
@@ -105,28 +180,21 @@ def searching_web(query: str) -> list:
     Returns:
         resources (list): A list of resources to user's query. It contains Title and url of the resource.
     """
-    search = DuckDuckGoSearchResults(safesearch = "on", max_results=10)
-
-    results = search.invoke(query)
-
-    # Regular expressions to match title and link
-    title_pattern = r'title:\s*(.*?),\s*link:'
-    link_pattern = r'link:\s*(https?://\S+)'
-
-    # Extracting titles and links
-    titles = re.findall(title_pattern, results)
-    links = re.findall(link_pattern, results)
+    with timing("tool_web_search"):
+        return web_searcher.searching(query)
 
-    # Combine titles and links
-    results = list(zip(titles, links))
-    random.shuffle(results)
-    # print(len(results))
-    return results[:4]
+async def asearching_web(query: str) -> list:
+    """
+    Asynchronous version of `searching_web`, used when the agent runs on the event loop.
+    """
+    with timing("tool_web_search"):
+        return await web_searcher.asearching(query)
 
 
 # Creating a structured tool from the searching_web function
 web_search = StructuredTool.from_function(
     func=searching_web,
+    coroutine=asearching_web,
     name="Web Searching",
     description="A tool for handling queries not related to topic of the pdf file.",
     args_schema=SearchingWeb,
@@ -137,61 +205,262 @@ web_search = StructuredTool.from_function(
 # Initialize the agent with the tool
 tools = [greeting, db_calling, web_search]
 
-app = FastAPI()
+# Timing every llm call of the agent and every ReAct iteration, the agent runnable being named "react_iteration"
+agent_callbacks = [TimingCallbackHandler(llm_stage="agent_llm", chain_stages={"react_iteration"})]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Startup of the worker, the endpoints of `router` answer "503 Service Unavailable" until it is ready
+readiness = Readiness()
+
+# Endpoints answering as soon as the worker accepts connections: probes and metrics
+probes = APIRouter()
+
+router = APIRouter(dependencies=[Depends(readiness.requiring)])
+
+# Identical questions asked at the same time by several users share a single routing, agent and tool call
+coalesced_answers = AsyncSingleFlight("agent_answer")
+coalesced_streams = AsyncSingleFlight("agent_answer_stream")
+
+def coalescing_key(query, proffesion, document_id):
+    """
+    Returns the key under which identical concurrent queries are coalesced, see `utils.singleflight.query_key`. The
+    document version is the one the API stored for the document, so queries never share an answer across uploads.
+    """
+    return query_key(query, proffesion, document_id, shared_store.document_version(document_id))
+
+@probes.get("/metrics")
+def metrics():
+    """
+    FastAPI endpoint exposing the stage latencies, request latencies and event counters in the Prometheus format.
+    """
+    
+    body, content_type = exporting_metrics()
+    return Response(content=body, media_type=content_type)
 
-@app.get("/to_agent")
-async def root(query: str, proffesion: str):
+@probes.get("/healthz")
+def healthz():
+    """
+    FastAPI liveness probe, failing only if the worker could not create its clients.
+    """
+    
+    return JSONResponse(content=readiness.status(), status_code=500 if readiness.state == "failed" else 200)
+
+@probes.get("/readyz")
+def readyz():
+    """
+    FastAPI readiness probe, succeeding once the clients of the worker are created and warmed up.
+    """
+    
+    return JSONResponse(content=readiness.status(), status_code=200 if readiness.is_ready else 503)
+
+@router.get("/to_agent")
+async def root(query: str, proffesion: str, document_id: Optional[str] = None):
     """
     FastAPI endpoint to handle GET requests and return a generated response for a user's query.
 
     Args:
         query (str): The query string input from the user, passed as a path parameter in the API request.
+        document_id (str, optional): The document or session the query is about. Default is None.
 
     Returns:
         dict: A dictionary containing the response generated from the query.
     """
     
-    print("User_query : " + query)
-    response = agent_executor.invoke({"input": query, "proffesion": proffesion, "description": description})
-    return response
+    logging_event("query", sampled=True, endpoint="/to_agent", query=query, document_id=document_id)
+    return await coalesced_answers.doing(coalescing_key(query, proffesion, document_id),
+                                         lambda: answering(query, proffesion, document_id))
+
+async def answering(query, proffesion, document_id):
+    """
+    Answers a user's query with the tool its intent routes to, or with the agent.
+
+    Args:
+        query (str): The user's input query.
+        proffesion (str): The user's profession.
+        document_id (str | None): The document or session the query is about.
+
+    Returns:
+        dict: The input, profession, document description and output of the agent.
+    """
+    current_document_id.set(document_id)
+    description = shared_store.description(document_id) or ""
+
+    # Answering obvious queries with their tool directly, without the agent's llm calls
+    route = await routing_query(query, document_id)
+    if route == "Greetings":
+        output = GREETING_REPLY
+    elif route == "Database Call":
+        output = await acalling_database(query)
+    elif route == "Web Searching":
+        output = await web_search.ainvoke(query)
+    else:
+        return await agent_executor.ainvoke({"input": query, "proffesion": proffesion, "description": description},
+                                            config={"callbacks": agent_callbacks})
+
+    return {"input": query, "proffesion": proffesion, "description": description, "output": output}
+
+async def routing_query(query, document_id):
+    """
+    Picks the tool for queries whose intent is obvious, falling back to the agent whenever the router fails.
+
+    Args:
+        query (str): The user's input query.
+        document_id (str | None): The document or session the query is about.
+
+    Returns:
+        str | None: The name of the tool answering the query, or None to let the agent decide.
+    """
+    try:
+        with timing("routing"):
+            route = await intent_router.routing(query, document_id)
+    except Exception as e:
+        counting("routing_failed")
+        logging_event("routing_failed", level=logging.WARNING, query=query, error=str(e))
+        return None
+
+    counting(f"route_{(route or 'Agent').lower().replace(' ', '_')}")
+    return route
+
+async def streaming_agent_response(query, proffesion, document_id=None):
+    """
+    Runs the agent for a user's query and yields the response as Server-Sent Events while it is being generated.
+
+    Every tool of the agent returns its result directly, so the agent plans a single step. Instead of waiting for
+    the whole step, the answer is streamed from the tool: the Vector Database answer is relayed from the streaming
+    endpoint of the API and greetings are streamed straight from the llm.
+
+    Args:
+        query (str): The user's input query.
+        proffesion (str): The user's profession.
+        document_id (str, optional): The document or session the query is about. Default is None.
+
+    Yields:
+        str: Formatted "token", "resources" or "error" events, followed by a "done" event.
+    """
+    current_document_id.set(document_id)
+
+    try:
+        route = await routing_query(query, document_id)
+        if route:
+            # Obvious queries go straight to their tool, with the query itself as the tool input
+            step = AgentAction(tool=route, tool_input=query, log="")
+        else:
+            step = await agent.ainvoke({
+                "input": query,
+                "proffesion": proffesion,
+                "description": shared_store.description(document_id) or "",
+                "intermediate_steps": [],
+            }, config={"callbacks": agent_callbacks})
+
+        if route == "Greetings":
+            yield formatting_event("token", {"text": GREETING_REPLY})
+        elif isinstance(step, AgentFinish):
+            yield formatting_event("token", {"text": step.return_values["output"]})
+        elif step.tool == "Database Call":
+            # Relaying the answer of the API piece by piece as it is generated
+            with timing("tool_database_call"):
+                async with getting_http_client().stream("GET", f"{API_URL}/get_response_stream", params=database_params(step.tool_input)) as response:
+                    # An API which is not ready or rejects the query answers with an error status and no events, it is
+                    # reported as an "error" event instead of an empty answer
+                    response.raise_for_status()
+                    async for event, data in aparsing_events(response.aiter_lines()):
+                        if event in ("token", "error"):
+                            yield formatting_event(event, data)
+        elif step.tool == "Greetings":
+            with timing("tool_greetings"):
+                async for piece in llm.astream(step.tool_input):
+                    yield formatting_event("token", {"text": piece})
+        else:
+            results = await web_search.ainvoke(step.tool_input)
+            yield formatting_event("resources", {"items": [list(result) for result in results]})
+    except Exception as e:
+        logging_event("agent_failed", level=logging.ERROR, query=query, document_id=document_id, error=str(e))
+        yield formatting_event("error", {"message": str(e)})
+
+    yield formatting_event("done", {})
+
+@router.get("/to_agent_stream")
+async def stream_root(query: str, proffesion: str, document_id: Optional[str] = None):
+    """
+    FastAPI endpoint to handle GET requests and stream the response for a user's query as Server-Sent Events.
+
+    Args:
+        query (str): The query string input from the user, passed as a path parameter in the API request.
+        document_id (str, optional): The document or session the query is about. Default is None.
+
+    Returns:
+        StreamingResponse: A `text/event-stream` of "token" events carrying the answer text as it is generated, or a
+        "resources" event with (title, link) pairs for unrelated queries, followed by a "done" event.
+    """
+    
+    logging_event("query", sampled=True, endpoint="/to_agent_stream", query=query, document_id=document_id)
+    events = coalesced_streams.streaming(coalescing_key(query, proffesion, document_id),
+                                         lambda: streaming_agent_response(query, proffesion, document_id))
+    return StreamingResponse(events, media_type="text/event-stream")
 
 class DescriptionRequest(BaseModel):
     description: str
+    document_id: Optional[str] = None
 
-@app.post("/send_desc")
+@router.post("/send_desc")
 def send_desc(request: DescriptionRequest):
     """
     FastAPI endpoint to handle POST requests for sending the description of the document to the agent.
 
     Args:
         description (str): The description of the document that will be used by the agent to generate responses.
+        document_id (str, optional): The document the description belongs to.
 
     Returns:
         dict: A dictionary containing the status of the document description process.
     """
     
-    description = request.description
-    print("type(description)", type(description))
-    print("Description : ", description)
+    shared_store.setting_description(request.document_id, request.description)
+    logging_event("description", document_id=request.document_id, description=request.description)
+
+    # Queries about this document are routed by their similarity with its description
+    try:
+        intent_router.setting_document(request.document_id, request.description)
+    except Exception as e:
+        logging_event("description_embedding_failed", level=logging.WARNING, document_id=request.document_id, error=str(e))
+
+def initializing_services():
+    """
+    Loads environment variables and creates the llm, the router, the web searcher and the agent, once in every
+    worker process of the agent when it starts.
+    """
+    global shared_store, llm, intent_router, web_searcher, agent, agent_executor
+
+    from langchain.agents import AgentExecutor, create_react_agent
+    from langchain.prompts import PromptTemplate
+    from langchain_google_genai import GoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 
-if __name__ == "__main__":
-    
     # Loading environment variables from the .env file
     load_dotenv()
+
+    # Writing structured logs to the standard error
+    configuring_logging()
     
-    description = ""
+    # Description of every uploaded document, keyed by document ID and shared by every worker process of the agent
+    shared_store = SharedStore(os.getenv("SHARED_STATE_PATH", "/tmp/rag-shared-state.sqlite"))
 
     # Initializing the Google Generative AI (LLM) model with specific parameters for the agent
     llm = GoogleGenerativeAI(model="gemini-1.5-flash-8b", temperature=0.5)
 
+    # Router answering greetings and clearly related or unrelated queries without the agent
+    intent_router = IntentRouter(
+        GoogleGenerativeAIEmbeddings(model="models/embedding-001"),
+        document_threshold=float(os.getenv("ROUTER_DOCUMENT_THRESHOLD", "0.75")),
+        web_threshold=float(os.getenv("ROUTER_WEB_THRESHOLD", "0.45")),
+        store=shared_store,
+    )
+
+    # Web search for unrelated queries, with a reused client, cached results and a latency budget
+    web_searcher = WebSearcher(
+        creating_search_backend(os.getenv("WEB_SEARCH_BACKEND", "duckduckgo")),
+        timeout=float(os.getenv("WEB_SEARCH_TIMEOUT", "5")),
+        ttl=float(os.getenv("WEB_SEARCH_CACHE_TTL", "3600")),
+    )
+
     # Defining the prompt template for the agent to follow when answering questions
     template = '''Answer the following questions as best you can. You have access to the following tools:
 
@@ -219,11 +488,72 @@ if __name__ == "__main__":
 
     # Initializing an agent that uses the LLM and tools to respond to user queries
     # The tools variable is a list of structured tools that the agent can invoke
-    agent = create_react_agent(llm, tools, prompt)
+    agent = create_react_agent(llm, tools, prompt).with_config(run_name="react_iteration")
 
     # The agent_executor is responsible for executing the agent and managing tool usage
     agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
 
+def warming_up():
+    """
+    Opens the connections of the clients and loads what they load on first use, with a tiny embedding and llm call,
+    so that the first requests are not slower than the next ones.
+    """
+    intent_router.embeddings.embed_query("Hello")
+    llm.invoke("Reply with OK.")
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Initializes the services in the background when a worker process starts, and warms them up unless `WARM_UP` is
+    "0". The services are not initialized when they were set up already, e.g. by the benchmarks. The pooled
+    connections of the shared HTTP client are closed when the worker stops.
+    """
+    if app.state.initializing:
+        readiness.starting(initializing_services, warming_up if os.getenv("WARM_UP", "1") == "1" else None)
+    else:
+        readiness.marking_ready()
+    yield
+    if http_client is not None:
+        await http_client.aclose()
+
+def creating_app(initializing=True):
+    """
+    Creates the FastAPI application of the agent. Every worker process creates its own, so the agent may be served
+    by `uvicorn agent:app --workers N` or gunicorn as well as by running this file.
+
+    Args:
+        initializing (bool, optional): Whether the services are initialized when the application starts. Default is True.
+
+    Returns:
+        FastAPI: The application.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.state.initializing = initializing
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.middleware("http")(timing_requests)
+    app.include_router(probes)
+    app.include_router(router)
+    return app
+
+app = creating_app()
+
+if __name__ == "__main__":
+
+    # Loading environment variables from the .env file, the workers load them again when they start
+    load_dotenv()
+
+    # Serving the agent from `AGENT_WORKERS` processes
+    workers = int(os.getenv("AGENT_WORKERS", "1"))
+    preparing_worker_metrics(workers)
+
     # Starting the FastAPI server using Uvicorn, making the app accessible at 0.0.0.0 on port 8080
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    uvicorn.run("agent:app", host="0.0.0.0", port=8080, workers=workers)
@@ -1,254 +1,811 @@
-from fastapi import FastAPI, File
+from fastapi import APIRouter, Depends, FastAPI, File, HTTPException, Request, UploadFile
+from typing import List, Optional
+from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
-import time
+from contextlib import asynccontextmanager
+import functools
+import hashlib
+import logging
 import os
-import requests
-# from utils.getting_web_text import extract_text_from_web
+import re
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from utils.web_crawler import WebCrawler, HttpPageCache
+
+# LangChain's integrations, the Pinecone client and the Gemini SDK are imported where they are first used, so a worker
+# accepts connections and answers its probes within a second while its clients are created in the background
+from langchain_core.documents import Document
+
+from utils.local_vector_store import LocalVectorStore
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_client import BatchedEmbeddings
+from utils.incremental_index import syncing_chunks_to_index, waiting_for_vector_count, loading_manifest, content_version, counting_vectors
+from utils.ingestion_jobs import IngestionJobQueue, QueueFullError
+from utils.answer_cache import SemanticAnswerCache
+from utils.sse import formatting_event
+from utils.keyword_index import BM25Index, reciprocal_rank_fusion
+from utils.context_packing import packing_context
+from utils.chunking import Chunker
+from utils.shared_state import DEFAULT_NAMESPACE, FileLock, SharedStore
+from utils.readiness import Readiness
+from utils.singleflight import SingleFlight, query_key
+from utils.telemetry import configuring_logging, counting, exporting_metrics, logging_event, observing, preparing_worker_metrics, timing, timing_requests
+
+def creating_chunker():
+    """
+    Creates a chunker sized by the `CHUNK_TOKENS` and `CHUNK_OVERLAP_TOKENS` environment variables, 256 and 32 tokens
+    by default.
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_pinecone import PineconeVectorStore
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, GoogleGenerativeAI
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.prompts import PromptTemplate
+    Returns:
+        Chunker: A chunker counting the documents it divides.
+    """
+    return Chunker(chunk_tokens=int(os.getenv("CHUNK_TOKENS", "256")),
+                   overlap_tokens=int(os.getenv("CHUNK_OVERLAP_TOKENS", "32")))
 
-def chunk_document(document, chunk_size=500, chunk_overlap=50):
+def chunk_document(document, chunker=None):
     """
-    Divides the document into smaller, overlapping chunks for better processing efficiency.
+    Divides the document into smaller, overlapping chunks for better processing efficiency, on sentence and paragraph
+    boundaries.
 
     Args:
         document (list): A list of fetched content from document.
-        chunk_size (int, optional): The maximum number of words ia a chunk. Default is 300.
-        chunk_overlap (int, optional): The number of overlapping words between consecutive chunks. Default is 50.
+        chunker (Chunker, optional): The chunker to use, e.g. to add up the throughput of every page of a document.
+            Default is None, for a new chunker from `creating_chunker`.
 
     Returns:
-        list: A list of document chunks, where each chunk is a Documentof content with the specified size and overlap.
+        list: A list of document chunks, where each chunk is a Document keeping the metadata of its page.
     """
-    
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    chunks = text_splitter.split_documents(document)
+    chunker = chunker or creating_chunker()
+    chunks = chunker.splitting(document)
     return chunks
 
-# def chunk_article(extracted_text, chunk_size=500, chunk_overlap=50):
-#     """
-#     Divides the article text into smaller, overlapping chunks for better processing efficiency.
-
-#     Args:
-#         extracted_text (str): The extracted text content from the article URL.
-#         chunk_size (int, optional): The maximum number of words in a chunk. Default is 300.
-#         chunk_overlap (int, optional): The number of overlapping words between consecutive chunks. Default is 50.
-
-#     Returns:
-#         list: A list of article chunks, where each chunk is a Documentof content with the specified size and overlap.
-#     """
-    
-#     text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-#     chunks = text_splitter.split_text(extracted_text)
-#     return chunks
-
 def creating_pinecone_index(embedding):
     """
     Creates a Pinecone index using the provided embedding model.
 
+    The `VECTOR_STORE_BACKEND` environment variable selects the backend. It defaults to "pinecone"; "local" keeps
+    the vectors in an in-process, memory-mapped index stored under `LOCAL_INDEX_DIR` instead, whose searches scan
+    embeddings quantized as set by `VECTOR_QUANTIZATION` ("int8" or "binary") and rescore the best
+    `RESCORE_FACTOR` candidates per result exactly.
+
     Args:
         embedding (object): The embedding model or function used to generate vector embeddings.
 
     Returns:
-        PineconeVectorStore: An instance of Pinecone index where the vectors can be processed.
+        PineconeVectorStore | LocalVectorStore: An instance of the index where the vectors can be processed.
     """
     
+    if os.getenv("VECTOR_STORE_BACKEND", "pinecone").lower() == "local":
+        return LocalVectorStore(embedding=embedding, directory=os.getenv("LOCAL_INDEX_DIR", "/tmp/rag-local-index"),
+                                quantization=os.getenv("VECTOR_QUANTIZATION") or None,
+                                rescore_factor=int(os.getenv("RESCORE_FACTOR", "10")))
+
+    from langchain_pinecone import PineconeVectorStore
+
     index = PineconeVectorStore(embedding=embedding)
     return index
 
-def uploading_document_to_pinecone(directory):
+def uploading_document_to_pinecone(directory, document_id=None, progress=None, description=None):
     """
     Uploads a document from a specified directory to the Pinecone index after processing and chunking the content.
 
     Args:
         directory (str): The file path of the PDF document that will be uploaded to Pinecone.
+        document_id (str, optional): The namespace of the index the document is stored in. Default is None.
+        progress (callable, optional): Called with a stage name and a count as the ingestion advances. Default is None.
+        description (str, optional): The description of the document if it is already known, e.g. from an earlier
+            upload of the same file, instead of generating it. Default is None.
 
     Returns:
-        None: This function does not return any value.
+        str: The generated description of the uploaded document.
     """
-    print("Loading PDF : ", directory)
-    pdf_loader = PyPDFLoader(directory)
-    document = pdf_loader.load()
+    from utils.pdf_pipeline import streaming_pdf_pages
 
-    # Replacing newline characters with spaces
-    for chunk in document:
-        chunk.page_content = chunk.page_content.replace('\n', ' ')
-    
-    # Dividing document content into chunks
-    chunked_data = chunk_document(document)
+    logging_event("pdf_loading", path=directory, document_id=document_id)
+
+    # Pages are extracted by worker processes and chunked as they arrive, so the chunks of the first pages are
+    # embedded and uploaded while later pages are still being parsed
+    pages = iter(streaming_pdf_pages(directory, max_workers=int(os.getenv("PDF_PARSE_WORKERS", "0")) or None))
+    chunker = creating_chunker()
+
+    def chunking_pages():
+        while True:
+            # Measuring the time spent waiting for the parsing workers
+            with timing("pdf_parse"):
+                page = next(pages, None)
+            if page is None:
+                logging_event("chunked", document_id=document_id, **chunker.throughput())
+                return
+
+            if progress:
+                progress("pages_parsed", 1)
+            # Dividing page content into chunks
+            with timing("chunking"):
+                chunks = chunk_document([page], chunker)
+            yield from chunks
+
+    chunked_data = chunking_pages()
 
-    print("Deleting file")
-    try:
-        # Deleting all existing data on Pinecone index
-        pinecone_index.delete(delete_all=True)
-        time.sleep(6)
-    except:
-        print("Namespace is already empty")
-    
-    print("Uploading File to Pinecone")
-    
-    # Uploading the chunked data to Pinecone index
-    pinecone_index.from_documents(chunked_data, embedding, index_name=index_name)
-    print("Document Uploaded to Pinecone")
-    time.sleep(10)
     prompt = "What is the Title of the document and a small description of the content."
-    description = response_generator(query = prompt, profession="Student")
+    return indexing_chunks(chunked_data, document_id, prompt, progress=progress, description=description)
+
+def uploading_articles_to_pinecone(urls, document_id=None, max_pages=None, progress=None):
+    """
+    Uploads the text of web articles to the Pinecone index after fetching, extracting and chunking them.
+
+    Pages are fetched concurrently, and pages fetched before are only revalidated with the server: an unchanged page
+    is not downloaded again and its chunks, already indexed, are not embedded again.
+
+    Args:
+        urls (list): The URLs of the articles.
+        document_id (str, optional): The namespace of the index the articles are stored in. Default is None.
+        max_pages (int, optional): The maximum number of pages to ingest, following the links of the given pages
+            when it is higher than their number. Default is None.
+        progress (callable, optional): Called with a stage name and a count as the ingestion advances. Default is None.
+
+    Returns:
+        str: The generated description of the uploaded articles.
+    """
+    logging_event("articles_loading", urls=urls, document_id=document_id)
+    pages = crawler.crawling(urls, max_pages=max_pages, progress=progress)
+
+    failed = [page for page in pages if page["status"] == "failed"]
+    for page in failed:
+        logging_event("article_failed", level=logging.WARNING, url=page["url"], error=page["error"])
+
+    pages = [page for page in pages if page["status"] != "failed" and page["text"]]
+    if not pages:
+        reason = f"{failed[0]['url']}: {failed[0]['error']}" if failed else ", ".join(urls)
+        raise ValueError(f"No text could be extracted from {reason}")
+
+    # Dividing the text of every changed article into chunks, the unchanged ones are only chunked if their chunks are
+    # not indexed in this namespace yet
+    chunker = creating_chunker()
+    with timing("chunking"):
+        chunked_data = chunk_document([Document(page_content=page["text"], metadata={"source": page["url"]})
+                                       for page in pages if page["status"] != "not_modified"], chunker)
+    logging_event("chunked", document_id=document_id, **chunker.throughput())
+
+    unchanged_sources = {
+        page["url"]: functools.partial(chunk_document, [Document(page_content=page["text"], metadata={"source": page["url"]})], chunker)
+        for page in pages if page["status"] == "not_modified"
+    }
+
+    prompt = "What is the Title of the article and a small description of the content."
+    return indexing_chunks(chunked_data, document_id, prompt, progress=progress, unchanged_sources=unchanged_sources)
+
+def indexing_chunks(chunked_data, document_id, prompt, progress=None, description=None, unchanged_sources=None):
+    """
+    Stores the chunks of a document in its namespace of the Pinecone index and describes the indexed document.
+
+    Args:
+        chunked_data (iterable): The Document chunks of the document.
+        document_id (str | None): The namespace of the index the document is stored in.
+        prompt (str): The query asking for the description of the document.
+        progress (callable, optional): Called with a stage name and a count as the ingestion advances. Default is None.
+        description (str, optional): The description of the document if it is already known. Default is None.
+        unchanged_sources (dict, optional): The sources of the document which did not change since it was last
+            indexed, mapped to a function returning their chunks, see `syncing_chunks_to_index`. Default is None.
+
+    Returns:
+        str: The generated description of the document.
+    """
+    # Ingestion jobs updating the same document take turns, different documents are updated in parallel
+    with locking_namespace(document_id):
+        # Upserting only the chunks which are not indexed yet and deleting the ones the document no longer contains
+        with timing("index_sync"):
+            stats = syncing_chunks_to_index(pinecone_index, chunked_data, manifest_path=manifest_path(document_id), namespace=document_id,
+                                            batch_size=int(os.getenv("UPSERT_BATCH_SIZE", "400")), progress=progress,
+                                            keyword_index=keyword_index, unchanged_sources=unchanged_sources)
+        logging_event("document_indexed", document_id=document_id, **stats)
+
+        # Waiting until the index serves the new version of the document instead of sleeping for a fixed time
+        with timing("index_wait"):
+            waiting_for_vector_count(pinecone_index, stats["total"], namespace=document_id)
+
+        # Answers cached for an earlier version of the document are no longer valid, the version is shared with the
+        # other workers so that none of them serves answers about the earlier version
+        if document_version(document_id) != stats["version"]:
+            answer_cache.invalidate(document_id)
+        shared_store.setting_document_version(document_id, stats["version"])
+
+        if description is None:
+            description = response_generator(query = prompt, profession="Student", document_id=document_id)
     return description
 
-# def uploading_article_to_pinecone(url):
-#     extracted_text = extract_text_from_web(url)
+def manifest_path(document_id):
+    """
+    Returns the path of the manifest listing the chunk IDs stored in the namespace of a document.
 
-#     chunked_data = chunk_article(extracted_text)
+    Args:
+        document_id (str | None): The namespace of the document, None for the default namespace.
 
-#     print("Deleting file")
-#     try:
-#         # Deleting all existing data on Pinecone index
-#         pinecone_index.delete(delete_all=True)
-#         time.sleep(2)
-#     except:
-#         print("Namespace is already empty")
-    
-#     print("Uploading File to Pinecone")
-    
-#     # Uploading the chunked data to Pinecone index
-#     pinecone_index.from_texts(chunked_data, embedding, index_name=index_name)
-#     print("Document Uploaded to Pinecone")
-#     time.sleep(3)
-#     prompt = "What is the Title of the article and a small description of the content."
-#     description = response_generator(prompt, profession="Student")
-#     return description
+    Returns:
+        str: The path of the JSON manifest file.
+    """
+    return os.path.join(os.getenv("INDEX_MANIFEST_DIR", "/tmp/rag-index-manifests"), f"{document_id or DEFAULT_NAMESPACE}.json")
+
+def document_version(document_id):
+    """
+    Returns the content version of a document from the store shared by the workers, reading it from the document's
+    manifest if it was ingested before the store existed.
+
+    Args:
+        document_id (str | None): The namespace of the document, None for the default namespace.
+
+    Returns:
+        str | None: The version of the document, or None if it was never ingested.
+    """
+    version = shared_store.document_version(document_id)
+    if version is None:
+        ids = loading_manifest(manifest_path(document_id))
+        if ids is not None:
+            version = content_version(ids)
+            shared_store.setting_document_version(document_id, version)
+    return version
+
+def locking_namespace(document_id):
+    """
+    Returns the lock serializing the updates of a document's namespace, between the ingestion threads of every
+    worker process.
+
+    Args:
+        document_id (str | None): The namespace of the document, None for the default namespace.
+
+    Returns:
+        FileLock: The lock of the namespace, a file under `INDEX_LOCK_DIR`.
+    """
+    return FileLock(os.path.join(os.getenv("INDEX_LOCK_DIR", "/tmp/rag-index-locks"), f"{document_id or DEFAULT_NAMESPACE}.lock"))
+
+def validating_document_id(document_id):
+    """
+    Rejects document IDs which can not be used as a namespace name.
+
+    Args:
+        document_id (str | None): The document ID sent by the client.
+
+    Raises:
+        HTTPException: If the document ID contains anything else than letters, digits, '-' and '_', or is the name
+            the files of the default namespace are stored under.
+    """
+    if document_id is not None and not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", document_id):
+        raise HTTPException(status_code=400, detail="document_id may only contain letters, digits, '-' and '_'")
+    if document_id == DEFAULT_NAMESPACE:
+        raise HTTPException(status_code=400, detail=f"document_id can not be {DEFAULT_NAMESPACE!r}")
+
+def ingesting_document(directory, document_id, sha256=None, description=None, progress=None):
+    """
+    Runs the whole ingestion of an uploaded PDF as a background job and shares the resulting description with the agent.
+
+    Args:
+        directory (str): The temporary file path of the uploaded PDF document, removed once the ingestion finishes.
+        document_id (str): The namespace of the index the document is stored in.
+        sha256 (str, optional): The SHA-256 of the file, recorded so that later uploads of the same file are not
+            ingested again. Default is None.
+        description (str, optional): The description of an earlier upload of the same file, reused instead of
+            generating it again. Default is None.
+        progress (callable, optional): Called with a stage name and a count as the ingestion advances. Default is None.
+
+    Returns:
+        str: The generated description of the uploaded document.
+    """
+    try:
+        description = uploading_document_to_pinecone(directory, document_id=document_id, progress=progress, description=description)
+    finally:
+        os.remove(directory)
+
+    if sha256:
+        shared_store.setting_upload(sha256, document_id, document_version(document_id), description)
+
+    sharing_description(document_id, description)
+    return description
+
+def sharing_description(document_id, description):
+    """
+    Stores the description of an indexed document in the store shared with the agent, which describes the document
+    to its llm and routes queries by their similarity with it.
+
+    Args:
+        document_id (str | None): The namespace of the document.
+        description (str): The generated description of the document.
+    """
+    shared_store.setting_description(document_id, description)
+    logging_event("description", document_id=document_id, description=description)
+
+def ingesting_articles(urls, document_id, max_pages=None, progress=None):
+    """
+    Runs the whole ingestion of web articles as a background job and shares the resulting description with the agent.
 
-def retrieve_response_from_pinecone(query, k=5):
+    Args:
+        urls (list): The URLs of the articles.
+        document_id (str): The namespace of the index the articles are stored in.
+        max_pages (int, optional): The maximum number of pages to ingest, see `uploading_articles_to_pinecone`. Default is None.
+        progress (callable, optional): Called with a stage name and a count as the ingestion advances. Default is None.
+
+    Returns:
+        str: The generated description of the uploaded articles.
+    """
+    description = uploading_articles_to_pinecone(urls, document_id=document_id, max_pages=max_pages, progress=progress)
+
+    sharing_description(document_id, description)
+    return description
+
+def retrieve_response_from_pinecone(query, k=5, document_id=None, query_vector=None):
     """
     Retrieves the most similar responses from the Pinecone index based on the given query.
 
+    The vector search runs concurrently with a BM25 keyword search over the same chunks, and both rankings are
+    merged with reciprocal rank fusion, so exact terms missed by the embeddings still make it into the results.
+
     Args:
         query (str): The input query used to search the Pinecone index for vectors.
         k (int, optional): Indicates top results to choose. Default is 5.
+        document_id (str, optional): The namespace of the document to search. Default is None.
+        query_vector (list, optional): The already computed embedding of the query. Default is None.
 
     Returns:
         list: A list of results containing the most similar vectors from the Pinecone index.
     """
     
-    results = pinecone_index.similarity_search(query, k=k)
+    def searching_vectors():
+        with timing("vector_search"):
+            if query_vector is not None:
+                return pinecone_index.similarity_search_by_vector(query_vector, k=k, namespace=document_id)
+            return pinecone_index.similarity_search(query, k=k, namespace=document_id)
+
+    with timing("retrieval"):
+        vector_search = retrieval_pool.submit(searching_vectors)
+
+        # Scoring the keywords locally while the vector search is in flight
+        with timing("keyword_search"):
+            keyword_results = keyword_index.search(query, k=k, namespace=document_id)
+
+        results = reciprocal_rank_fusion([vector_search.result(), keyword_results], k=k)
     return results
 
-def response_generator(query, profession):
+def streaming_response_generator(query, profession, document_id=None):
     """
     Generates a response to the given query by retrieving relevant information from the Pinecone index and invoking 
-    a processing chain with llm.
+    a processing chain with llm, yielding the response piece by piece as the llm produces it.
+
+    Answers are cached by the embedding of the query, so a repeated or paraphrased question about the same version
+    of the document is answered from the cache.
 
     Args:
         query (str): The user's input or question that will be used to retrieve relevant information and generate a response.
+        profession (str): The user's profession, used to tailor the response.
+        document_id (str, optional): The namespace of the document the answer is retrieved from. Default is None.
 
-    Returns:
-        str: The generated response to the query, either based on the retrieved information or an error messageif the process fails.
+    Yields:
+        str: The next piece of the generated response, or an error message if the process fails.
     """
     
     try:
-        results = retrieve_response_from_pinecone(query)
-        print("results", results)
-
-        # Generating a response by invoking the chain with retrieved content and the original query
-        answer = chain.invoke(input={"proffesion": profession, "context": results, "user_query": query})
+        # Embedding the query once, for both the cache lookup and the retrieval
+        query_vector = embedding.embed_query(query)
+        version = document_version(document_id)
+
+        answer = answer_cache.lookup(query_vector, document_id, version, profession)
+        if answer is not None:
+            counting("answer_cache_hit")
+            yield answer
+            return
+        counting("answer_cache_miss")
+
+        results = retrieve_response_from_pinecone(query, document_id=document_id, query_vector=query_vector)
+
+        # Merging overlapping chunks and dropping repeated ones, within the prompt token budget
+        with timing("context_packing"):
+            results = packing_context(results, token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000")))
+        logging_event("context", sampled=True, document_id=document_id, query=query,
+                      sources=[(result.metadata.get("source"), result.metadata.get("page")) for result in results],
+                      characters=sum(len(result.page_content) for result in results))
+
+        # Generating a response by streaming the chain with retrieved content and the original query
+        pieces = []
+        with timing("llm_generation"):
+            started = time.perf_counter()
+            for piece in chain.stream(input={"proffesion": profession, "context": results, "user_query": query}):
+                if not pieces:
+                    observing("llm_first_token", time.perf_counter() - started)
+                pieces.append(piece)
+                yield piece
+
+        answer_cache.store(query_vector, "".join(pieces), document_id, version, profession)
     except Exception as e:
+        counting("answer_failed")
+        logging_event("answer_failed", level=logging.ERROR, document_id=document_id, query=query, error=str(e))
         # Returning an error message if any exception occurs
-        answer = f"Sorry, I am unable to find the answer to your query. Please try again later. The error is {e}"
+        yield f"Sorry, I am unable to find the answer to your query. Please try again later. The error is {e}"
+
+def response_generator(query, profession, document_id=None):
+    """
+    Generates the complete response to the given query, see `streaming_response_generator`.
+
+    Args:
+        query (str): The user's input or question that will be used to retrieve relevant information and generate a response.
+        profession (str): The user's profession, used to tailor the response.
+        document_id (str, optional): The namespace of the document the answer is retrieved from. Default is None.
+
+    Returns:
+        str: The generated response to the query, either based on the retrieved information or an error messageif the process fails.
+    """
     
-    return answer
+    return "".join(streaming_response_generator(query, profession, document_id=document_id))
+
+# Startup of the worker, the endpoints of `router` answer "503 Service Unavailable" until it is ready
+readiness = Readiness()
+
+# Endpoints answering as soon as the worker accepts connections: probes and metrics
+probes = APIRouter()
 
-app = FastAPI()
+router = APIRouter(dependencies=[Depends(readiness.requiring)])
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Identical questions asked at the same time by several users share a single retrieval and llm call
+coalesced_answers = SingleFlight("answer")
+coalesced_streams = SingleFlight("answer_stream")
 
-@app.get("/get_response")
-def root(query: str, proffesion: str):
+@probes.get("/metrics")
+def metrics():
+    """
+    FastAPI endpoint exposing the stage latencies, request latencies and event counters in the Prometheus format.
+    """
+    
+    body, content_type = exporting_metrics()
+    return Response(content=body, media_type=content_type)
+
+@probes.get("/healthz")
+def healthz():
+    """
+    FastAPI liveness probe, failing only if the worker could not create its clients.
+    """
+    
+    return JSONResponse(content=readiness.status(), status_code=500 if readiness.state == "failed" else 200)
+
+@probes.get("/readyz")
+def readyz():
+    """
+    FastAPI readiness probe, succeeding once the clients of the worker are created and warmed up.
+    """
+    
+    return JSONResponse(content=readiness.status(), status_code=200 if readiness.is_ready else 503)
+
+@router.get("/get_response")
+def root(query: str, proffesion: str, document_id: Optional[str] = None):
     """
     FastAPI endpoint to handle GET requests and return a generated response for a user's query.
 
     Args:
         query (str): The query string input from the user, passed as a path parameter in the API request.
+        document_id (str, optional): The document or session whose namespace is searched. Default is None.
 
     Returns:
         dict: A dictionary containing the response generated from the query.
     """
     
-    print("User_query : " + query)
-    answer = response_generator(query, proffesion)
+    logging_event("query", sampled=True, endpoint="/get_response", query=query, document_id=document_id)
+    validating_document_id(document_id)
+    key = query_key(query, proffesion, document_id, document_version(document_id))
+    answer = coalesced_answers.doing(key, lambda: response_generator(query, proffesion, document_id=document_id))
     return JSONResponse(content={"answer": answer})
 
-@app.post("/upload_document")
-def upload_document(file_bytes: bytes = File(...)):
+@router.get("/get_response_stream")
+def stream_root(query: str, proffesion: str, document_id: Optional[str] = None):
+    """
+    FastAPI endpoint to handle GET requests and stream the generated response for a user's query as Server-Sent Events.
+
+    Args:
+        query (str): The query string input from the user, passed as a path parameter in the API request.
+        document_id (str, optional): The document or session whose namespace is searched. Default is None.
+
+    Returns:
+        StreamingResponse: A `text/event-stream` of "token" events carrying the response text as it is generated,
+        followed by a "done" event.
+    """
+    
+    logging_event("query", sampled=True, endpoint="/get_response_stream", query=query, document_id=document_id)
+    validating_document_id(document_id)
+    key = query_key(query, proffesion, document_id, document_version(document_id))
+
+    def events():
+        for piece in coalesced_streams.streaming(key, lambda: streaming_response_generator(query, proffesion, document_id=document_id)):
+            yield formatting_event("token", {"text": piece})
+        yield formatting_event("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@router.post("/upload_document")
+async def upload_document(file_bytes: UploadFile = File(...), document_id: Optional[str] = None):
     """
     FastAPI endpoint to handle POST requests for uploading a document to the Pinecone index.
 
     Args:
-        file_bytes (bytes): The byte data of the document file that will be uploaded to the Pinecone index.
+        file_bytes (UploadFile): The document file that will be uploaded to the Pinecone index, copied to disk piece
+            by piece.
+        document_id (str, optional): The document or session namespace the file replaces. Default is None, a new
+            namespace is created.
+
+    Returns:
+        dict: A dictionary containing the ID of the ingestion job, to be polled on `/upload_status/{job_id}`, and the
+        ID of the document to be passed along with queries. When the namespace already holds the same file, the
+        status is "indexed" and the description of the document is returned instead of a job.
+    """
+    
+    validating_document_id(document_id)
+
+    async def reading_chunks():
+        while chunk := await file_bytes.read(1024 * 1024):
+            yield chunk
+
+    return submitting_document(*await receiving_upload(reading_chunks()), document_id)
+
+@router.post("/upload_document_stream")
+async def upload_document_stream(request: Request, document_id: Optional[str] = None, sha256: Optional[str] = None):
+    """
+    FastAPI endpoint to handle POST requests for uploading a document sent as the raw request body, usually in
+    chunked transfer encoding, which is written to disk as it arrives instead of being held in memory.
+
+    Args:
+        document_id (str, optional): The document or session namespace the file replaces. Default is None, a new
+            namespace is created.
+        sha256 (str, optional): The SHA-256 of the file computed by the client, checked against the received bytes.
+            Default is None.
 
     Returns:
-        dict: A dictionary containing the status of the document upload process.
+        dict: The same as `/upload_document`.
     """
     
+    validating_document_id(document_id)
+    path, received_sha256 = await receiving_upload(request.stream())
+
+    if sha256 and sha256.lower() != received_sha256:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail="The received file does not match its SHA-256, upload it again")
+    return submitting_document(path, received_sha256, document_id)
+
+@router.get("/uploaded_document/{sha256}")
+def uploaded_document(sha256: str, document_id: str):
+    """
+    FastAPI endpoint to handle GET requests asking whether a document namespace already holds a file, so that
+    clients skip uploading it again. Only the caller's own namespace is looked at, the namespaces of other sessions
+    are never disclosed.
+
+    Args:
+        sha256 (str): The SHA-256 of the file, in hexadecimal.
+        document_id (str): The document or session namespace of the caller.
+
+    Returns:
+        dict: The ID of the document holding the file, to be passed along with queries, and its description.
+    """
+    
+    validating_document_id(document_id)
+    for upload in indexed_uploads(sha256.lower()):
+        if upload["document_id"] == document_id:
+            return {"document_id": document_id, "description": upload["description"]}
+    raise HTTPException(status_code=404, detail="This file is not indexed")
+
+async def receiving_upload(chunks):
+    """
+    Writes an uploaded file to a temporary file as its chunks arrive, hashing it on the way.
+
+    Args:
+        chunks (async iterable): The bytes of the file.
+
+    Returns:
+        tuple: The path of the temporary file and the SHA-256 of its content.
+
+    Raises:
+        HTTPException: If the file is empty or larger than `MAX_UPLOAD_MB` megabytes (default 200).
+    """
+    max_bytes = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+    digest = hashlib.sha256()
+    size = 0
+
+    # Saving the uploaded file under a unique name, so concurrent uploads never overwrite each other
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Files larger than {max_bytes // (1024 * 1024)} MB can not be uploaded")
+                digest.update(chunk)
+                f.write(chunk)
+            if not size:
+                raise HTTPException(status_code=400, detail="The uploaded file is empty")
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+
+    return f.name, digest.hexdigest()
+
+def indexed_uploads(sha256):
+    """
+    Finds the namespaces a file is indexed in, ignoring the ones whose content changed since it was ingested.
+
+    Args:
+        sha256 (str): The SHA-256 of the file.
+
+    Returns:
+        list: The "document_id", "version" and "description" of every upload of the file, most recent first.
+    """
+    return [upload for upload in shared_store.uploads(sha256) if upload["version"] == document_version(upload["document_id"])]
+
+def submitting_document(path, sha256, document_id):
+    """
+    Queues the ingestion job of an uploaded file, unless the namespace already holds the same file.
+
+    When another namespace holds the same file, the file is still indexed in the caller's namespace, so sessions
+    never share a namespace, but its description is reused and its embeddings come from the embedding cache.
+
+    Args:
+        path (str): The temporary file path of the uploaded PDF document.
+        sha256 (str): The SHA-256 of the file.
+        document_id (str | None): The document ID sent by the client.
+
+    Returns:
+        dict: The ID of the ingestion job and the ID of the document, or the description of the document if the
+        namespace already holds the file.
+
+    Raises:
+        HTTPException: If too many jobs are waiting.
+    """
+    document_id = document_id or uuid.uuid4().hex
+
+    uploads = indexed_uploads(sha256)
+    for upload in uploads:
+        if upload["document_id"] == document_id:
+            os.remove(path)
+            counting("upload_deduplicated")
+            return {"document_id": document_id, "status": "indexed", "description": upload["description"]}
+
     try:
+        description = uploads[0]["description"] if uploads else None
+        job_id = ingestion_jobs.submit(ingesting_document, path, document_id, sha256=sha256, description=description)
+        return {"job_id": job_id, "document_id": document_id, "status": "queued"}
+    except QueueFullError as e:
+        os.remove(path)
+        raise HTTPException(status_code=503, detail=str(e))
+
+@router.get("/upload_status/{job_id}")
+def upload_status(job_id: str):
+    """
+    FastAPI endpoint to handle GET requests for the status of a document ingestion job.
 
-        # Ensure the 'uploaded' directory exists
-        # os.makedirs('./uploaded', exist_ok=True)
+    Args:
+        job_id (str): The ID of the ingestion job returned by `/upload_document`.
 
-        # Save the uploaded file
-        with open("/tmp/document.pdf", "wb") as f:
-            f.write(file_bytes)
+    Returns:
+        dict: The job status ("queued", "running", "done" or "failed"), its progress counters (pages_parsed,
+        chunks_embedded, chunks_upserted), the generated description once done or the error if it failed.
+    """
+    
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingestion job")
+    return job
 
-        description = uploading_document_to_pinecone("/tmp/document.pdf")
-        response = requests.post("http://0.0.0.0:8080/send_desc", json={"description": description})
-        return {"status": description}
-    except Exception as e:
-        return {"status": f"Error uploading file: {e}"}
+@router.post("/upload_article")
+def upload_article(url: str, document_id: Optional[str] = None):
+    """
+    FastAPI endpoint to handle POST requests for uploading a web article to the Pinecone index.
 
-# @app.post("/upload_article")
-# def upload_article(url: str):
-#     try:
-#         description = uploading_article_to_pinecone(url)
-#         response = requests.post("http://0.0.0.0:8080/send_desc", files={"description": description})
-#         return {"status": description}
-#     except Exception as e:
-#         return {"status": f"Error uploading file: {e}"}
+    Args:
+        url (str): The URL of the article, fetched and ingested in the background.
+        document_id (str, optional): The document or session namespace the article replaces. Default is None, a new
+            namespace is created.
 
-if __name__ == "__main__":
+    Returns:
+        dict: A dictionary containing the ID of the ingestion job, to be polled on `/upload_status/{job_id}`, and the
+        ID of the document to be passed along with queries.
+    """
+    
+    return submitting_articles([url], document_id)
+
+class ArticlesRequest(BaseModel):
+    urls: List[str]
+    document_id: Optional[str] = None
+    max_pages: Optional[int] = None
+
+@router.post("/upload_articles")
+def upload_articles(request: ArticlesRequest):
     """
-    Initializes the FastAPI server, loads environment variables, creates an embedding model and Pinecone index, 
-    uploads a document for processing, and sets up a language model for generating responses.
+    FastAPI endpoint to handle POST requests for uploading many web articles, or a whole documentation site, to the
+    Pinecone index.
 
-    This block of code performs the following tasks:
+    Args:
+        urls (list): The URLs of the articles, fetched concurrently and ingested in the background.
+        document_id (str, optional): The document or session namespace the articles replace. Default is None, a new
+            namespace is created.
+        max_pages (int, optional): The maximum number of pages to ingest. When higher than the number of URLs, the
+            links of the pages are followed within the same site section. Default is None.
+
+    Returns:
+        dict: A dictionary containing the ID of the ingestion job, to be polled on `/upload_status/{job_id}`, and the
+        ID of the document to be passed along with queries.
+    """
+    
+    return submitting_articles(request.urls, request.document_id, max_pages=request.max_pages)
+
+def submitting_articles(urls, document_id, max_pages=None):
+    """
+    Validates an article upload and queues its ingestion job.
+
+    Args:
+        urls (list): The URLs of the articles.
+        document_id (str | None): The document ID sent by the client.
+        max_pages (int, optional): The maximum number of pages to ingest. Default is None.
+
+    Returns:
+        dict: The ID of the ingestion job and the ID of the document.
+
+    Raises:
+        HTTPException: If a URL or the document ID is invalid, or if too many jobs are waiting.
+    """
+    validating_document_id(document_id)
+    page_limit = int(os.getenv("CRAWLER_MAX_PAGES", "200"))
+    if not urls or len(urls) > page_limit:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {page_limit} URLs may be uploaded at once")
+    for url in urls:
+        if not re.match(r"https?://[^\s/]+", url):
+            raise HTTPException(status_code=400, detail=f"{url!r} is not an http or https URL")
+        try:
+            crawler.validating_url(url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    document_id = document_id or uuid.uuid4().hex
+
+    try:
+        job_id = ingestion_jobs.submit(ingesting_articles, urls, document_id, max_pages=min(max_pages or 0, page_limit) or None)
+        return {"job_id": job_id, "document_id": document_id, "status": "queued"}
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def initializing_services():
+    """
+    Loads environment variables and creates the clients every request relies on, once in every worker process of
+    the API when it starts.
+
+    This function performs the following tasks:
     - Loads environment variables.
     - Initializes the embedding model for document chunking and retrieval.
     - Creates a Pinecone index to store document embeddings.
-    - Uploads a specific PDF document to the Pinecone index for later query-based retrieval.
     - Sets up a language model (LLM) for generating human-like responses.
     - Defines the system prompt and response behavior for the assistant.
     - Sets up a chain that combines document retrieval with response generation.
-    - Starts the FastAPI server on host `0.0.0.0` at port 8000.
+    - Opens the state shared with the other workers and starts the background ingestion workers.
     """
+    global batched_embedding, embedding, pinecone_index, llm, chain, answer_cache, shared_store, keyword_index, retrieval_pool, crawler, ingestion_jobs
+
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings, GoogleGenerativeAI
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain_core.prompts import PromptTemplate
 
     # Loading environment variables from .env file
     load_dotenv()
 
-    # Initializing embedding model for creating document vectors
-    embedding = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+    # Writing structured logs to the standard error
+    configuring_logging()
+
+    # Initializing embedding model for creating document vectors, sending concurrent batches with rate limit aware
+    # retries, behind a persistent cache so re-uploaded chunks are not sent to the embedding API again
+    batched_embedding = BatchedEmbeddings(
+        GoogleGenerativeAIEmbeddings(model="models/embedding-001"),
+        batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "100")),
+        max_concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", "4")),
+    )
+    embedding = CachedEmbeddings(
+        batched_embedding,
+        cache_path=os.getenv("EMBEDDING_CACHE_PATH", "/tmp/rag-embedding-cache.sqlite"),
+        max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000")),
+    )
 
-    # Pinecone index name for storing document embeddings
-    index_name = "rag-chatbot"
+    # Caching every batch as soon as it is embedded, so a failed upload resumes after its last successful batch
+    batched_embedding.on_batch_embedded = embedding.store
 
     # Creating Pinecone index using the embedding model
     pinecone_index = creating_pinecone_index(embedding)
@@ -265,6 +822,96 @@ if __name__ == "__main__":
     # Setting up the document processing chain for response generation based on retrieved documents
     chain = create_stuff_documents_chain(llm, prompt_template, document_variable_name="context")
 
+    # Cache of generated answers, looked up by the similarity of the query embeddings
+    answer_cache = SemanticAnswerCache(
+        threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+        max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024")),
+        ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    )
+
+    # Descriptions, document versions and ingestion jobs, shared by every worker process of the API
+    shared_store = SharedStore(os.getenv("SHARED_STATE_PATH", "/tmp/rag-shared-state.sqlite"))
+
+    # Keyword index searched alongside the vector store
+    keyword_index = BM25Index(directory=os.getenv("BM25_INDEX_DIR", "/tmp/rag-bm25-index"))
+
+    # Threads running the vector searches concurrently with the keyword searches
+    retrieval_pool = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVAL_WORKERS", "16")), thread_name_prefix="retrieval")
+
+    # Concurrent, cache revalidating fetcher of web articles, polite with every host
+    crawler = WebCrawler(
+        HttpPageCache(directory=os.getenv("HTTP_CACHE_DIR", "/tmp/rag-http-cache")),
+        max_workers=int(os.getenv("CRAWLER_WORKERS", "8")),
+        per_host_concurrency=int(os.getenv("CRAWLER_HOST_CONCURRENCY", "2")),
+        per_host_interval=float(os.getenv("CRAWLER_HOST_INTERVAL", "0.5")),
+        timeout=float(os.getenv("ARTICLE_TIMEOUT", "10")),
+        allow_private_hosts=os.getenv("CRAWLER_ALLOW_PRIVATE_HOSTS", "0") == "1",
+    )
+
+    # Background workers for document ingestion, bounded so that uploads never tie up request threads
+    ingestion_jobs = IngestionJobQueue(max_workers=int(os.getenv("INGESTION_WORKERS", "2")), store=shared_store)
+
+def warming_up():
+    """
+    Opens the connections of the clients and loads what they load on first use, with a tiny embedding, index and llm
+    call, so that the first requests are not slower than the next ones.
+    """
+    embedding.embed_query("Hello")
+    counting_vectors(pinecone_index)
+    llm.invoke("Reply with OK.")
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Initializes the services in the background when a worker process starts, and warms them up unless `WARM_UP` is
+    "0". The services are not initialized when they were set up already, e.g. by the benchmarks.
+    """
+    if app.state.initializing:
+        readiness.starting(initializing_services, warming_up if os.getenv("WARM_UP", "1") == "1" else None)
+    else:
+        readiness.marking_ready()
+    yield
+    if "retrieval_pool" in globals():
+        retrieval_pool.shutdown(wait=False)
+
+def creating_app(initializing=True):
+    """
+    Creates the FastAPI application of the API. Every worker process creates its own, so the API may be served by
+    `uvicorn api:app --workers N` or gunicorn as well as by running this file.
+
+    Args:
+        initializing (bool, optional): Whether the services are initialized when the application starts. Default is True.
+
+    Returns:
+        FastAPI: The application.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.state.initializing = initializing
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.middleware("http")(timing_requests)
+    app.include_router(probes)
+    app.include_router(router)
+    return app
+
+app = creating_app()
+
+if __name__ == "__main__":
+
+    # Loading environment variables from .env file, the workers load them again when they start
+    load_dotenv()
+
+    # Serving the API from `API_WORKERS` processes, one per core at most since every worker loads its own clients
+    workers = int(os.getenv("API_WORKERS", "1"))
+    preparing_worker_metrics(workers)
+
     # Starting the FastAPI server with Uvicorn, accessible at 0.0.0.0 on port 8000
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("api:app", host="0.0.0.0", port=8000, workers=workers)
@@ -1,7 +1,11 @@
 import streamlit as st
 import requests
-# from dotenv import load_dotenv
-#from voice import generating_audio
+import hashlib
+import os
+import time
+import uuid
+from utils.sse import parsing_events
+from voice import SpeechStream
 
 def wide_space_default():
     st.set_page_config(layout="wide")
@@ -23,34 +27,155 @@ css_for_text = """
 </style>
 """
 
-@st.cache_data
-def uploading_web_url(url: str):
+def uploading_web_url(urls: list, document_id, max_pages):
+    """
+    Submits web articles for ingestion, every time the form is submitted, so that pages changed since an earlier
+    submission are fetched and indexed again. The response of the last submission is kept for the reruns of the
+    session.
+
+    Args:
+        urls (list): The URLs of the articles.
+        document_id (str): The namespace of the session.
+        max_pages (int): The maximum number of pages to ingest.
+
+    Returns:
+        dict: The response of the server: the ID of the ingestion job, or the error.
+    """
     print("Uploading Web URL...")
-    st.write("I am working on completing this feature, soon it will be finished")
-    #clearing_cache()
-    #response = requests.post(f"http://0.0.0.0:8000/upload_article?url={url}").json()
-    #print("Url : ", url)
-
-@st.cache_data
-def uploading_file(uploaded_file):
-    print("uploaded_file name", uploaded_file.name)
-    files_bytes = uploaded_file.read()
-    print("files_bytes", len(files_bytes))
-    
-    # print("Pdf Uploading by read_doc()")
-    response = requests.post("http://0.0.0.0:8000/upload_document", files={"file_bytes": files_bytes}).json()
-    # st.markdown(response['status'], unsafe_allow_html=True)
+    try:
+        response = requests.post("http://0.0.0.0:8000/upload_articles",
+                                 json={"urls": urls, "document_id": document_id, "max_pages": max_pages}, timeout=30).json()
+    except requests.RequestException as e:
+        response = {"detail": str(e)}
+    print("Urls : ", urls)
+    st.session_state["web_upload"] = response
+    return response
+
+def reading_chunks(uploaded_file, chunk_size=1024 * 1024):
+    """
+    Yields the content of an uploaded file piece by piece, from its beginning.
+    """
+    uploaded_file.seek(0)
+    while chunk := uploaded_file.read(chunk_size):
+        yield chunk
+
+def uploading_file(uploaded_file, document_id):
+    """
+    Uploads a PDF unless the namespace of the session already holds the same file, once per uploaded file of the
+    session.
+
+    The file is identified by its SHA-256, and when it is not indexed yet, it is sent in chunks which the server
+    writes to disk as they arrive, without copying the whole file in memory on either side.
+
+    Args:
+        uploaded_file (UploadedFile): The file selected in the sidebar.
+        document_id (str): The namespace of the session, which the file replaces.
+
+    Returns:
+        dict: The response of the server: the ID of the ingestion job, or an "indexed" status along with the ID and
+        description of the document when the namespace already holds the file.
+    """
+    uploads = st.session_state.setdefault("uploads", {})
+    if uploaded_file.file_id in uploads:
+        return uploads[uploaded_file.file_id]
+
+    print("uploaded_file name", uploaded_file.name, "size", uploaded_file.size)
+    digest = hashlib.sha256()
+    for chunk in reading_chunks(uploaded_file):
+        digest.update(chunk)
+
+    indexed = requests.get(f"http://0.0.0.0:8000/uploaded_document/{digest.hexdigest()}", params={"document_id": document_id})
+    if indexed.status_code == 200:
+        response = {"status": "indexed", **indexed.json()}
+    else:
+        response = requests.post("http://0.0.0.0:8000/upload_document_stream", data=reading_chunks(uploaded_file),
+                                 params={"document_id": document_id, "sha256": digest.hexdigest()},
+                                 headers={"Content-Type": "application/octet-stream"}).json()
+
+    uploads[uploaded_file.file_id] = response
     return response
 
-def clearing_cache():
-    print("Clearing Cache...")
-    uploading_file.clear()
-    print("Cleared Cache")
+def waiting_for_upload(job_id):
+    """
+    Polls the ingestion job of an uploaded document until it finishes, showing its progress meanwhile.
+
+    Args:
+        job_id (str): The ID of the ingestion job returned by the upload endpoint.
+
+    Returns:
+        dict: A dictionary whose "status" is the document description, or the error if the ingestion failed.
+    """
+    finished_uploads = st.session_state.setdefault("finished_uploads", {})
+    if job_id in finished_uploads:
+        return finished_uploads[job_id]
+
+    progress_text = st.empty()
+    # Giving up after UPLOAD_TIMEOUT seconds, in case the job never finishes
+    deadline = time.monotonic() + float(os.getenv("UPLOAD_TIMEOUT", "1800"))
+    while True:
+        if time.monotonic() >= deadline:
+            response = {"status": "Error uploading file: the document is taking too long to be processed, try again later"}
+            break
+        try:
+            job = requests.get(f"http://0.0.0.0:8000/upload_status/{job_id}", timeout=10).json()
+        except requests.RequestException:
+            time.sleep(1)
+            continue
+        if job.get("status") == "done":
+            response = {"status": job["result"]}
+            break
+        if job.get("status") == "failed" or "detail" in job:
+            response = {"status": f"Error uploading file: {job.get('error') or job.get('detail')}"}
+            break
+
+        counters = job["progress"]
+        pages = counters.get("pages_parsed", 0) + counters.get("pages_fetched", 0) + counters.get("pages_not_modified", 0)
+        progress_text.write(f"Processing document ({job['status']}): {pages} pages parsed, "
+                            f"{counters.get('chunks_embedded', 0)} chunks embedded, {counters.get('chunks_upserted', 0)} chunks indexed")
+        time.sleep(1)
+
+    progress_text.empty()
+    finished_uploads[job_id] = response
+    return response
 
 def formatting_answer(answer):
     answer = answer.replace("<h1>", "<h2>").replace("<h1/>", "<h2/>")
     return answer
 
+def is_ready(url):
+    try:
+        return requests.get(url, timeout=2).status_code == 200
+    except requests.RequestException:
+        return False
+
+def waiting_for_services(timeout=120):
+    """
+    Waits until the API and the agent answer their readiness probe, once per session, so the first queries do not
+    fail while the services are still starting.
+
+    Args:
+        timeout (int, optional): The number of seconds to wait before giving up. Default is 120.
+    """
+    if st.session_state.get("services_ready"):
+        return
+
+    with st.spinner("Starting the services..."):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if is_ready("http://0.0.0.0:8000/readyz") and is_ready("http://0.0.0.0:8080/readyz"):
+                st.session_state["services_ready"] = True
+                return
+            time.sleep(1)
+
+    st.error("The services are still starting, please reload the page in a moment.")
+    st.stop()
+
+
+waiting_for_services()
+
+# Every browser session gets its own namespace on the server, re-uploads replace the session's document
+if "document_id" not in st.session_state:
+    st.session_state["document_id"] = uuid.uuid4().hex
 
 # Applying the custom CSS for styling
 st.markdown(css_for_text, unsafe_allow_html=True)
@@ -63,21 +188,39 @@ response = {"status":""}
 with st.sidebar:
     with st.expander("Upload PDF"):
         try:
-            uploaded_file = st.file_uploader("Upload PDF", label_visibility='hidden', type="pdf", key="file", accept_multiple_files=False, on_change=clearing_cache)
+            uploaded_file = st.file_uploader("Upload PDF", label_visibility='hidden', type="pdf", key="file", accept_multiple_files=False)
         except Exception as e:
             print("Error while upladong the document : ", e)
         if uploaded_file is not None:
-            response = uploading_file(uploaded_file)
+            response = uploading_file(uploaded_file, st.session_state["document_id"])
+            if response.get("status") == "indexed":
+                response = {"status": response["description"]}
+            elif "job_id" in response:
+                response = waiting_for_upload(response["job_id"])
+            elif "detail" in response:
+                response = {"status": f"Error uploading file: {response['detail']}"}
             # st.write(response['status'])
     with st.expander("Enter Web URL"):
-        url = st.text_input(label="Press ENTER to submit", placeholder = "https://www.google.com")
-        # st.button("Submit", type="primary", on_click=uploading_web_url, args=[url])
-        if url:
-            st.write(url)
-            uploading_web_url(url)
+        # The articles are only submitted when the form is, not on every rerun of the script
+        with st.form("web_url"):
+            urls = st.text_area(label="One URL per line, press CTRL+ENTER to submit", placeholder = "https://www.google.com")
+            max_pages = st.number_input("Pages to index, links are followed within the site beyond the URLs above", min_value=1, max_value=200, value=1)
+            submitted = st.form_submit_button("Submit", type="primary")
+        urls = [url.strip() for url in urls.splitlines() if url.strip()]
+        web_upload = uploading_web_url(urls, st.session_state["document_id"], int(max_pages)) if submitted and urls else st.session_state.get("web_upload")
+        if web_upload is not None:
+            st.write(", ".join(urls))
+            response = web_upload
+            if "job_id" in response:
+                response = waiting_for_upload(response["job_id"])
+            elif "detail" in response:
+                response = {"status": f"Error uploading article: {response['detail']}"}
 
     proffesions = ["Researcher", "Engineer", "Teacher", "Lawyer", "Student", "Doctor", "Other"]
     proffesion = st.selectbox("Select your Proffesion for better results", proffesions)
+
+    # Answers are read aloud with Sarvam AI when its API key is set
+    speaking = st.toggle("Read the answers aloud", value=bool(os.getenv("SARVAM_API_KEY")))
     
     st.write("This is not a production ready project till yet. I am working on it to make it scalable on a large scale.")
     st.write("Give your valuable feedback at [Linkedin](https://www.linkedin.com/in/dhairya-kalathia) & [Email](https://mail.google.com/mail/u/0/?to=dhairya.kalathia@gmail.com&fs=1&tf=cm)")
@@ -94,45 +237,53 @@ if prompt:
     # Display the user's prompt in the chat with custom CSS styling
     user.markdown(f"<p class='text'>{prompt}</p>", unsafe_allow_html=True)
     try:
-        # Send the user's prompt to the backend API for generating a response
-        response = requests.get(f"http://0.0.0.0:8080/to_agent", params={"query": prompt, "proffesion": proffesion}).json()
-        # print(response['output']['answer'])
-
-        # Check if the API returned a valid response and whether it's a string (text-based)
-        if isinstance(response.get('output', ''), dict):
-            # Extract the response text, clean it up, and display it in the chat
-            output_text = response['output']['answer']
-            # output_text = response.get('output', '')
-            
-            # Generate audio from the assistant's response text
-            # audio_buffer = generating_audio(output_text)
-
-            # Display the assistant's response in the chat with formatting
-            # assistant.markdown(f"<p class='text'>{formatting_answer(output_text)}</p>", unsafe_allow_html=True)
-            assistant.markdown(f"{output_text}", unsafe_allow_html=True)
-
-            # Play the generated audio directly on the Streamlit app
-            # st.audio(audio_buffer, format="audio/wav")
-
-        else:
-            # If the response is not a string, handle it as a list of related articles
-            output_list = response.get('output', '')
-
-            # Display a message that the query is unrelated to the topic
-            assistant.markdown(f"<p class='text'>The query is not related to data you have provided.<br/>"
-                            "So, I would recommend you to go through these articles for more information:</p>", 
-                            unsafe_allow_html=True)
+        # Send the user's prompt to the backend API and stream the generated response
+        params = {"query": prompt, "proffesion": proffesion, "document_id": st.session_state["document_id"]}
+        with requests.get(f"http://0.0.0.0:8080/to_agent_stream", params=params, stream=True) as response:
+            # Placeholder rewritten with the growing answer as its pieces arrive
+            answer_placeholder = assistant.empty()
+            output_text = ""
+
+            # Sentences are synthesized while the rest of the answer is still being generated
+            speech = SpeechStream() if speaking else None
+
+            for event, data in parsing_events(response.iter_lines(decode_unicode=True)):
+                if event == "token":
+                    output_text += data["text"]
+                    answer_placeholder.markdown(f"{output_text}", unsafe_allow_html=True)
+                    if speech:
+                        speech.feeding(data["text"])
+
+                elif event == "resources":
+                    # Display a message that the query is unrelated to the topic
+                    assistant.markdown(f"<p class='text'>The query is not related to data you have provided.<br/>"
+                                    "So, I would recommend you to go through these articles for more information:</p>", 
+                                    unsafe_allow_html=True)
+
+                    # Iterate through the output list and display each article with its title and URL
+                    for title, link in data["items"]:
+
+                        # Clean up the link by removing any trailing commas
+                        link = link.replace(',', '')
+
+                        # Display each article's title and a clickable URL
+                        assistant.markdown(f"<hr/><p class='text'>Title: {title} <br/>"
+                                        f"URL: <a href={link}>{link}</a></p>", 
+                                        unsafe_allow_html=True)
 
-            # Iterate through the output list and display each article with its title and URL
-            for title, link in output_list:
+                elif event == "error":
+                    raise RuntimeError(data["message"])
 
-                # Clean up the link by removing any trailing commas
-                link = link.replace(',', '')
+        if speech and output_text:
+            try:
+                # Generate audio from the rest of the assistant's response text and merge it with the synthesized sentences
+                speech.closing()
+                audio_buffer = speech.merging()
 
-                # Display each article's title and a clickable URL
-                assistant.markdown(f"<hr/><p class='text'>Title: {title} <br/>"
-                                f"URL: <a href={link}>{link}</a></p>", 
-                                unsafe_allow_html=True)
+                # Play the generated audio directly on the Streamlit app
+                assistant.audio(audio_buffer, format="audio/wav", autoplay=True)
+            except Exception as e:
+                assistant.caption(f"The answer could not be read aloud: {e}")
     except Exception as e:
         # Display an error message if the API request fails
         assistant.markdown(f"<p class='text'>Sorry, I couldn't process your request.<br/> There is some problem I am facing right now. Please try again later.</p>", 
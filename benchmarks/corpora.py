@@ -0,0 +1,86 @@
+import os
+import random
+import textwrap
+
+# The text of a scraped web page, shipped with the repository
+WEB_TEXT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "web_text.txt")
+
+
+def loading_web_text():
+    """
+    Returns the text of `web_text.txt`.
+    """
+    with open(WEB_TEXT_PATH, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def making_queries(text, count, words=8, seed=0):
+    """
+    Picks queries out of a text: runs of consecutive words starting at random positions.
+
+    Args:
+        text (str): The corpus.
+        count (int): The number of queries.
+        words (int, optional): The number of words of a query. Default is 8.
+        seed (int, optional): The seed of the random positions. Default is 0.
+
+    Returns:
+        list: The queries.
+    """
+    tokens = text.split()
+    generator = random.Random(seed)
+    starts = [generator.randrange(0, max(1, len(tokens) - words)) for _ in range(count)]
+    return [" ".join(tokens[start:start + words]) for start in starts]
+
+
+def _escaping(line):
+    line = line.encode("latin-1", "replace").decode("latin-1")
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def making_pdf(text, pages, lines_per_page=50, line_width=95):
+    """
+    Builds a PDF document out of a text, filling every page with lines of the text in order and starting over from
+    the beginning of the text when it runs out. Every paragraph of the text, after a blank line, starts a new line.
+
+    Args:
+        text (str): The text of the pages.
+        pages (int): The number of pages.
+        lines_per_page (int, optional): The number of lines of a page. Default is 50.
+        line_width (int, optional): The maximum number of characters of a line. Default is 95.
+
+    Returns:
+        bytes: The PDF document.
+    """
+    lines = [line for paragraph in text.split("\n\n") for line in textwrap.wrap(" ".join(paragraph.split()), width=line_width)]
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * page} 0 R" for page in range(pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    font_id = 3 + 2 * pages
+
+    for page in range(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * page} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode()
+        )
+        operations = []
+        for row in range(lines_per_page):
+            line = lines[(page * lines_per_page + row) % len(lines)]
+            operations.append(f"BT /F1 9 Tf 30 {770 - 15 * row} Td ({_escaping(line)}) Tj ET")
+        stream = "\n".join(operations).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    document = b"%PDF-1.4\n"
+    offsets = []
+    for number, content in enumerate(objects, start=1):
+        offsets.append(len(document))
+        document += f"{number} 0 obj\n".encode() + content + b"\nendobj\n"
+
+    xref = len(document)
+    document += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    document += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    document += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return document
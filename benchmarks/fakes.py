@@ -0,0 +1,120 @@
+import hashlib
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+from utils.keyword_index import tokenizing
+from utils.local_vector_store import LocalVectorStore
+
+# Words the fake llm builds its answers from
+VOCABULARY = (
+    "the document explains how data is processed by the system and why each step matters for the final result "
+    "while the examples show common cases and the limits of the approach in practice"
+).split()
+
+
+class FakeLLM(LLM):
+    """
+    A deterministic stand-in for GoogleGenerativeAI, answering after an injected latency.
+
+    Prompts of the ReAct agent are answered with a call to the Database Call tool for the question of the prompt,
+    every other prompt with `tokens` words derived from the hash of the prompt.
+
+    Attributes:
+        latency (float): The number of seconds before the first token.
+        token_latency (float): The number of seconds between two tokens.
+        tokens (int): The number of words of an answer.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    tokens: int = 40
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    def _words(self, prompt):
+        if "Action Input" in prompt and "Question:" in prompt:
+            question = prompt.rsplit("Question:", 1)[1].split(" and I am", 1)[0].strip()
+            return ["I", "should", "look", "in", "the", "document.\nAction:", "Database", "Call\nAction", "Input:", question]
+
+        seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "big")
+        return [VOCABULARY[(seed + position * 7919) % len(VOCABULARY)] for position in range(self.tokens)]
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        words = self._words(prompt)
+        time.sleep(self.latency + self.token_latency * len(words))
+        return " ".join(words)
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for position, word in enumerate(self._words(prompt)):
+            if position:
+                time.sleep(self.token_latency)
+            chunk = GenerationChunk(text=(" " if position else "") + word)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    A deterministic stand-in for GoogleGenerativeAIEmbeddings: every text is embedded as its hashed bag of words, so
+    texts sharing words are similar, after an injected latency.
+
+    Attributes:
+        size (int): The number of dimensions of the embeddings.
+        latency (float): The number of seconds of every call.
+        per_text_latency (float): The number of seconds added to a call for every embedded text.
+    """
+
+    def __init__(self, size=768, latency=0.0, per_text_latency=0.0):
+        self.size = size
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+
+    def _embedding(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in tokenizing(text):
+            vector[int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest(), "big") % self.size] += 1.0
+        if not vector.any():
+            vector[0] = 1.0
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        return [self._embedding(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency + self.per_text_latency)
+        return self._embedding(text)
+
+
+class FakePineconeVectorStore(LocalVectorStore):
+    """
+    A stand-in for PineconeVectorStore: the local vector store, with an injected network round trip on every upsert,
+    delete and query.
+
+    Attributes:
+        latency (float): The number of seconds of every round trip.
+    """
+
+    def __init__(self, embedding, directory, latency=0.0):
+        super().__init__(embedding=embedding, directory=directory)
+        self.latency = latency
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, namespace=None):
+        time.sleep(self.latency)
+        return super().add_embeddings(text_embeddings, metadatas=metadatas, ids=ids, namespace=namespace)
+
+    def delete(self, ids=None, delete_all=None, namespace=None, **kwargs):
+        time.sleep(self.latency)
+        return super().delete(ids=ids, delete_all=delete_all, namespace=namespace, **kwargs)
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, namespace=None, **kwargs):
+        time.sleep(self.latency)
+        return super().similarity_search_by_vector_with_score(embedding, k=k, namespace=namespace, **kwargs)
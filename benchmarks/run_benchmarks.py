@@ -0,0 +1,343 @@
+"""
+Offline end-to-end benchmark of the RAG ChatBOT.
+
+Gemini, Pinecone and DuckDuckGo are replaced by the deterministic stand-ins of `benchmarks.fakes`, with configurable
+injected latencies, and the real ingestion, retrieval and serving code of `api.py` and `agent.py` runs against them.
+The corpora are `web_text.txt` and a synthetic PDF made of its text.
+
+Usage:
+    python -m benchmarks.run_benchmarks --pages 100 --requests 200 --concurrency 16 --json results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import uvicorn
+from langchain.agents import AgentExecutor, create_react_agent
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.documents import Document
+from langchain_core.prompts import PromptTemplate
+
+import agent
+import api
+from benchmarks.corpora import loading_web_text, making_pdf, making_queries
+from benchmarks.fakes import FakeEmbeddings, FakeLLM, FakePineconeVectorStore
+from utils.answer_cache import SemanticAnswerCache
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_client import BatchedEmbeddings
+from utils.ingestion_jobs import IngestionJobQueue
+from utils.intent_router import IntentRouter
+from utils.keyword_index import BM25Index
+from utils.local_vector_store import QUANTIZATIONS, LocalVectorStore
+from utils.shared_state import SharedStore
+from utils.web_crawler import HttpPageCache, WebCrawler
+from utils.web_search import StubSearchBackend, WebSearcher
+
+AGENT_TEMPLATE = """Answer the following questions as best you can. You have access to the following tools:
+
+{tools}
+
+Use the following format:
+
+Question: the input question you must answer
+Thought: you should always think about what to do
+Action: the action to take, should be one of [{tool_names}]
+Action Input: the input to the action
+Observation: the result of the action
+Thought: I now know the final answer
+Final Answer: the final answer to the original input question
+Here this is an HTML formatted description of the content of the document.
+{description}
+Begin!
+
+Question: {input} and I am {proffesion}
+Thought:{agent_scratchpad}"""
+
+
+def percentiles(latencies):
+    """
+    Summarizes latencies in seconds as milliseconds.
+
+    Args:
+        latencies (list): The measured latencies, in seconds.
+
+    Returns:
+        dict: The count, mean, p50, p95 and p99 of the latencies.
+    """
+    milliseconds = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        "count": len(latencies),
+        "mean_ms": round(float(milliseconds.mean()), 2),
+        "p50_ms": round(float(np.percentile(milliseconds, 50)), 2),
+        "p95_ms": round(float(np.percentile(milliseconds, 95)), 2),
+        "p99_ms": round(float(np.percentile(milliseconds, 99)), 2),
+    }
+
+
+def configuring_api(arguments, directory):
+    """
+    Sets up the globals `api.initializing_services` creates, with the stand-ins in place of the remote services.
+    """
+    os.environ["INDEX_MANIFEST_DIR"] = os.path.join(directory, "manifests")
+    os.environ["INDEX_LOCK_DIR"] = os.path.join(directory, "locks")
+    os.environ["VECTOR_STORE_BACKEND"] = "local"
+
+    fake_embedding = FakeEmbeddings(latency=arguments.embedding_latency, per_text_latency=arguments.embedding_text_latency)
+    api.batched_embedding = BatchedEmbeddings(fake_embedding, batch_size=100, max_concurrency=4)
+    api.embedding = CachedEmbeddings(api.batched_embedding, cache_path=os.path.join(directory, "embedding-cache.sqlite"))
+    api.batched_embedding.on_batch_embedded = api.embedding.store
+
+    api.pinecone_index = FakePineconeVectorStore(api.embedding, os.path.join(directory, "index"), latency=arguments.vector_store_latency)
+    api.llm = FakeLLM(latency=arguments.llm_latency, token_latency=arguments.llm_token_latency)
+    prompt_template = PromptTemplate(
+        template="I am {proffesion}. I want you to provide a good information regarding my query. You will get additional information from my pdf file: {context}. Here is my query for you: {user_query}.",
+        input_variables=["proffesion", "context", "user_query"],
+    )
+    api.chain = create_stuff_documents_chain(api.llm, prompt_template, document_variable_name="context")
+
+    # A threshold above 1 never matches, every query goes through retrieval and the llm unless asked otherwise
+    api.answer_cache = SemanticAnswerCache(threshold=0.95 if arguments.answer_cache else 1.1)
+    api.shared_store = SharedStore(os.path.join(directory, "shared-state.sqlite"))
+    api.keyword_index = BM25Index(directory=os.path.join(directory, "bm25"))
+    api.retrieval_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="retrieval")
+    api.crawler = WebCrawler(HttpPageCache(directory=os.path.join(directory, "http-cache")))
+    api.ingestion_jobs = IngestionJobQueue(max_workers=2, store=api.shared_store)
+
+
+def configuring_agent(arguments, api_url, directory):
+    """
+    Sets up the globals `agent.initializing_services` creates, with the stand-ins in place of the remote services.
+    """
+    agent.API_URL = api_url
+    agent.shared_store = SharedStore(os.path.join(directory, "shared-state.sqlite"))
+    agent.llm = FakeLLM(latency=arguments.llm_latency, token_latency=arguments.llm_token_latency)
+    agent.intent_router = IntentRouter(FakeEmbeddings(latency=arguments.embedding_latency), store=agent.shared_store)
+    agent.web_searcher = WebSearcher(StubSearchBackend(delay=arguments.search_latency))
+
+    tools = agent.tools
+    agent.agent = create_react_agent(agent.llm, tools, PromptTemplate.from_template(AGENT_TEMPLATE)).with_config(run_name="react_iteration")
+    agent.agent_executor = AgentExecutor(agent=agent.agent, tools=tools, verbose=False)
+
+
+def starting_server(app):
+    """
+    Serves an application on a free local port from a background thread.
+
+    Returns:
+        tuple: The base URL of the server and the uvicorn server, to be stopped with `should_exit`.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+def benchmarking_ingestion(pdf_path, web_text):
+    """
+    Ingests the synthetic PDF and the web text in their own namespaces and measures their throughput.
+    """
+    counters = {}
+
+    def progress(stage, count=1):
+        counters[stage] = counters.get(stage, 0) + count
+
+    started = time.perf_counter()
+    api.uploading_document_to_pinecone(pdf_path, document_id="benchmark-pdf", progress=progress)
+    pdf_seconds = time.perf_counter() - started
+
+    chunker = api.creating_chunker()
+    started = time.perf_counter()
+    chunks = api.chunk_document([Document(page_content=web_text, metadata={"source": "web_text.txt"})], chunker)
+    api.indexing_chunks(chunks, "benchmark-web", "What is the Title of the article and a small description of the content.")
+    web_seconds = time.perf_counter() - started
+
+    return {
+        "pdf": {
+            "seconds": round(pdf_seconds, 3),
+            "pages": counters.get("pages_parsed", 0),
+            "chunks": counters.get("chunks_upserted", 0),
+            "pages_per_second": round(counters.get("pages_parsed", 0) / pdf_seconds, 2),
+            "chunks_per_second": round(counters.get("chunks_upserted", 0) / pdf_seconds, 2),
+        },
+        "web_text": {
+            "seconds": round(web_seconds, 3),
+            "characters": len(web_text),
+            "chunks": len(chunks),
+            "chunks_per_second": round(len(chunks) / web_seconds, 2),
+            "chunking": chunker.throughput(),
+        },
+    }
+
+
+def benchmarking_retrieval(queries):
+    """
+    Measures the latency of retrieval alone, query embedding included, one query at a time.
+    """
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        api.retrieve_response_from_pinecone(query, document_id="benchmark-web")
+        latencies.append(time.perf_counter() - started)
+    return percentiles(latencies)
+
+
+def benchmarking_quantization(arguments, directory, k=5):
+    """
+    Measures the recall@k and the latency of the quantized local vector store against the exact one, on a synthetic
+    corpus of clustered dense vectors: hashed bag-of-words embeddings are sparse and non-negative, unlike real ones.
+    The queries are corpus vectors with added noise.
+    """
+    generator = np.random.default_rng(0)
+    size = 768
+    centers = generator.normal(size=(max(1, arguments.quantization_vectors // 100), size))
+    vectors = centers[generator.integers(0, len(centers), arguments.quantization_vectors)]
+    vectors = vectors + generator.normal(scale=0.8, size=vectors.shape) + 0.3
+    queries = vectors[generator.integers(0, len(vectors), arguments.queries)]
+    queries = queries + generator.normal(scale=0.5, size=queries.shape)
+
+    ids = [str(position) for position in range(len(vectors))]
+    results, exact = {}, None
+    for quantization in (None, *QUANTIZATIONS):
+        name = quantization or "float32"
+        store = LocalVectorStore(None, os.path.join(directory, f"quantization-{name}"), quantization=quantization,
+                                 rescore_factor=arguments.rescore_factor)
+        store.add_embeddings(list(zip(ids, vectors)), ids=ids)
+
+        latencies, found = [], []
+        for query in queries:
+            started = time.perf_counter()
+            documents = store.similarity_search_by_vector(query, k=k)
+            latencies.append(time.perf_counter() - started)
+            found.append({document.id for document in documents})
+
+        exact = exact or found
+        results[name] = {
+            **percentiles(latencies),
+            f"recall_at_{k}": round(float(np.mean([len(got & expected) / k for got, expected in zip(found, exact)])), 4),
+            "scanned_bytes_per_vector": round(store.scanned_bytes() / len(vectors), 1),
+        }
+    return results
+
+
+def benchmarking_web_search(queries):
+    """
+    Measures the latency of the web search tool on cold queries, then on the same queries served from its cache.
+    """
+    results = {}
+    for name in ("cold", "cached"):
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            agent.searching_web(query)
+            latencies.append(time.perf_counter() - started)
+        results[name] = percentiles(latencies)
+    return results
+
+
+def loading_endpoint(url, params_list, concurrency):
+    """
+    Sends GET requests to an endpoint from `concurrency` threads at once and measures their latency.
+    """
+    failures = []
+
+    with httpx.Client(timeout=300, limits=httpx.Limits(max_connections=concurrency)) as client:
+
+        def requesting(params):
+            started = time.perf_counter()
+            response = client.get(url, params=params)
+            if response.status_code != 200:
+                failures.append(response.status_code)
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(requesting, params_list))
+        seconds = time.perf_counter() - started
+
+    summary = percentiles(latencies)
+    summary["requests_per_second"] = round(len(latencies) / seconds, 2)
+    summary["failures"] = len(failures)
+    return summary
+
+
+def parsing_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with local stand-ins for Gemini, Pinecone and DuckDuckGo.")
+    parser.add_argument("--pages", type=int, default=50, help="Pages of the synthetic PDF.")
+    parser.add_argument("--queries", type=int, default=100, help="Queries of the retrieval and web search benchmarks.")
+    parser.add_argument("--requests", type=int, default=100, help="Requests sent to every endpoint under load.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once under load.")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds before the first token of the llm.")
+    parser.add_argument("--llm-token-latency", type=float, default=0.005, help="Seconds between two tokens of the llm.")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds of every embedding call.")
+    parser.add_argument("--embedding-text-latency", type=float, default=0.0005, help="Seconds added per embedded text.")
+    parser.add_argument("--vector-store-latency", type=float, default=0.02, help="Seconds of every vector store round trip.")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="Seconds of every web search.")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the semantic answer cache enabled under load.")
+    parser.add_argument("--quantization-vectors", type=int, default=20000, help="Vectors of the quantization benchmark.")
+    parser.add_argument("--rescore-factor", type=int, default=10, help="Candidates rescored per result by the quantized stores.")
+    parser.add_argument("--json", help="Writes the results to this JSON file as well.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parsing_arguments(argv)
+    directory = tempfile.mkdtemp(prefix="rag-benchmark-")
+    web_text = loading_web_text()
+    queries = making_queries(web_text, arguments.queries)
+    load_queries = making_queries(web_text, arguments.requests, seed=1)
+
+    pdf_path = os.path.join(directory, "benchmark.pdf")
+    with open(pdf_path, "wb") as f:
+        f.write(making_pdf(web_text, arguments.pages))
+
+    results = {"settings": vars(arguments)}
+
+    # The services print every step, only the report is written to the console
+    report = sys.stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        configuring_api(arguments, directory)
+        api_url, api_server = starting_server(api.creating_app(initializing=False))
+        configuring_agent(arguments, api_url, directory)
+        agent_url, agent_server = starting_server(agent.creating_app(initializing=False))
+
+        results["ingestion"] = benchmarking_ingestion(pdf_path, web_text)
+        results["retrieval"] = benchmarking_retrieval(queries)
+        results["quantization"] = benchmarking_quantization(arguments, directory)
+        results["web_search"] = benchmarking_web_search(queries)
+        results["get_response"] = loading_endpoint(
+            f"{api_url}/get_response",
+            [{"query": query, "proffesion": "Engineer", "document_id": "benchmark-web"} for query in load_queries],
+            arguments.concurrency,
+        )
+        results["to_agent"] = loading_endpoint(
+            f"{agent_url}/to_agent",
+            [{"query": query, "proffesion": "Engineer", "document_id": "benchmark-web"} for query in load_queries],
+            arguments.concurrency,
+        )
+
+        api_server.should_exit = agent_server.should_exit = True
+
+    print(json.dumps(results, indent=2), file=report)
+    if arguments.json:
+        with open(arguments.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,16 @@
-exec python -u api.py &
-exec python -u agent.py &
+python -u api.py &
+python -u agent.py &
+
+# Waiting until both services answer their readiness probe before opening the app, for at most STARTUP_TIMEOUT seconds
+waiting_for() {
+    for _ in $(seq "${STARTUP_TIMEOUT:-120}"); do
+        curl -fsS -o /dev/null "$1" && return 0
+        sleep 1
+    done
+    echo "$1 is not ready after ${STARTUP_TIMEOUT:-120} seconds, starting the app anyway" >&2
+}
+
+waiting_for http://localhost:8000/readyz
+waiting_for http://localhost:8080/readyz
+
 streamlit run app.py --server.address=0.0.0.0 --server.port=7860
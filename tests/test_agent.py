@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import agent
+from utils.shared_state import SharedStore
+from utils.sse import parsing_events
+
+
+class FixedRouter:
+    """
+    Routes every query to the same tool, or fails if told to.
+    """
+
+    def __init__(self, route, error=None):
+        self.route = route
+        self.error = error
+
+    async def routing(self, query, document_id):
+        if self.error:
+            raise self.error
+        return self.route
+
+
+@pytest.fixture
+def services(monkeypatch):
+    """
+    Answers the calls to the API from a mock transport, recording the document ID of every call.
+    """
+    calls = []
+
+    async def handling(request):
+        calls.append(request.url.params.get("document_id"))
+        await asyncio.sleep(0.2)
+        if request.url.params["query"] == "unavailable":
+            return httpx.Response(503, json={"detail": "The service is starting"})
+        if request.url.path == "/get_response_stream":
+            return httpx.Response(200, text='event: token\ndata: {"text": "From the document"}\n\nevent: done\ndata: {}\n\n')
+        return httpx.Response(200, json=f"Answer about {request.url.params.get('document_id')}")
+
+    monkeypatch.setattr(agent, "http_client", httpx.AsyncClient(transport=httpx.MockTransport(handling)))
+    monkeypatch.setattr(agent, "intent_router", FixedRouter("Database Call"), raising=False)
+    monkeypatch.setattr(agent, "shared_store", SharedStore(":memory:"), raising=False)
+    return calls
+
+
+def test_concurrent_tool_calls_share_the_event_loop_and_keep_their_document(services):
+    async def answering_both():
+        started = time.perf_counter()
+        answers = await asyncio.gather(agent.answering("question", "Doctor", "first"), agent.answering("question", "Doctor", "second"))
+        return answers, time.perf_counter() - started
+
+    answers, seconds = asyncio.run(answering_both())
+
+    assert [answer["output"] for answer in answers] == ["Answer about first", "Answer about second"]
+    assert sorted(services) == ["first", "second"]
+    # Both calls waited on the API at the same time
+    assert seconds < 0.35
+
+
+def test_failed_routing_falls_back_on_the_agent(monkeypatch):
+    monkeypatch.setattr(agent, "intent_router", FixedRouter(None, error=ValueError("embedding failed")), raising=False)
+
+    assert asyncio.run(agent.routing_query("question", None)) is None
+
+
+def test_streamed_database_answers_are_relayed(services):
+    async def collecting(query):
+        return "".join([event async for event in agent.streaming_agent_response(query, "Doctor", "first")])
+
+    events = list(parsing_events(asyncio.run(collecting("question")).split("\n")))
+    assert events == [("token", {"text": "From the document"}), ("done", {})]
+
+    # An API which is not ready is reported instead of answering nothing
+    events = list(parsing_events(asyncio.run(collecting("unavailable")).split("\n")))
+    assert [event for event, _ in events] == ["error", "done"]
@@ -0,0 +1,62 @@
+import utils.answer_cache
+from utils.answer_cache import SemanticAnswerCache
+
+QUERY = [1.0, 0.0, 0.0]
+# A cosine similarity of 0.995 with QUERY
+PARAPHRASE = [1.0, 0.1, 0.0]
+OTHER = [0.0, 1.0, 0.0]
+
+
+def test_paraphrased_queries_share_an_answer():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store(QUERY, "answer", "doc", "v1", "doctor")
+
+    assert cache.lookup(PARAPHRASE, "doc", "v1", "doctor") == "answer"
+    assert cache.lookup(OTHER, "doc", "v1", "doctor") is None
+
+
+def test_answers_are_partitioned_by_document_version_and_profession():
+    cache = SemanticAnswerCache()
+    cache.store(QUERY, "answer", "doc", "v1", "doctor")
+
+    assert cache.lookup(QUERY, "doc", "v2", "doctor") is None
+    assert cache.lookup(QUERY, "doc", "v1", "lawyer") is None
+    assert cache.lookup(QUERY, None, "v1", "doctor") is None
+
+
+def test_answers_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils.answer_cache.time, "monotonic", lambda: now[0])
+    cache = SemanticAnswerCache(ttl=60)
+    cache.store(QUERY, "answer", "doc", "v1", "doctor")
+
+    now[0] += 59
+    assert cache.lookup(QUERY, "doc", "v1", "doctor") == "answer"
+    now[0] += 2
+    assert cache.lookup(QUERY, "doc", "v1", "doctor") is None
+    assert cache._partitions == {} and not cache._recency
+
+
+def test_least_recently_used_answers_are_evicted():
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.store(QUERY, "first", "a", "v1", "doctor")
+    cache.store(QUERY, "second", "b", "v1", "doctor")
+    cache.lookup(QUERY, "a", "v1", "doctor")
+    cache.store(QUERY, "third", "c", "v1", "doctor")
+
+    assert cache.lookup(QUERY, "a", "v1", "doctor") == "first"
+    assert cache.lookup(QUERY, "b", "v1", "doctor") is None
+    assert cache.lookup(QUERY, "c", "v1", "doctor") == "third"
+
+
+def test_invalidating_a_document_drops_all_its_versions():
+    cache = SemanticAnswerCache()
+    cache.store(QUERY, "old", "doc", "v1", "doctor")
+    cache.store(QUERY, "new", "doc", "v2", "lawyer")
+    cache.store(QUERY, "kept", "other", "v1", "doctor")
+
+    cache.invalidate("doc")
+
+    assert cache.lookup(QUERY, "doc", "v1", "doctor") is None
+    assert cache.lookup(QUERY, "doc", "v2", "lawyer") is None
+    assert cache.lookup(QUERY, "other", "v1", "doctor") == "kept"
@@ -0,0 +1,73 @@
+import textwrap
+
+from langchain_core.documents import Document
+
+from benchmarks.corpora import making_pdf
+from utils.chunking import Chunker
+from utils.getting_web_text import extract_text_from_html
+from utils.pdf_pipeline import streaming_pdf_pages
+
+# Paragraphs of 150 to 250 characters, more than half of a 64 token chunk each, so that every chunk is one paragraph
+PARAGRAPHS = [
+    "The index stores every chunk of a document once. Chunks are identified by a hash of their normalized text, "
+    "so unchanged chunks are never embedded again.",
+    "Queries are embedded and compared to every chunk of the namespace. The best chunks are packed into the "
+    "context of the llm within its token budget.",
+    "Web pages are fetched concurrently and revalidated with their validators. A page the server reports as "
+    "unchanged keeps the chunks indexed the last time.",
+    "Ingestion jobs run in the background and report their progress. A job whose worker stopped is marked as "
+    "failed after a while.",
+]
+
+
+def chunking(texts, **kwargs):
+    chunker = Chunker(**kwargs)
+    return [chunk.page_content for chunk in chunker.splitting([Document(page_content=text) for text in texts])]
+
+
+def test_chunks_of_extracted_pdf_pages_end_on_paragraphs(tmp_path):
+    path = tmp_path / "document.pdf"
+    lines = sum(len(textwrap.wrap(paragraph, width=95)) for paragraph in PARAGRAPHS)
+    path.write_bytes(making_pdf("\n\n".join(PARAGRAPHS), pages=1, lines_per_page=lines, line_width=95))
+
+    pages = [page.page_content for page in streaming_pdf_pages(str(path), max_workers=1)]
+    assert pages == ["\n\n".join(PARAGRAPHS)]
+    assert chunking(pages, chunk_tokens=64, overlap_tokens=0) == PARAGRAPHS
+
+
+def test_chunks_of_extracted_html_end_on_paragraphs():
+    # The source lines of a paragraph are wrapped like in most HTML documents
+    paragraphs = [paragraph.replace(". ", ".\n    ") for paragraph in PARAGRAPHS]
+    html = "<html><body>" + "".join(f"<p>{paragraph}</p>\n" for paragraph in paragraphs) + "</body></html>"
+
+    text = extract_text_from_html([html.encode("utf-8")])
+    assert text == "\n\n".join(PARAGRAPHS)
+    assert chunking([text], chunk_tokens=64, overlap_tokens=0) == PARAGRAPHS
+
+
+def test_chunks_cut_between_sentences_and_overlap():
+    sentences = [f"Sentence number {position} says something about the topic." for position in range(20)]
+    chunks = chunking([" ".join(sentences)], chunk_tokens=40, overlap_tokens=16)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 40 * 4
+        assert chunk.startswith("Sentence") and chunk.endswith(".")
+    # Consecutive chunks share the sentence at their boundary
+    for previous, following in zip(chunks, chunks[1:]):
+        assert previous.rsplit(". ", 1)[-1] == following.split(". ", 1)[0] + "."
+
+
+def test_sentences_longer_than_a_chunk_are_cut_between_words():
+    chunks = chunking([" ".join(["word"] * 200)], chunk_tokens=32, overlap_tokens=0)
+
+    assert all(len(chunk) <= 32 * 4 for chunk in chunks)
+    assert " ".join(chunks).split() == ["word"] * 200
+
+
+def test_chunks_keep_the_metadata_of_their_document():
+    chunker = Chunker(chunk_tokens=32, overlap_tokens=0)
+    chunks = chunker.splitting([Document(page_content=PARAGRAPHS[0], metadata={"source": "a.pdf", "page": 3})])
+
+    assert all(chunk.metadata == {"source": "a.pdf", "page": 3} for chunk in chunks)
+    assert chunker.throughput()["documents"] == 1
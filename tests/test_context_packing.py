@@ -0,0 +1,53 @@
+from langchain_core.documents import Document
+
+from utils.context_packing import estimating_tokens, packing_context
+
+TEXT = (
+    "The warranty covers manufacturing defects for two years from the date of purchase. Claims are made through the "
+    "retailer with the original receipt. Damage caused by misuse, accidents or unauthorized repairs is excluded. "
+    "Replacement parts are shipped within ten working days of an accepted claim."
+)
+
+
+def chunk(start, end, page=1, source="manual.pdf"):
+    return Document(page_content=TEXT[start:end], metadata={"source": source, "page": page})
+
+
+def test_overlapping_chunks_of_a_page_are_merged():
+    packed = packing_context([chunk(80, 220), chunk(0, 120)])
+
+    assert [document.page_content for document in packed] == [TEXT[0:220]]
+    assert packed[0].metadata == {"source": "manual.pdf", "page": 1}
+
+
+def test_chunks_bridged_by_a_later_one_become_one_passage():
+    packed = packing_context([chunk(0, 100), chunk(180, 280), chunk(80, 200)])
+
+    assert [document.page_content for document in packed] == [TEXT[0:280]]
+
+
+def test_overlapping_chunks_of_other_pages_are_kept_apart():
+    packed = packing_context([chunk(0, 120, page=1), chunk(180, 280, page=2), chunk(100, 200, page=2)])
+
+    assert [document.metadata["page"] for document in packed] == [1, 2]
+    assert packed[1].page_content == TEXT[100:280]
+
+
+def test_near_duplicates_of_more_relevant_passages_are_dropped():
+    duplicate = Document(page_content=TEXT[0:200].replace("two years", "2 years"), metadata={"source": "copy.pdf", "page": 9})
+    other = Document(page_content="Shipping is free for orders above fifty euros.", metadata={"source": "faq.html"})
+
+    packed = packing_context([chunk(0, 200), duplicate, other])
+
+    assert [document.metadata["source"] for document in packed] == ["manual.pdf", "faq.html"]
+
+
+def test_context_stays_within_the_token_budget():
+    documents = [Document(page_content=" ".join([f"word{position}"] * 100), metadata={"page": position}) for position in range(5)]
+
+    packed = packing_context(documents, token_budget=400)
+
+    assert sum(estimating_tokens(document.page_content) for document in packed) <= 400
+    assert [document.metadata["page"] for document in packed] == [0, 1, 2]
+    # The passage overflowing the budget is cut at a word boundary
+    assert packed[-1].page_content.split() == ["word2"] * len(packed[-1].page_content.split())
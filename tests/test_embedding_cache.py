@@ -0,0 +1,95 @@
+import sqlite3
+
+from benchmarks.fakes import FakeEmbeddings
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_client import BatchedEmbeddings
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    """
+    Counts the texts sent to the embedding model.
+    """
+
+    def __init__(self):
+        super().__init__(size=16)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def counting_writes(cache):
+    """
+    Counts the rows written to the cached vectors, by inserts and updates alike.
+    """
+    writes = []
+    cache._connection.create_function("counting_write", 0, lambda: writes.append(1))
+    for event in ("INSERT", "UPDATE OF vector"):
+        name = event.split()[0].lower()
+        cache._connection.execute(f"CREATE TEMP TRIGGER counting_{name} AFTER {event} ON main.embeddings BEGIN SELECT counting_write(); END")
+    return writes
+
+
+def counting_rows(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def test_cached_texts_are_not_embedded_again(tmp_path):
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, cache_path=str(tmp_path / "cache.sqlite"))
+
+    first = cache.embed_documents(["alpha", "beta", "alpha"])
+    second = cache.embed_documents(["  alpha ", "gamma"])
+
+    assert model.embedded == ["alpha", "beta", "gamma"]
+    assert second[0] == first[0] == first[2]
+
+
+def test_misses_are_stored_once_when_the_model_stores_its_batches(tmp_path):
+    batched = BatchedEmbeddings(CountingEmbeddings(), batch_size=4, max_concurrency=2)
+    cache = CachedEmbeddings(batched, cache_path=str(tmp_path / "cache.sqlite"))
+    batched.on_batch_embedded = cache.store
+    writes = counting_writes(cache)
+
+    cache.embed_documents([f"text number {position}" for position in range(10)])
+
+    assert len(writes) == 10
+
+
+def test_misses_are_stored_by_the_cache_otherwise(tmp_path):
+    cache = CachedEmbeddings(CountingEmbeddings(), cache_path=str(tmp_path / "cache.sqlite"))
+    writes = counting_writes(cache)
+
+    cache.embed_documents([f"text number {position}" for position in range(10)])
+
+    assert len(writes) == 10
+    assert counting_rows(tmp_path / "cache.sqlite") == 10
+
+
+def test_least_recently_used_vectors_are_evicted(tmp_path):
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, cache_path=str(tmp_path / "cache.sqlite"), max_entries=5)
+    cache.embed_documents([f"old {position}" for position in range(4)])
+    cache.embed_documents(["old 0"])
+    cache.embed_documents([f"new {position}" for position in range(3)])
+
+    assert counting_rows(tmp_path / "cache.sqlite") == 5
+    model.embedded.clear()
+    cache.embed_documents(["old 0", "new 0", "new 1", "new 2"])
+    assert model.embedded == []
+
+
+def test_entry_count_is_shared_between_processes_of_the_same_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first = CachedEmbeddings(CountingEmbeddings(), cache_path=path, max_entries=6)
+    second = CachedEmbeddings(CountingEmbeddings(), cache_path=path, max_entries=6)
+
+    first.embed_documents([f"first {position}" for position in range(4)])
+    second.embed_documents([f"second {position}" for position in range(4)])
+    # Storing vectors already cached again leaves the count unchanged
+    first.store([f"second {position}" for position in range(4)], [[0.0] * 16] * 4)
+
+    assert counting_rows(path) == 6
+    assert first._connection.execute("SELECT entries FROM embeddings_count").fetchone()[0] == 6
@@ -0,0 +1,146 @@
+import threading
+
+import pytest
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeEmbeddings
+from utils.embedding_cache import CachedEmbeddings
+import utils.embedding_client
+from utils.embedding_client import BatchedEmbeddings, is_rate_limit_error, is_transient_error
+from utils.incremental_index import syncing_chunks_to_index
+from utils.local_vector_store import LocalVectorStore
+
+
+class RecordingProgress:
+    """
+    Records the progress events of an ingestion, in order.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, stage, count=1):
+        with self._lock:
+            self.events.append((stage, count))
+
+
+def creating_store(tmp_path, batch_size):
+    batched = BatchedEmbeddings(FakeEmbeddings(size=64), batch_size=batch_size, max_concurrency=2)
+    cached = CachedEmbeddings(batched, cache_path=str(tmp_path / "cache.sqlite"))
+    batched.on_batch_embedded = cached.store
+    return LocalVectorStore(cached, str(tmp_path / "index"))
+
+
+def test_embedded_chunks_are_reported_batch_by_batch_before_the_upsert(tmp_path):
+    store = creating_store(tmp_path, batch_size=10)
+    chunks = [Document(page_content=f"chunk number {position}") for position in range(45)]
+    progress = RecordingProgress()
+
+    syncing_chunks_to_index(store, chunks, str(tmp_path / "manifest.json"), batch_size=45, progress=progress)
+
+    # The batches run concurrently, so they may finish in any order, but all of them before the upsert
+    assert sorted(count for stage, count in progress.events[:-1]) == [5, 10, 10, 10, 10]
+    assert {stage for stage, _ in progress.events[:-1]} == {"chunks_embedded"}
+    assert progress.events[-1] == ("chunks_upserted", 45)
+
+
+def test_cached_chunks_are_reported_as_embedded(tmp_path):
+    store = creating_store(tmp_path, batch_size=10)
+    chunks = [Document(page_content=f"chunk number {position}") for position in range(20)]
+    syncing_chunks_to_index(store, chunks, str(tmp_path / "manifest.json"), batch_size=20)
+
+    # Indexing the same chunks in another namespace serves their embeddings from the cache
+    progress = RecordingProgress()
+    syncing_chunks_to_index(store, chunks, str(tmp_path / "other.json"), namespace="other", batch_size=20, progress=progress)
+
+    assert progress.events == [("chunks_embedded", 20), ("chunks_upserted", 20)]
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"status {code}")
+        self.code = code
+
+
+class FlakyEmbeddings(FakeEmbeddings):
+    """
+    Fails the first calls of every batch with the given errors, then embeds it.
+    """
+
+    def __init__(self, errors):
+        super().__init__(size=8)
+        self.errors = errors
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            attempt = self.calls.get(texts[0], 0)
+            self.calls[texts[0]] = attempt + 1
+        error = self.errors(texts, attempt)
+        if error:
+            raise error
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Records the back-off delays instead of sleeping through them.
+    """
+    delays = []
+    monkeypatch.setattr(utils.embedding_client.time, "sleep", delays.append)
+    return delays
+
+
+def test_errors_are_classified_by_the_status_code_of_their_cause():
+    try:
+        try:
+            raise ApiError(429)
+        except ApiError as e:
+            raise RuntimeError("Error embedding content") from e
+    except RuntimeError as e:
+        wrapped = e
+
+    assert is_rate_limit_error(wrapped) and is_transient_error(wrapped)
+    assert is_transient_error(ApiError(503)) and not is_rate_limit_error(ApiError(503))
+    assert is_transient_error(TimeoutError()) and is_transient_error(ConnectionResetError())
+    assert not is_transient_error(ApiError(400)) and not is_transient_error(ValueError("too many tokens"))
+
+
+def test_rate_limited_batches_are_retried_and_slow_down_together(sleeps):
+    model = FlakyEmbeddings(lambda texts, attempt: ApiError(429) if attempt < 2 else None)
+    batched = BatchedEmbeddings(model, batch_size=3, max_concurrency=2)
+    texts = [f"text {position}" for position in range(9)]
+
+    assert batched.embed_documents(texts) == FakeEmbeddings(size=8).embed_documents(texts)
+    assert set(model.calls.values()) == {3}
+    # Every rate limit doubles the delay shared by the batches, and every successful call halves it again
+    assert max(sleeps) > 1.0
+    delay = batched._delay
+    batched.embed_query("query")
+    assert batched._delay == delay / 2
+
+
+def test_permanent_errors_are_not_retried(sleeps):
+    model = FlakyEmbeddings(lambda texts, attempt: ApiError(400))
+    batched = BatchedEmbeddings(model, batch_size=10)
+
+    with pytest.raises(ApiError):
+        batched.embed_documents(["text"])
+    assert model.calls == {"text": 1}
+    assert sleeps == []
+
+
+def test_batches_embedded_before_a_failure_reach_the_callback(sleeps):
+    model = FlakyEmbeddings(lambda texts, attempt: ApiError(503) if texts[0] == "text 4" else None)
+    embedded = []
+    batched = BatchedEmbeddings(model, batch_size=2, max_concurrency=1, max_retries=2, on_batch_embedded=lambda texts, vectors: embedded.extend(texts))
+
+    with pytest.raises(ApiError):
+        batched.embed_documents([f"text {position}" for position in range(10)])
+    assert model.calls["text 4"] == 3
+    # The batch picked up while the failure is raised may still finish, the ones after it are cancelled
+    assert embedded[:4] == ["text 0", "text 1", "text 2", "text 3"]
+    assert "text 4" not in embedded
@@ -0,0 +1,44 @@
+import pytest
+
+from utils.getting_web_text import extract_text_from_html
+
+
+def extracting(html, **kwargs):
+    return extract_text_from_html([html.encode("utf-8")], **kwargs)
+
+
+def test_scripts_navigation_and_page_furniture_are_skipped():
+    text = extracting("""
+        <html><head><style>p { color: red }</style></head><body>
+        <nav>Home | About</nav>
+        <div class="cookie-banner">We use cookies</div>
+        <p>The article text.</p>
+        <script>var tracking = 1;</script>
+        <div class="widget sidebar">Popular posts</div>
+        <section id="comments">First!</section>
+        <footer>Copyright</footer>
+        </body></html>
+    """)
+
+    assert text == "The article text."
+
+
+@pytest.mark.parametrize("wrapper", ['class="has-sidebar"', 'class="with-comments"', 'class="page-header-wrap"', 'id="main-content"'])
+def test_wrappers_named_after_furniture_keep_their_content(wrapper):
+    text = extracting(f'<body><div {wrapper}><p class="ad-free">Keep me</p><p>And me</p></div></body>')
+
+    assert text == "Keep me\n\nAnd me"
+
+
+def test_main_element_is_the_content_root():
+    text = extracting("<body><div>Site banner text</div><main><h1>Title</h1><p>Body</p></main></body>")
+
+    assert text == "Title\n\nBody"
+
+
+def test_links_are_collected_and_text_is_split_on_blocks():
+    links = []
+    text = extracting('<body><p>One <a href="/a">link</a></p><ul><li>Two</li><li>Three</li></ul><nav><a href="/b">b</a></nav></body>', links=links)
+
+    assert links == ["/a", "/b"]
+    assert text == "One link\n\nTwo\n\nThree"
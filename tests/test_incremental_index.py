@@ -0,0 +1,104 @@
+import os
+
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeEmbeddings
+from utils.incremental_index import loading_manifest, syncing_chunks_to_index, waiting_for_vector_count
+from utils.keyword_index import BM25Index
+from utils.local_vector_store import LocalVectorStore
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    """
+    Counts the texts sent to the embedding model.
+    """
+
+    def __init__(self):
+        super().__init__(size=16)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def making_chunks(texts, source=None):
+    return [Document(page_content=text, metadata={"source": source} if source else {}) for text in texts]
+
+
+def test_only_changed_chunks_are_embedded_and_stale_ones_deleted(tmp_path):
+    model = CountingEmbeddings()
+    store = LocalVectorStore(model, str(tmp_path / "index"))
+    manifest = str(tmp_path / "manifest.json")
+
+    first = syncing_chunks_to_index(store, making_chunks(["one", "two", "three", "two"]), manifest)
+    assert (first["added"], first["deleted"], first["total"]) == (3, 0, 3)
+
+    model.embedded.clear()
+    second = syncing_chunks_to_index(store, making_chunks(["one", "two", "three"]), manifest)
+    assert (second["added"], second["unchanged"], second["version"]) == (0, 3, first["version"])
+    assert model.embedded == []
+
+    third = syncing_chunks_to_index(store, making_chunks(["one", "two", "four"]), manifest)
+    assert (third["added"], third["deleted"], third["total"]) == (1, 1, 3)
+    assert third["version"] != first["version"]
+    assert model.embedded == ["four"]
+    assert store.vector_count() == 3
+    assert sorted(document.page_content for document in store.similarity_search("four", k=10)) == ["four", "one", "two"]
+
+
+def test_unchanged_sources_are_not_chunked_again(tmp_path):
+    store = LocalVectorStore(CountingEmbeddings(), str(tmp_path / "index"))
+    manifest = str(tmp_path / "manifest.json")
+    syncing_chunks_to_index(store, making_chunks(["a1", "a2"], "a") + making_chunks(["b1"], "b"), manifest)
+
+    def failing():
+        raise AssertionError("the chunks of an unchanged source were computed again")
+
+    result = syncing_chunks_to_index(store, making_chunks(["b2"], "b"), manifest, unchanged_sources={"a": failing})
+
+    assert (result["added"], result["deleted"], result["total"]) == (1, 1, 3)
+
+
+def test_unchanged_sources_unknown_to_the_manifest_are_chunked(tmp_path):
+    store = LocalVectorStore(CountingEmbeddings(), str(tmp_path / "index"))
+    manifest = str(tmp_path / "manifest.json")
+
+    result = syncing_chunks_to_index(store, [], manifest, unchanged_sources={"a": lambda: making_chunks(["a1", "a2"], "a")})
+
+    assert result["added"] == 2
+    assert store.vector_count() == 2
+
+
+def test_namespace_without_manifest_is_rebuilt(tmp_path):
+    store = LocalVectorStore(CountingEmbeddings(), str(tmp_path / "index"))
+    manifest = str(tmp_path / "manifest.json")
+    syncing_chunks_to_index(store, making_chunks(["old", "older"]), manifest, namespace="tenant")
+    os.remove(manifest)
+
+    result = syncing_chunks_to_index(store, making_chunks(["new"]), manifest, namespace="tenant")
+
+    assert (result["added"], result["total"]) == (1, 1)
+    assert store.vector_count(namespace="tenant") == 1
+    assert len(loading_manifest(manifest)) == 1
+
+
+def test_keyword_index_out_of_step_is_rebuilt(tmp_path):
+    store = LocalVectorStore(CountingEmbeddings(), str(tmp_path / "index"))
+    manifest = str(tmp_path / "manifest.json")
+    syncing_chunks_to_index(store, making_chunks(["invoice due", "error code"]), manifest)
+
+    # A keyword index created after the first ingestion receives every chunk, not only the new ones
+    keyword_index = BM25Index(str(tmp_path / "keywords"))
+    syncing_chunks_to_index(store, making_chunks(["invoice due", "error code", "refund policy"]), manifest, keyword_index=keyword_index)
+
+    assert keyword_index.size(None) == 3
+    assert [document.page_content for document in keyword_index.search("error")] == ["error code"]
+
+
+def test_waiting_for_vector_count_stops_at_the_expected_count(tmp_path):
+    store = LocalVectorStore(CountingEmbeddings(), str(tmp_path / "index"))
+    store.add_texts(["one", "two"])
+
+    assert waiting_for_vector_count(store, 2, timeout=1)
+    assert not waiting_for_vector_count(store, 3, timeout=0.1, interval=0.05)
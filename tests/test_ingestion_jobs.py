@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from utils.ingestion_jobs import IngestionJobQueue, QueueFullError
+from utils.shared_state import SharedStore
+
+
+def waiting_for_job(queue, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def ingesting(pages, progress):
+    for _ in range(pages):
+        progress("pages_parsed")
+    progress("chunks_upserted", 10)
+    return f"{pages} pages"
+
+
+def test_job_reports_its_progress_and_result():
+    queue = IngestionJobQueue()
+    job = waiting_for_job(queue, queue.submit(ingesting, 3))
+
+    assert job["status"] == "done"
+    assert job["progress"] == {"pages_parsed": 3, "chunks_upserted": 10}
+    assert job["result"] == "3 pages"
+    assert job["finished_at"] >= job["created_at"]
+
+
+def test_failing_job_reports_its_error():
+    def failing(progress):
+        raise ValueError("the document is empty")
+
+    queue = IngestionJobQueue()
+    job = waiting_for_job(queue, queue.submit(failing))
+
+    assert (job["status"], job["error"]) == ("failed", "the document is empty")
+    assert queue.get("unknown") is None
+
+
+def test_submissions_beyond_the_pending_limit_are_rejected():
+    release = threading.Event()
+    queue = IngestionJobQueue(max_workers=1, max_pending=2)
+    jobs = [queue.submit(lambda progress: release.wait(5)) for _ in range(2)]
+
+    with pytest.raises(QueueFullError):
+        queue.submit(lambda progress: None)
+
+    release.set()
+    for job_id in jobs:
+        waiting_for_job(queue, job_id)
+    assert waiting_for_job(queue, queue.submit(lambda progress: None))["status"] == "done"
+
+
+def test_jobs_are_shared_between_workers_of_the_same_store(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    first = IngestionJobQueue(store=SharedStore(path))
+    second = IngestionJobQueue(store=SharedStore(path))
+
+    job_id = first.submit(ingesting, 2)
+    waiting_for_job(first, job_id)
+
+    assert second.get(job_id)["progress"] == {"pages_parsed": 2, "chunks_upserted": 10}
+
+
+def test_jobs_of_a_stopped_worker_are_marked_as_failed(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    release = threading.Event()
+    stopped = IngestionJobQueue(store=SharedStore(path), heartbeat_interval=60)
+    job_id = stopped.submit(lambda progress: release.wait(5))
+
+    # The stopped worker's heartbeat is older than what the other worker tolerates
+    alive = IngestionJobQueue(store=SharedStore(path), stale_after=0.2)
+    time.sleep(0.3)
+    job = alive.get(job_id)
+    release.set()
+
+    assert (job["status"], job["error"]) == ("failed", "The worker running the job stopped")
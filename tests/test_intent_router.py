@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from utils.intent_router import IntentRouter
+from utils.shared_state import SharedStore
+
+VECTORS = {
+    "A guide to pruning fruit trees": [1.0, 0.0],
+    "when should apple trees be pruned": [0.9, 0.1],
+    "who won the football match yesterday": [0.0, 1.0],
+    "what tools do gardeners use": [0.5, 0.6],
+}
+
+
+class TableEmbeddings(Embeddings):
+    """
+    Embeds the texts of a fixed table, counting the embedded queries.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def embed_documents(self, texts):
+        return [VECTORS[text] for text in texts]
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return VECTORS[text]
+
+
+def routing(router, query, document_id=None):
+    return asyncio.run(router.routing(query, document_id))
+
+
+@pytest.mark.parametrize("query", ["hi", "Hello there!", "good morning everyone", "thanks", "How are you doing?"])
+def test_greetings_are_answered_without_embedding(query):
+    embeddings = TableEmbeddings()
+
+    assert routing(IntentRouter(embeddings), query) == "Greetings"
+    assert embeddings.queries == []
+
+
+def test_queries_are_routed_by_their_similarity_to_the_document():
+    router = IntentRouter(TableEmbeddings(), document_threshold=0.75, web_threshold=0.45)
+    router.setting_document("garden", "A guide to pruning fruit trees")
+
+    assert routing(router, "when should apple trees be pruned", "garden") == "Database Call"
+    assert routing(router, "who won the football match yesterday", "garden") == "Web Searching"
+    assert routing(router, "what tools do gardeners use", "garden") is None
+
+
+def test_documents_without_description_are_left_to_the_agent():
+    embeddings = TableEmbeddings()
+
+    assert routing(IntentRouter(embeddings), "when should apple trees be pruned", "garden") is None
+    assert embeddings.queries == []
+
+
+def test_description_stored_by_another_service_is_embedded_once(tmp_path):
+    store = SharedStore(str(tmp_path / "state.sqlite"))
+    store.setting_description("garden", "A guide to pruning fruit trees")
+    embeddings = TableEmbeddings()
+    router = IntentRouter(embeddings, store=store)
+
+    routing(router, "when should apple trees be pruned", "garden")
+    routing(router, "who won the football match yesterday", "garden")
+
+    assert embeddings.queries.count("A guide to pruning fruit trees") == 1
+
+    # Another worker of the agent routes with the stored embedding, until the description is replaced
+    other = TableEmbeddings()
+    routing(IntentRouter(other, store=SharedStore(store.path)), "when should apple trees be pruned", "garden")
+    store.setting_description("garden", "A guide to pruning fruit trees")
+    routing(IntentRouter(other, store=SharedStore(store.path)), "when should apple trees be pruned", "garden")
+    assert other.queries.count("A guide to pruning fruit trees") == 1
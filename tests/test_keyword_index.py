@@ -0,0 +1,62 @@
+from langchain_core.documents import Document
+
+from utils.keyword_index import BM25Index, reciprocal_rank_fusion, tokenizing
+
+
+def indexing(index, texts, namespace=None):
+    ids = [f"{namespace}-{position}" for position in range(len(texts))]
+    index.add_documents([Document(page_content=text) for text in texts], ids=ids, namespace=namespace)
+    index.save(namespace=namespace)
+    return ids
+
+
+def test_tokenizing_keeps_identifiers_and_numbers():
+    assert tokenizing("Section 3.2: ERR_TIMEOUT, retry!") == ["section", "3", "2", "err_timeout", "retry"]
+
+
+def test_rare_exact_term_ranks_first(tmp_path):
+    index = BM25Index(str(tmp_path))
+    ids = indexing(index, [
+        "the invoice lists the total amount due",
+        "the error code ERR_4711 means the upload timed out",
+        "the amount of the invoice is due in thirty days",
+    ])
+
+    results = index.search("what does ERR_4711 mean", k=2)
+    assert [document.id for document in results][0] == ids[1]
+    assert index.search("weather") == []
+
+
+def test_namespaces_are_isolated(tmp_path):
+    index = BM25Index(str(tmp_path))
+    indexing(index, ["invoices of the default namespace"])
+    named = indexing(index, ["invoices of the tenant named default"], namespace="default")
+
+    assert [document.page_content for document in index.search("invoices", namespace=None)] == ["invoices of the default namespace"]
+    assert [document.id for document in index.search("invoices", namespace="default")] == named
+
+    # Another process loading both namespaces from disk keeps them apart too
+    reloaded = BM25Index(str(tmp_path))
+    assert reloaded.size(namespace=None) == 1
+    assert reloaded.size(namespace="default") == 1
+    assert [document.id for document in reloaded.search("invoices", namespace="default")] == named
+
+
+def test_deleted_chunks_are_no_longer_found(tmp_path):
+    index = BM25Index(str(tmp_path))
+    ids = indexing(index, ["the alpha chunk", "the beta chunk"], namespace="doc")
+    index.delete(ids=[ids[0]], namespace="doc")
+    index.save(namespace="doc")
+
+    assert [document.id for document in BM25Index(str(tmp_path)).search("alpha chunk", namespace="doc")] == [ids[1]]
+
+    index.delete(delete_all=True, namespace="doc")
+    assert index.size(namespace="doc") == 0
+
+
+def test_reciprocal_rank_fusion_favors_documents_ranked_by_both():
+    a, b, c = (Document(id=name, page_content=name) for name in "abc")
+
+    fused = reciprocal_rank_fusion([[a, b], [c, b]], k=3)
+    assert [document.id for document in fused] == ["b", "a", "c"]
+    assert len(reciprocal_rank_fusion([[a, b], [c, b]], k=1)) == 1
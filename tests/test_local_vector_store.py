@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from utils.local_vector_store import LocalVectorStore
+
+K = 5
+
+# The least recall@5 of the quantized scans with rescoring, against the exact float32 search
+MINIMUM_RECALL = {"int8": 0.95, "binary": 0.8}
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    """
+    Clustered dense vectors and noisy copies of some of them as queries, like the quantization benchmark, with the
+    exact top k of every query.
+    """
+    generator = np.random.default_rng(0)
+    size = 256
+    centers = generator.normal(size=(30, size))
+    vectors = centers[generator.integers(0, len(centers), 3000)]
+    vectors = vectors + generator.normal(scale=0.8, size=vectors.shape) + 0.3
+    queries = vectors[generator.integers(0, len(vectors), 100)]
+    queries = queries + generator.normal(scale=0.5, size=queries.shape)
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    exact = [set(np.argsort(-(normalized @ query))[:K].astype(str)) for query in queries]
+    return [str(position) for position in range(len(vectors))], vectors, queries, exact
+
+
+def recall(store, queries, exact):
+    found = [{document.id for document in store.similarity_search_by_vector(query, k=K)} for query in queries]
+    return float(np.mean([len(got & expected) / K for got, expected in zip(found, exact)]))
+
+
+def test_exact_search_matches_float32_top_k(tmp_path, corpus):
+    ids, vectors, queries, exact = corpus
+    store = LocalVectorStore(None, str(tmp_path))
+    store.add_embeddings(list(zip(ids, vectors)), ids=ids)
+
+    assert recall(store, queries, exact) == 1.0
+
+
+@pytest.mark.parametrize("quantization", ["int8", "binary"])
+def test_rescored_quantized_search_recall(tmp_path, corpus, quantization):
+    ids, vectors, queries, exact = corpus
+    store = LocalVectorStore(None, str(tmp_path), quantization=quantization)
+    store.add_embeddings(list(zip(ids, vectors)), ids=ids)
+
+    assert recall(store, queries, exact) >= MINIMUM_RECALL[quantization]
+    assert store.scanned_bytes() < vectors.shape[0] * vectors.shape[1] * 4
+
+
+@pytest.mark.parametrize("quantization", ["int8", "binary"])
+def test_recall_of_batches_appended_and_requantized(tmp_path, corpus, quantization):
+    ids, vectors, queries, exact = corpus
+    store = LocalVectorStore(None, str(tmp_path), quantization=quantization)
+    for start in range(0, len(ids), 500):
+        store.add_embeddings(list(zip(ids[start:start + 500], vectors[start:start + 500])), ids=ids[start:start + 500])
+
+    assert store.vector_count() == len(ids)
+    assert recall(store, queries, exact) >= MINIMUM_RECALL[quantization]
+
+    store.requantizing()
+    assert recall(store, queries, exact) >= MINIMUM_RECALL[quantization]
+
+
+@pytest.mark.parametrize("quantization", [None, "int8", "binary"])
+def test_reopened_store_returns_the_same_results(tmp_path, corpus, quantization):
+    ids, vectors, queries, _ = corpus
+    store = LocalVectorStore(None, str(tmp_path), quantization=quantization)
+    store.add_embeddings(list(zip(ids[:1000], vectors[:1000])), ids=ids[:1000])
+    store.add_embeddings(list(zip(ids[1000:], vectors[1000:])), ids=ids[1000:])
+    store.delete(ids=ids[:10])
+
+    reopened = LocalVectorStore(None, str(tmp_path), quantization=quantization)
+    assert reopened.vector_count() == len(ids) - 10
+    for query in queries[:10]:
+        expected = [document.id for document in store.similarity_search_by_vector(query, k=K)]
+        assert [document.id for document in reopened.similarity_search_by_vector(query, k=K)] == expected
+        assert not set(expected) & set(ids[:10])
+
+
+def test_stored_ids_are_replaced_and_keep_their_metadata(tmp_path):
+    store = LocalVectorStore(None, str(tmp_path))
+    store.add_embeddings([("first", [1.0, 0.0]), ("second", [0.0, 1.0])], metadatas=[{"page": 1}, {"page": 2}], ids=["a", "b"])
+    store.add_embeddings([("first again", [0.0, 1.0])], metadatas=[{"page": 3}], ids=["a"])
+
+    results = store.similarity_search_by_vector([0.0, 1.0], k=2)
+    assert store.vector_count() == 2
+    assert sorted((document.id, document.page_content, document.metadata["page"]) for document in results) == [
+        ("a", "first again", 3), ("b", "second", 2),
+    ]
+
+
+def test_namespaces_are_searched_and_deleted_apart(tmp_path):
+    store = LocalVectorStore(None, str(tmp_path))
+    store.add_embeddings([("default", [1.0, 0.0])], ids=["a"])
+    store.add_embeddings([("tenant", [1.0, 0.0])], ids=["a"], namespace="tenant")
+
+    assert [document.page_content for document in store.similarity_search_by_vector([1.0, 0.0], namespace="tenant")] == ["tenant"]
+    store.delete(delete_all=True, namespace="tenant")
+    assert store.vector_count(namespace="tenant") == 0
+    assert [document.page_content for document in store.similarity_search_by_vector([1.0, 0.0])] == ["default"]
+
+    with pytest.raises(ValueError):
+        store.vector_count(namespace="../escape")
+
+
+def test_writes_of_another_worker_are_picked_up(tmp_path):
+    first = LocalVectorStore(None, str(tmp_path))
+    second = LocalVectorStore(None, str(tmp_path))
+    first.add_embeddings([("one", [1.0, 0.0])], ids=["a"])
+    assert second.vector_count() == 1
+
+    first.add_embeddings([("two", [0.0, 1.0])], ids=["b"])
+    first.delete(ids=["a"])
+    assert [document.id for document in second.similarity_search_by_vector([1.0, 0.0], k=4)] == ["b"]
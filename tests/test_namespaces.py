@@ -0,0 +1,22 @@
+import pytest
+from fastapi import HTTPException
+
+import api
+from utils.shared_state import DEFAULT_NAMESPACE
+
+
+def test_default_namespace_key_is_rejected_as_document_id():
+    with pytest.raises(HTTPException) as raised:
+        api.validating_document_id(DEFAULT_NAMESPACE)
+    assert raised.value.status_code == 400
+
+    api.validating_document_id("default")
+    api.validating_document_id(None)
+
+
+def test_document_named_default_has_its_own_manifest_and_lock(tmp_path, monkeypatch):
+    monkeypatch.setenv("INDEX_MANIFEST_DIR", str(tmp_path / "manifests"))
+    monkeypatch.setenv("INDEX_LOCK_DIR", str(tmp_path / "locks"))
+
+    assert api.manifest_path(None) != api.manifest_path("default")
+    assert api.locking_namespace(None).path != api.locking_namespace("default").path
@@ -0,0 +1,75 @@
+import pytest
+
+import utils.pdf_pipeline
+from benchmarks.corpora import making_pdf
+from utils.pdf_pipeline import _joining_lines, streaming_pdf_pages
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """
+    Starts every test with no extraction pool and shuts down the one it created.
+    """
+    monkeypatch.setattr(utils.pdf_pipeline, "_pool", None)
+    yield
+    if utils.pdf_pipeline._pool is not None:
+        utils.pdf_pipeline._pool.shutdown()
+
+
+def writing_pdf(tmp_path, pages):
+    path = tmp_path / "document.pdf"
+    text = " ".join(f"Sentence {position} of the document." for position in range(pages * 10))
+    path.write_bytes(making_pdf(text, pages=pages, lines_per_page=5))
+    return str(path)
+
+
+def test_pages_are_yielded_in_order_with_their_metadata(tmp_path, pool):
+    path = writing_pdf(tmp_path, pages=7)
+
+    pages = list(streaming_pdf_pages(path, max_workers=2, pages_per_task=2))
+
+    assert [page.metadata for page in pages] == [{"source": path, "page": number, "total_pages": 7} for number in range(7)]
+    assert all("Sentence" in page.page_content for page in pages)
+
+
+def test_small_document_starts_one_worker_per_page_range(tmp_path, pool):
+    list(streaming_pdf_pages(writing_pdf(tmp_path, pages=3), max_workers=8, pages_per_task=8))
+
+    executor = utils.pdf_pipeline._pool
+    assert len(executor._processes) == 1
+    assert executor._mp_context.get_start_method() != "fork"
+
+
+def test_extractions_share_one_pool(tmp_path, pool):
+    path = writing_pdf(tmp_path, pages=3)
+    list(streaming_pdf_pages(path, max_workers=2))
+    executor = utils.pdf_pipeline._pool
+    list(streaming_pdf_pages(path, max_workers=2))
+
+    assert utils.pdf_pipeline._pool is executor
+
+
+def test_abandoned_extraction_leaves_the_pool_usable(tmp_path, pool):
+    path = writing_pdf(tmp_path, pages=9)
+    pages = streaming_pdf_pages(path, max_workers=2, pages_per_task=1)
+    next(pages)
+    pages.close()
+
+    assert len(list(streaming_pdf_pages(path, max_workers=2, pages_per_task=1))) == 9
+
+
+def test_wrapped_lines_are_joined_into_paragraphs():
+    text = (
+        "The first paragraph is wrapped across several lines\n"
+        "of the page, all of about the same width as this one\n"
+        "until it ends.\n"
+        "The second one starts on the next line and goes on\n"
+        "\n"
+        "after an empty line."
+    )
+
+    assert _joining_lines(text).split("\n\n") == [
+        "The first paragraph is wrapped across several lines of the page, all of about the same width as this one until it ends.",
+        "The second one starts on the next line and goes on",
+        "after an empty line.",
+    ]
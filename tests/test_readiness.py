@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from utils.readiness import Readiness
+
+
+def test_requests_are_rejected_until_the_service_is_warmed_up():
+    readiness = Readiness()
+    warming = threading.Event()
+    release = threading.Event()
+
+    def warming_up():
+        warming.set()
+        release.wait(5)
+
+    thread = readiness.starting(lambda: None, warming_up)
+    warming.wait(5)
+
+    assert readiness.status() == {"status": "warming_up"}
+    with pytest.raises(HTTPException) as raised:
+        readiness.requiring()
+    assert raised.value.status_code == 503 and raised.value.headers == {"Retry-After": "1"}
+
+    release.set()
+    thread.join(5)
+    assert readiness.is_ready and readiness.status() == {"status": "ready"}
+    readiness.requiring()
+
+
+def test_failed_warm_up_only_delays_readiness():
+    def warming_up():
+        raise ConnectionError("the llm is unreachable")
+
+    readiness = Readiness()
+    readiness.starting(lambda: None, warming_up).join(5)
+
+    assert readiness.status() == {"status": "ready"}
+
+
+def test_failed_initialization_is_reported():
+    def initializing():
+        raise KeyError("GOOGLE_API_KEY")
+
+    readiness = Readiness()
+    readiness.starting(initializing).join(5)
+
+    assert not readiness.is_ready
+    assert readiness.status() == {"status": "failed", "error": "'GOOGLE_API_KEY'"}
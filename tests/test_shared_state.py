@@ -0,0 +1,88 @@
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from utils.shared_state import FileLock, SharedStore
+
+
+def test_workers_sharing_a_file_see_each_other_s_writes(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    first, second = SharedStore(path), SharedStore(path)
+
+    first.setting_description("report", "A yearly report")
+    first.setting_document_version(None, "v1")
+    first.setting_upload("abc", None, "v1", "A manual")
+    first.setting_upload("abc", "report", "v2", "A yearly report")
+
+    assert second.description("report") == "A yearly report"
+    assert second.document_version(None) == "v1" and second.document_version("report") is None
+    assert [upload["document_id"] for upload in second.uploads("abc")] == ["report", None]
+
+
+def test_replacing_a_description_drops_its_embedding(tmp_path):
+    store = SharedStore(str(tmp_path / "state.sqlite"))
+    store.setting_description("report", "A yearly report")
+    store.setting_anchor("report", np.array([0.6, 0.8], dtype=np.float32))
+
+    assert store.anchor("report").tolist() == np.array([0.6, 0.8], dtype=np.float32).tolist()
+    assert store.description("report") == "A yearly report"
+
+    store.setting_description("report", "A quarterly report")
+    assert store.anchor("report") is None
+
+
+def test_concurrent_workers_never_exceed_the_pending_limit(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    SharedStore(path)
+    added = []
+
+    def submitting():
+        store = SharedStore(path)
+        for _ in range(10):
+            if store.adding_job(uuid.uuid4().hex, max_pending=5, max_finished=10) is None:
+                added.append(1)
+
+    threads = [threading.Thread(target=submitting) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(added) == 5
+
+
+def test_finished_jobs_beyond_the_limit_are_forgotten(tmp_path):
+    store = SharedStore(str(tmp_path / "state.sqlite"))
+    for position in range(4):
+        store.adding_job(f"job-{position}", max_pending=10, max_finished=2)
+        store.adding_progress(f"job-{position}", "pages_parsed", 3)
+        store.updating_job(f"job-{position}", status="done", finished_at=time.time())
+        time.sleep(0.01)
+    store.adding_job("last", max_pending=10, max_finished=2)
+
+    assert store.job("job-0") is None and store.job("job-1") is None
+    assert store.job("job-3")["progress"] == {"pages_parsed": 3}
+
+
+def test_file_lock_excludes_other_holders(tmp_path):
+    path = str(tmp_path / "locks" / "namespace.lock")
+    holders, overlaps = [], []
+
+    def updating():
+        for _ in range(20):
+            with FileLock(path):
+                holders.append(1)
+                if len(holders) > 1:
+                    overlaps.append(1)
+                time.sleep(0.001)
+                holders.pop()
+
+    threads = [threading.Thread(target=updating) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == []
@@ -0,0 +1,327 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from utils.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def waiting_for_followers(flights, key, count, timeout=5.0):
+    """
+    Waits until `count` calls joined the flight of a key, so a test knows they are coalesced before going on.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with flights._lock:
+            flight = flights._flights.get(key)
+            if flight is not None and flight.followers >= count:
+                return
+        time.sleep(0.001)
+    raise AssertionError(f"{count} followers never joined the flight of {key!r}")
+
+
+def starting_thread(target):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(target()), daemon=True)
+    thread.start()
+    return thread, results
+
+
+def test_concurrent_calls_share_one_computation():
+    flights = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def computing():
+        calls.append(1)
+        release.wait(5)
+        return object()
+
+    leader, leader_results = starting_thread(lambda: flights.doing("key", computing))
+    waiting_for_followers(flights, "key", 0)
+    followers = [starting_thread(lambda: flights.doing("key", computing)) for _ in range(3)]
+    waiting_for_followers(flights, "key", 3)
+    release.set()
+
+    for thread, _ in [(leader, leader_results)] + followers:
+        thread.join(5)
+    assert len(calls) == 1
+    assert all(results[0] is leader_results[0] for _, results in followers)
+
+
+def test_error_is_raised_in_every_coalesced_call():
+    flights = SingleFlight("test")
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError("index unavailable")
+
+    def calling():
+        try:
+            flights.doing("key", failing)
+        except RuntimeError as e:
+            return e
+
+    leader, leader_results = starting_thread(calling)
+    waiting_for_followers(flights, "key", 0)
+    follower, follower_results = starting_thread(calling)
+    waiting_for_followers(flights, "key", 1)
+    release.set()
+
+    leader.join(5)
+    follower.join(5)
+    assert str(leader_results[0]) == "index unavailable"
+    assert follower_results[0] is leader_results[0]
+
+
+def test_call_after_landing_computes_again():
+    flights = SingleFlight("test")
+    calls = []
+
+    def computing():
+        calls.append(1)
+        return len(calls)
+
+    assert flights.doing("key", computing) == 1
+    assert flights.doing("key", computing) == 2
+    assert flights._flights == {}
+
+
+@pytest.fixture
+def serving():
+    """
+    Serves an app with uvicorn in a thread, returning its base URL and the thread running its event loop.
+    """
+    servers = []
+
+    def starting(app):
+        config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning")
+        server = uvicorn.Server(config)
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while not server.started and time.monotonic() < deadline:
+            time.sleep(0.01)
+        servers.append((server, thread))
+        port = server.servers[0].sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}", thread
+
+    yield starting
+    for server, thread in servers:
+        server.should_exit = True
+        thread.join(5)
+
+
+def test_leader_disconnect_keeps_the_event_loop_responsive(serving):
+    flights = SingleFlight("test")
+    producing_threads = set()
+
+    def generating():
+        for position in range(10):
+            producing_threads.add(threading.current_thread())
+            yield str(position)
+            time.sleep(0.2)
+
+    app = FastAPI()
+
+    @app.get("/stream")
+    def stream():
+        def events():
+            for piece in flights.streaming("key", generating):
+                yield f"data: {piece}\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/ping")
+    async def ping():
+        return {}
+
+    url, loop_thread = serving(app)
+
+    leader_client = httpx.Client(timeout=10)
+    leader = leader_client.send(leader_client.build_request("GET", f"{url}/stream"), stream=True)
+    assert next(leader.iter_lines()) == "data: 0"
+
+    def following():
+        with httpx.stream("GET", f"{url}/stream", timeout=10) as response:
+            return [line for line in response.iter_lines() if line]
+
+    follower, follower_results = starting_thread(following)
+    waiting_for_followers(flights, "key", 1)
+
+    # The client of the leader disconnects while the follower still waits for the rest of the answer
+    leader.close()
+    leader_client.close()
+
+    latencies = []
+    for _ in range(5):
+        started = time.monotonic()
+        httpx.get(f"{url}/ping", timeout=10).raise_for_status()
+        latencies.append(time.monotonic() - started)
+        time.sleep(0.1)
+
+    follower.join(10)
+    assert max(latencies) < 0.5
+    assert loop_thread not in producing_threads
+    assert follower_results == [[f"data: {position}" for position in range(10)]]
+
+
+def test_stream_is_closed_once_every_caller_left():
+    flights = SingleFlight("test")
+    release = threading.Event()
+    closed = threading.Event()
+    produced = []
+
+    def generating():
+        try:
+            for piece in ["a", "b", "c"]:
+                produced.append(piece)
+                yield piece
+                release.wait(5)
+        finally:
+            closed.set()
+
+    leader = flights.streaming("key", generating)
+    assert next(leader) == "a"
+    leader.close()
+    assert flights._flights == {}
+
+    # The producer closes the iterable after the piece it was waiting for
+    release.set()
+    assert closed.wait(5)
+    assert produced == ["a", "b"]
+
+
+def test_stream_error_reaches_followers_after_the_pieces():
+    flights = SingleFlight("test")
+    release = threading.Event()
+
+    def generating():
+        yield "a"
+        release.wait(5)
+        raise RuntimeError("llm failed")
+
+    def following():
+        pieces = []
+        try:
+            for piece in flights.streaming("key", generating):
+                pieces.append(piece)
+        except RuntimeError as e:
+            return pieces, str(e)
+
+    leader = flights.streaming("key", generating)
+    assert next(leader) == "a"
+    follower, follower_results = starting_thread(following)
+    waiting_for_followers(flights, "key", 1)
+    release.set()
+
+    with pytest.raises(RuntimeError, match="llm failed"):
+        list(leader)
+    follower.join(5)
+    assert follower_results == [(["a"], "llm failed")]
+
+
+def test_late_stream_joiner_after_landing_streams_again():
+    flights = SingleFlight("test")
+    calls = []
+
+    def generating():
+        calls.append(1)
+        yield from ["a", "b"]
+
+    assert list(flights.streaming("key", generating)) == ["a", "b"]
+    assert list(flights.streaming("key", generating)) == ["a", "b"]
+    assert len(calls) == 2
+
+
+def test_async_computation_survives_the_cancelled_leader():
+    async def checking():
+        flights = AsyncSingleFlight("test")
+        release = asyncio.Event()
+        calls = []
+
+        async def computing():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.ensure_future(flights.doing("key", computing))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.doing("key", computing))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await follower == "answer"
+        assert leader.cancelled()
+        assert len(calls) == 1
+        assert flights._flights == {}
+
+    asyncio.run(checking())
+
+
+def test_async_computation_is_cancelled_with_its_last_caller():
+    async def checking():
+        flights = AsyncSingleFlight("test")
+        cancelled = []
+
+        async def computing():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        callers = [asyncio.ensure_future(flights.doing("key", computing)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        assert cancelled == [True]
+        assert flights._flights == {}
+
+    asyncio.run(checking())
+
+
+def test_async_stream_replays_pieces_and_propagates_errors():
+    async def checking():
+        flights = AsyncSingleFlight("test")
+        release = asyncio.Event()
+
+        async def generating():
+            yield "a"
+            await release.wait()
+            yield "b"
+            raise RuntimeError("llm failed")
+
+        async def collecting():
+            pieces = []
+            try:
+                async for piece in flights.streaming("key", generating):
+                    pieces.append(piece)
+            except RuntimeError as e:
+                return pieces, str(e)
+
+        leader = asyncio.ensure_future(collecting())
+        while not flights._flights or not flights._flights["key"].pieces:
+            await asyncio.sleep(0)
+
+        # Joining once "a" was yielded, the follower still receives it
+        follower = asyncio.ensure_future(collecting())
+        await asyncio.sleep(0)
+        assert flights._flights["key"].waiters == 2
+        release.set()
+
+        assert await leader == (["a", "b"], "llm failed")
+        assert await follower == (["a", "b"], "llm failed")
+
+    asyncio.run(checking())
@@ -0,0 +1,30 @@
+import asyncio
+
+from utils.sse import aparsing_events, formatting_event, parsing_events
+
+EVENTS = [("token", {"text": "Hello"}), ("token", {"text": " world\n"}), ("resources", {"links": ["https://example.com"]}), ("done", {})]
+
+
+def lines_of(events):
+    return "".join(formatting_event(event, data) for event, data in events).split("\n")
+
+
+def test_formatted_events_are_parsed_back():
+    assert list(parsing_events(lines_of(EVENTS))) == EVENTS
+
+
+def test_events_are_parsed_from_an_async_stream():
+    async def streaming(lines):
+        for line in lines:
+            yield line
+
+    async def collecting():
+        return [event async for event in aparsing_events(streaming(lines_of(EVENTS)))]
+
+    assert asyncio.run(collecting()) == EVENTS
+
+
+def test_comments_are_ignored_and_an_unterminated_event_is_completed():
+    lines = [": keep-alive", "", "event: error", 'data: {"detail":', 'data: "the llm timed out"}']
+
+    assert list(parsing_events(lines)) == [("error", {"detail": "the llm timed out"})]
@@ -0,0 +1,52 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from utils.telemetry import counting, exporting_metrics, timing, timing_requests
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_stages_are_timed_and_their_errors_counted():
+    durations = sample("rag_stage_duration_seconds_count", stage="test_stage")
+    errors = sample("rag_stage_errors_total", stage="test_stage")
+
+    with timing("test_stage"):
+        pass
+    with pytest.raises(ValueError):
+        with timing("test_stage"):
+            raise ValueError("failed")
+
+    assert sample("rag_stage_duration_seconds_count", stage="test_stage") == durations + 2
+    assert sample("rag_stage_errors_total", stage="test_stage") == errors + 1
+
+
+def test_requests_are_labelled_by_route_template():
+    app = FastAPI()
+    app.middleware("http")(timing_requests)
+
+    @app.get("/test_jobs/{job_id}")
+    def job(job_id):
+        return {"job_id": job_id}
+
+    client = TestClient(app)
+    before = sample("rag_request_duration_seconds_count", method="GET", endpoint="/test_jobs/{job_id}", status="200")
+    client.get("/test_jobs/1")
+    client.get("/test_jobs/2")
+    client.get("/missing")
+
+    assert sample("rag_request_duration_seconds_count", method="GET", endpoint="/test_jobs/{job_id}", status="200") == before + 2
+    assert sample("rag_request_duration_seconds_count", method="GET", endpoint="unmatched", status="404") >= 1
+
+
+def test_metrics_are_exported_in_the_prometheus_format(monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    counting("test_event", 3)
+
+    body, content_type = exporting_metrics()
+
+    assert content_type.startswith("text/plain")
+    assert 'rag_events_total{event="test_event"}' in body.decode("utf-8")
@@ -0,0 +1,93 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from fastapi import HTTPException
+
+import api
+from utils.shared_state import SharedStore
+
+
+class RecordingQueue:
+    """
+    Records the submitted ingestion jobs without running them.
+    """
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, function, *args, **kwargs):
+        self.jobs.append((args, kwargs))
+        return f"job-{len(self.jobs)}"
+
+
+@pytest.fixture
+def services(monkeypatch, tmp_path):
+    monkeypatch.setattr(api, "shared_store", SharedStore(str(tmp_path / "state.sqlite")), raising=False)
+    monkeypatch.setattr(api, "ingestion_jobs", RecordingQueue(), raising=False)
+    monkeypatch.setenv("INDEX_MANIFEST_DIR", str(tmp_path / "manifests"))
+    return api.shared_store, api.ingestion_jobs
+
+
+def receiving(chunks):
+    async def streaming():
+        for chunk in chunks:
+            yield chunk
+
+    return asyncio.run(api.receiving_upload(streaming()))
+
+
+def writing_upload(tmp_path, name="upload.pdf"):
+    path = tmp_path / name
+    path.write_bytes(b"%PDF")
+    return str(path)
+
+
+def test_uploads_are_written_and_hashed_as_they_arrive(monkeypatch):
+    path, sha256 = receiving([b"%PDF-1.4 ", b"content"])
+    try:
+        assert open(path, "rb").read() == b"%PDF-1.4 content"
+        assert sha256 == hashlib.sha256(b"%PDF-1.4 content").hexdigest()
+    finally:
+        os.remove(path)
+
+    monkeypatch.setenv("MAX_UPLOAD_MB", "1")
+    with pytest.raises(HTTPException) as raised:
+        receiving([b"x" * 1024 * 1024, b"x"])
+    assert raised.value.status_code == 413
+
+
+def test_file_already_indexed_in_the_namespace_is_not_ingested_again(tmp_path, services):
+    store, queue = services
+    store.setting_document_version("session", "v1")
+    store.setting_upload("abc", "session", "v1", "A manual")
+    path = writing_upload(tmp_path)
+
+    assert api.submitting_document(path, "abc", "session") == {"document_id": "session", "status": "indexed", "description": "A manual"}
+    assert queue.jobs == [] and not os.path.exists(path)
+    assert api.uploaded_document("ABC", "session")["description"] == "A manual"
+
+
+def test_file_indexed_in_another_namespace_reuses_its_description(tmp_path, services):
+    store, queue = services
+    store.setting_document_version("other", "v1")
+    store.setting_upload("abc", "other", "v1", "A manual")
+
+    result = api.submitting_document(writing_upload(tmp_path), "abc", "session")
+
+    assert result["status"] == "queued"
+    assert queue.jobs[0][1] == {"sha256": "abc", "description": "A manual"}
+    # The namespaces of other sessions are never disclosed
+    with pytest.raises(HTTPException) as raised:
+        api.uploaded_document("abc", "session")
+    assert raised.value.status_code == 404
+
+
+def test_namespace_changed_since_the_upload_is_ingested_again(tmp_path, services):
+    store, queue = services
+    store.setting_upload("abc", "session", "v1", "A manual")
+    store.setting_document_version("session", "v2")
+
+    assert api.submitting_document(writing_upload(tmp_path), "abc", "session")["status"] == "queued"
+    assert queue.jobs[0][1] == {"sha256": "abc", "description": None}
@@ -0,0 +1,99 @@
+import base64
+import io
+import threading
+import wave
+
+import pytest
+
+import voice
+from voice import SpeechStream, cleaning_text, merging_wav, splitting_text
+
+
+def making_clip(frames, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as clip:
+        clip.setnchannels(1)
+        clip.setsampwidth(2)
+        clip.setframerate(rate)
+        clip.writeframes(frames)
+    return buffer.getvalue()
+
+
+class FakeSession:
+    """
+    Answers every synthesis request with a clip of the input text, counting the requests.
+    """
+
+    def __init__(self):
+        self.inputs = []
+        self._lock = threading.Lock()
+
+    def post(self, url, json, headers, timeout):
+        with self._lock:
+            self.inputs.append(json["inputs"][0])
+        audio = base64.b64encode(making_clip(json["inputs"][0].encode("utf-8")[:2] * 10)).decode("ascii")
+        return FakeResponse({"audios": [audio]})
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def session(monkeypatch, tmp_path):
+    fake = FakeSession()
+    _, executor = voice._getting_session()
+    monkeypatch.setattr(voice, "_getting_session", lambda: (fake, executor))
+    monkeypatch.setenv("TTS_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("SARVAM_API_KEY", "test")
+    return fake
+
+
+def test_text_is_cleaned_and_split_within_the_api_limit():
+    assert cleaning_text("**Bold** <b>answer</b>\\## Next line") == "Bold answer \n Next line"
+
+    text = "Short one. " + ", ".join(["a clause of a very long sentence"] * 30) + ". Last one."
+    pieces = splitting_text(text, max_characters=200)
+
+    assert all(len(piece) <= 200 for piece in pieces)
+    assert " ".join(pieces).split() == text.split()
+    assert pieces[0].startswith("Short one. a clause")
+
+
+def test_clips_are_merged_under_one_header():
+    merged = merging_wav([making_clip(b"\x01\x00" * 100), making_clip(b"\x02\x00" * 50)])
+
+    with wave.open(merged, "rb") as clip:
+        assert clip.getnframes() == 150 and clip.getframerate() == 16000
+
+    with pytest.raises(ValueError):
+        merging_wav([making_clip(b"\x00\x00"), making_clip(b"\x00\x00", rate=8000)])
+
+
+def test_streamed_answer_is_synthesized_sentence_by_sentence(session):
+    stream = SpeechStream(group_characters=40)
+    for piece in ["The first ", "sentence. The second ", "sentence is here. And the version 3.", "5 is out. ", "The end"]:
+        stream.feeding(piece)
+    stream.closing()
+    clips = list(stream.clips())
+
+    # The first sentence goes alone, the next ones by groups of at least 40 characters, "3.5" is not cut
+    assert session.inputs[0] == "The first sentence."
+    assert " ".join(session.inputs) == "The first sentence. The second sentence is here. And the version 3.5 is out. The end"
+    assert len(clips) == len(session.inputs) < 5
+
+
+def test_synthesized_clips_are_cached(session):
+    first = voice.synthesizing_clip("Hello there.")
+    second = voice.synthesizing_clip("Hello there.")
+    voice.synthesizing_clip("Hello there.", settings={**voice.VOICE_SETTINGS, "speaker": "arvind"})
+
+    assert first == second
+    assert session.inputs == ["Hello there.", "Hello there."]
@@ -0,0 +1,110 @@
+import http.server
+import ipaddress
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+import api
+import utils.web_crawler
+from utils.web_crawler import HttpPageCache, WebCrawler, checking_address
+
+PAGES = {
+    "/guide/": "<html><body><p>Guide home</p><a href='intro.html'>intro</a><a href='/blog/'>blog</a></body></html>",
+    "/guide/intro.html": "<html><body><p>Introduction</p><a href='/guide/'>home</a></body></html>",
+    "/blog/": "<html><body><p>Blog</p></body></html>",
+}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "http://169.254.169.254/latest/meta-data/")
+            self.end_headers()
+            return
+        if self.path not in PAGES:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = f'"{len(PAGES[self.path])}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(PAGES[self.path].encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    _Handler.requests = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_crawling_follows_links_within_the_section(tmp_path, site):
+    crawler = WebCrawler(HttpPageCache(str(tmp_path)), per_host_interval=0, allow_private_hosts=True)
+    pages = crawler.crawling([f"{site}/guide/"], max_pages=10)
+
+    assert [page["url"] for page in pages] == [f"{site}/guide/", f"{site}/guide/intro.html"]
+    assert [page["status"] for page in pages] == ["fetched", "fetched"]
+    assert "Introduction" in pages[1]["text"]
+
+
+def test_unchanged_pages_are_revalidated(tmp_path, site):
+    crawler = WebCrawler(HttpPageCache(str(tmp_path)), per_host_interval=0, allow_private_hosts=True)
+    first = crawler.fetching(f"{site}/guide/intro.html")
+    second = crawler.fetching(f"{site}/guide/intro.html")
+
+    assert first["status"] == "fetched"
+    assert second["status"] == "not_modified"
+    assert second["text"] == first["text"]
+
+
+@pytest.mark.parametrize("address", ["127.0.0.1", "10.1.2.3", "172.16.0.1", "192.168.1.1", "169.254.169.254", "::1", "fe80::1", "::ffff:127.0.0.1"])
+def test_non_public_addresses_are_refused(address):
+    with pytest.raises(ValueError):
+        checking_address(address)
+
+
+def test_private_hosts_are_refused_by_default(tmp_path, site):
+    crawler = WebCrawler(HttpPageCache(str(tmp_path)), per_host_interval=0)
+    pages = crawler.crawling([f"{site}/guide/", "http://localhost:8080/", "http://169.254.169.254/latest/meta-data/"])
+
+    assert [page["status"] for page in pages] == ["failed", "failed", "failed"]
+    assert _Handler.requests == []
+
+
+def test_redirects_to_private_hosts_are_refused(tmp_path, site, monkeypatch):
+    # Taking the test server for a public host, the redirect target still is not one
+    def checking_only_link_local(address):
+        if ipaddress.ip_address(address).is_link_local:
+            raise ValueError(f"{address} is not a public address")
+
+    monkeypatch.setattr(utils.web_crawler, "checking_address", checking_only_link_local)
+    crawler = WebCrawler(HttpPageCache(str(tmp_path)), per_host_interval=0)
+
+    with pytest.raises(ValueError, match="169.254.169.254"):
+        crawler.fetching(f"{site}/redirect")
+    assert _Handler.requests == ["/redirect"]
+
+
+def test_article_upload_of_a_private_url_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "crawler", WebCrawler(HttpPageCache(str(tmp_path))), raising=False)
+
+    with pytest.raises(HTTPException) as raised:
+        api.submitting_articles(["http://169.254.169.254/latest/meta-data/"], None)
+    assert raised.value.status_code == 400
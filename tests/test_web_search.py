@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+from utils.web_search import StubSearchBackend, WebSearcher
+
+
+class ScriptedBackend:
+    """
+    Answers searches with the given results, or fails or hangs when told to, counting the searches.
+    """
+
+    def __init__(self, results):
+        self.answers = results
+        self.queries = []
+        self.error = None
+        self.release = threading.Event()
+        self.release.set()
+
+    def results(self, query, max_results):
+        self.queries.append(query)
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return self.answers
+
+
+def test_results_are_cached_by_normalized_query():
+    backend = ScriptedBackend([{"title": "Guide", "link": "https://example.com/guide"}])
+    searcher = WebSearcher(backend)
+
+    assert searcher.searching("Pruning  Apple Trees") == [("Guide", "https://example.com/guide")]
+    assert searcher.searching("pruning apple trees ") == [("Guide", "https://example.com/guide")]
+    assert asyncio.run(searcher.asearching("PRUNING apple trees")) == [("Guide", "https://example.com/guide")]
+    assert backend.queries == ["pruning apple trees"]
+
+
+def test_malformed_results_are_skipped():
+    backend = ScriptedBackend([
+        {"title": "", "link": "https://example.com/untitled"},
+        {"title": "Relative", "link": "/relative"},
+        {"title": "No link"},
+        {"title": " Kept ", "link": " https://example.com/kept "},
+    ])
+
+    assert WebSearcher(backend).searching("query") == [("Kept", "https://example.com/kept")]
+
+
+def test_results_are_limited_to_max_results():
+    assert len(WebSearcher(StubSearchBackend(), max_results=3).searching("query")) == 3
+
+
+def test_slow_or_failing_searches_fall_back_on_expired_results():
+    backend = ScriptedBackend([{"title": "Old", "link": "https://example.com/old"}])
+    searcher = WebSearcher(backend, timeout=0.2, ttl=0)
+    searcher.searching("query")
+
+    backend.release.clear()
+    assert searcher.searching("query") == [("Old", "https://example.com/old")]
+    assert asyncio.run(searcher.asearching("other query")) == []
+    backend.release.set()
+
+    backend.error = ConnectionError("unreachable")
+    assert searcher.searching("query") == [("Old", "https://example.com/old")]
+    assert searcher.searching("unknown query") == []
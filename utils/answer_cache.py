@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Caches generated answers by the embedding of the query, so that a repeated or paraphrased question is answered
+    without retrieval and without an LLM call.
+
+    Entries are partitioned by document, document version and profession; a lookup only compares the query with the
+    entries of its own partition. Entries expire after `ttl` seconds and the least recently used ones are evicted
+    once the cache holds `max_entries` answers.
+
+    Attributes:
+        threshold (float): The minimum cosine similarity between two queries for them to share an answer.
+        max_entries (int): The maximum number of cached answers.
+        ttl (float): The number of seconds an answer stays valid.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=1024, ttl=3600.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # Least recently used order of every entry, mapping the entry key to its partition
+        self._recency = OrderedDict()
+        # Entries of every partition, mapping the entry key to (query vector, answer, creation time)
+        self._partitions = {}
+        self._lock = threading.Lock()
+        self._next_key = 0
+
+    def _removing(self, key):
+        partition = self._recency.pop(key)
+        entries = self._partitions[partition]
+        del entries[key]
+        if not entries:
+            del self._partitions[partition]
+
+    def lookup(self, query_vector, document_id, document_version, profession):
+        """
+        Returns the cached answer of the most similar earlier query, if it is similar enough.
+
+        Args:
+            query_vector (list): The embedding of the query.
+            document_id (str | None): The document the query is about.
+            document_version (str | None): The version of the document's content.
+            profession (str): The profession the answer was tailored to.
+
+        Returns:
+            str | None: The cached answer, or None on a miss.
+        """
+        partition = (document_id, document_version, profession)
+        now = time.monotonic()
+
+        with self._lock:
+            entries = self._partitions.get(partition)
+            if not entries:
+                return None
+
+            # Dropping the expired entries of the partition before comparing
+            for key in [key for key, (_, _, created_at) in entries.items() if now - created_at > self.ttl]:
+                self._removing(key)
+            if partition not in self._partitions:
+                return None
+
+            keys = list(entries)
+            matrix = np.stack([entries[key][0] for key in keys])
+
+            query = np.asarray(query_vector, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            scores = matrix @ query
+
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+
+            self._recency.move_to_end(keys[best])
+            return entries[keys[best]][1]
+
+    def store(self, query_vector, answer, document_id, document_version, profession):
+        """
+        Caches the answer generated for a query.
+
+        Args:
+            query_vector (list): The embedding of the query.
+            answer (str): The generated answer.
+            document_id (str | None): The document the query is about.
+            document_version (str | None): The version of the document's content.
+            profession (str): The profession the answer was tailored to.
+        """
+        partition = (document_id, document_version, profession)
+
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+
+            self._partitions.setdefault(partition, OrderedDict())[key] = (vector, answer, time.monotonic())
+            self._recency[key] = partition
+
+            while len(self._recency) > self.max_entries:
+                self._removing(next(iter(self._recency)))
+
+    def invalidate(self, document_id):
+        """
+        Drops every cached answer about the given document, whatever its version.
+
+        Args:
+            document_id (str | None): The re-ingested document.
+        """
+        with self._lock:
+            for key in [key for key, partition in self._recency.items() if partition[0] == document_id]:
+                self._removing(key)
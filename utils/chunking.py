@@ -0,0 +1,137 @@
+import re
+import time
+
+from langchain_core.documents import Document
+
+from utils.context_packing import CHARACTERS_PER_TOKEN
+
+# Ends of sentences (after '.', '!' or '?' and any closing quote or bracket) and line breaks; a blank line is a
+# paragraph break
+BREAK_PATTERN = re.compile(r"(?<=[.!?])[\"'”’)\]]*\s+|\n\s*")
+
+
+class Chunker:
+    """
+    Divides documents into chunks of about `chunk_tokens` tokens, cutting only between sentences, and between
+    paragraphs when one ends in the second half of a chunk. Consecutive chunks share their last and first sentences
+    within `overlap_tokens` tokens.
+
+    Texts are scanned once with precompiled patterns into sentence boundaries, the chunks are sized from these
+    offsets and only the final chunks are copied out of the text. Tokens are estimated from the length of the text,
+    like the context packing does.
+
+    The chunker counts what it processes, see `throughput`.
+
+    Attributes:
+        chunk_tokens (int): The maximum number of tokens of a chunk.
+        overlap_tokens (int): The maximum number of tokens shared by consecutive chunks.
+    """
+
+    def __init__(self, chunk_tokens=256, overlap_tokens=32):
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+
+        self.documents = 0
+        self.characters = 0
+        self.chunks = 0
+        self.chunk_characters = 0
+        self.seconds = 0.0
+
+    def _sentences(self, text, max_characters):
+        """
+        Returns the (start, end, starts_paragraph) spans of the sentences of a text, the end including the spaces
+        after the sentence. Sentences longer than `max_characters` are cut between words.
+        """
+        spans = []
+
+        def adding(start, end, paragraph):
+            while end - start > max_characters:
+                cut = text.rfind(" ", start + 1, start + max_characters)
+                cut = cut + 1 if cut > start else start + max_characters
+                spans.append((start, cut, paragraph))
+                start, paragraph = cut, False
+            spans.append((start, end, paragraph))
+
+        start, paragraph = 0, True
+        for match in BREAK_PATTERN.finditer(text):
+            adding(start, match.end(), paragraph)
+            start = match.end()
+            # A break spanning a blank line ends the paragraph
+            paragraph = match.group().count("\n") >= 2
+        if start < len(text):
+            adding(start, len(text), paragraph)
+        return spans
+
+    def _splitting_text(self, text):
+        """
+        Returns the chunks of a single text.
+        """
+        max_characters = self.chunk_tokens * CHARACTERS_PER_TOKEN
+        overlap_characters = self.overlap_tokens * CHARACTERS_PER_TOKEN
+        spans = self._sentences(text, max_characters)
+
+        chunks = []
+        first = 0
+        while first < len(spans):
+            start = spans[first][0]
+
+            # Taking sentences while they fit, stopping early at a paragraph break past the middle of the chunk
+            last = first + 1
+            while last < len(spans) and spans[last][1] - start <= max_characters:
+                if spans[last][2] and spans[last - 1][1] - start >= max_characters // 2:
+                    break
+                last += 1
+
+            chunk = text[start:spans[last - 1][1]].strip()
+            if chunk:
+                chunks.append(chunk)
+            if last >= len(spans):
+                break
+
+            # Starting the next chunk with the last sentences of this one, within the overlap
+            next_first = last
+            while next_first - 1 > first and spans[last - 1][1] - spans[next_first - 1][0] <= overlap_characters:
+                next_first -= 1
+            first = next_first
+
+        return chunks
+
+    def splitting(self, documents):
+        """
+        Divides documents into chunks, every chunk keeping the metadata of its document, e.g. its source and page.
+
+        Args:
+            documents (list): The Documents to be divided.
+
+        Returns:
+            list: The Document chunks, in document order.
+        """
+        started = time.perf_counter()
+        chunks = []
+        for document in documents:
+            self.documents += 1
+            self.characters += len(document.page_content)
+            for text in self._splitting_text(document.page_content):
+                chunks.append(Document(page_content=text, metadata=dict(document.metadata)))
+                self.chunk_characters += len(text)
+
+        self.chunks += len(chunks)
+        self.seconds += time.perf_counter() - started
+        return chunks
+
+    def throughput(self):
+        """
+        Returns what the chunker processed so far and how fast.
+
+        Returns:
+            dict: The numbers of documents, characters and chunks, the average estimated tokens of a chunk, the seconds
+            spent chunking and the characters chunked per second.
+        """
+        return {
+            "documents": self.documents,
+            "characters": self.characters,
+            "chunks": self.chunks,
+            "tokens_per_chunk": round(self.chunk_characters / CHARACTERS_PER_TOKEN / self.chunks, 1) if self.chunks else 0,
+            "seconds": round(self.seconds, 4),
+            "characters_per_second": round(self.characters / self.seconds) if self.seconds else 0,
+        }
@@ -0,0 +1,142 @@
+import math
+
+from langchain_core.documents import Document
+
+from utils.keyword_index import tokenizing
+
+# Average number of characters per token of the Gemini tokenizer on English text
+CHARACTERS_PER_TOKEN = 4
+
+
+def estimating_tokens(text):
+    """
+    Estimates the number of tokens a text takes in a prompt, without calling a tokenizer.
+
+    Args:
+        text (str): The text to be measured.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+
+def _overlap(left, right, min_overlap=20):
+    """
+    Returns the length of the longest suffix of `left` which is also a prefix of `right`, or 0 if it is shorter than
+    `min_overlap` characters.
+    """
+    for length in range(min(len(left), len(right)), min_overlap - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def _shingles(text, size=3):
+    tokens = tokenizing(text)
+    if len(tokens) < size:
+        return {tuple(tokens)}
+    return {tuple(tokens[position:position + size]) for position in range(len(tokens) - size + 1)}
+
+
+def _containment(candidate, passage):
+    """
+    Returns the share of the candidate shingles which also appear in the passage.
+    """
+    if not candidate:
+        return 1.0
+    return len(candidate & passage) / len(candidate)
+
+
+class _Block:
+    """
+    A run of consecutive chunks of the same page merged into one text, ranked like its most relevant chunk.
+    """
+
+    def __init__(self, text, metadata, rank):
+        self.text = text
+        self.metadata = dict(metadata)
+        self.rank = rank
+        self.key = (metadata.get("source"), metadata.get("page"))
+        self.shingles = _shingles(text)
+
+    def merging(self, text, rank):
+        """
+        Merges a text into the block if it is contained in it, or extends it on either side.
+
+        Returns:
+            bool: True if the text was merged.
+        """
+        if text in self.text:
+            merged = self.text
+        elif self.text in text:
+            merged = text
+        elif _overlap(self.text, text):
+            merged = self.text + text[_overlap(self.text, text):]
+        elif _overlap(text, self.text):
+            merged = text + self.text[_overlap(text, self.text):]
+        else:
+            return False
+
+        if merged != self.text:
+            self.text = merged
+            self.shingles = _shingles(merged)
+        self.rank = min(self.rank, rank)
+        return True
+
+
+def packing_context(documents, token_budget=2000, duplicate_threshold=0.8):
+    """
+    Assembles the retrieved chunks into the context passed to the llm.
+
+    Overlapping chunks of the same page are merged into a single passage, so the text they share is sent once, and
+    passages which are near-duplicates of a more relevant one are dropped. The passages keep the relevance order of
+    their best chunk and are added until the token budget is spent, the last one being cut at a word boundary.
+
+    Args:
+        documents (list): The retrieved Documents, ordered from the most to the least relevant.
+        token_budget (int, optional): The maximum estimated number of tokens of the context. Default is 2000.
+        duplicate_threshold (float, optional): The share of its word trigrams a passage must have in common with a
+            more relevant one to be dropped as a near-duplicate. Default is 0.8.
+
+    Returns:
+        list: The packed Documents, ordered from the most to the least relevant.
+    """
+    blocks = []
+
+    for rank, document in enumerate(documents):
+        text = document.page_content.strip()
+        if not text:
+            continue
+        key = (document.metadata.get("source"), document.metadata.get("page"))
+
+        merged_into = next((block for block in blocks if block.key == key and block.merging(text, rank)), None)
+        if merged_into is None:
+            candidate = _Block(text, document.metadata, rank)
+            if any(_containment(candidate.shingles, block.shingles) >= duplicate_threshold for block in blocks):
+                continue
+            blocks.append(candidate)
+            continue
+
+        # An extended block may now bridge the gap to another block of the same page
+        for block in [block for block in blocks if block is not merged_into and block.key == key]:
+            if merged_into.merging(block.text, block.rank):
+                blocks.remove(block)
+
+    blocks.sort(key=lambda block: block.rank)
+
+    packed = []
+    remaining = token_budget
+    for block in blocks:
+        tokens = estimating_tokens(block.text)
+        if tokens > remaining:
+            # Cutting the passage which overflows the budget at the last word that fits
+            text = block.text[:remaining * CHARACTERS_PER_TOKEN].rsplit(" ", 1)[0]
+            if text and (not packed or estimating_tokens(text) >= 50):
+                packed.append(Document(page_content=text, metadata=block.metadata))
+            break
+
+        packed.append(Document(page_content=block.text, metadata=block.metadata))
+        remaining -= tokens
+
+    return packed
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.embedding_client import reporting_embedded
+from utils.telemetry import counting, logging_event
+
+
+def normalizing_text(text):
+    """
+    Normalizes a chunk of text so that insignificant differences (unicode forms, spacing) map to the same cache key.
+
+    Args:
+        text (str): The chunk text.
+
+    Returns:
+        str: The normalized text.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a persistent, content-addressed cache of document embeddings.
+
+    Every vector is stored under the SHA-256 of the embedding model name and the normalized chunk text, as raw
+    float32 bytes in a SQLite file. Only texts missing from the cache are sent to the wrapped model. When the cache
+    grows past `max_entries`, the least recently used vectors are evicted.
+
+    Attributes:
+        embeddings (Embeddings): The wrapped embedding model.
+        model_name (str): The embedding model name, part of every cache key.
+        max_entries (int): The maximum number of vectors kept in the cache.
+    """
+
+    def __init__(self, embeddings, cache_path="/tmp/rag-embedding-cache.sqlite", model_name=None, max_entries=100_000):
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, "model", type(embeddings).__name__)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        cache_directory = os.path.dirname(cache_path)
+        if cache_directory:
+            os.makedirs(cache_directory, exist_ok=True)
+
+        # In WAL mode, the worker processes of the API share the file without lookups waiting for each other's writes
+        self._connection = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._counting_entries()
+        self._connection.commit()
+
+    def _counting_entries(self):
+        """
+        Keeps the number of cached vectors in a table of its own, so that stores check the size bound without a scan.
+
+        The count is updated by triggers in the same transactions as the vectors, which keeps it exact for every process
+        sharing the file. The table is created and filled with a single scan, the first time the cache is opened.
+        """
+        self._connection.execute("BEGIN IMMEDIATE")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings_count (id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL)")
+        self._connection.execute("INSERT OR IGNORE INTO embeddings_count (id, entries) SELECT 0, COUNT(*) FROM embeddings")
+        self._connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_inserted AFTER INSERT ON embeddings "
+            "BEGIN UPDATE embeddings_count SET entries = entries + 1 WHERE id = 0; END"
+        )
+        self._connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_deleted AFTER DELETE ON embeddings "
+            "BEGIN UPDATE embeddings_count SET entries = entries - 1 WHERE id = 0; END"
+        )
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{normalizing_text(text)}".encode("utf-8")).digest()
+
+    def _lookup(self, keys):
+        """
+        Fetches the cached vectors for the given keys and marks them as recently used.
+
+        Args:
+            keys (list): The cache keys to look up.
+
+        Returns:
+            dict: A mapping from every cached key to its vector.
+        """
+        found = {}
+        unique_keys = list(set(keys))
+
+        with self._lock:
+            # Querying in slices to stay below SQLite's limit on bound parameters
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+
+            if found:
+                now = time.time()
+                self._connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self._connection.commit()
+
+        return found
+
+    def _store(self, keys, vectors):
+        """
+        Stores the given vectors and evicts the least recently used ones if the cache is over its size bound.
+
+        Args:
+            keys (list): The cache keys.
+            vectors (list): The vectors to be stored, one for every key.
+        """
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in zip(keys, vectors)]
+
+        with self._lock:
+            # Updating the vectors already cached in place, so that only new keys fire the counting trigger
+            self._connection.executemany(
+                "INSERT INTO embeddings (key, vector, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET vector = excluded.vector, last_used = excluded.last_used",
+                rows,
+            )
+
+            overflow = self._connection.execute("SELECT entries FROM embeddings_count").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._connection.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (overflow,)
+                )
+            self._connection.commit()
+
+    def store(self, texts, vectors):
+        """
+        Adds already computed document embeddings to the cache.
+
+        Args:
+            texts (list): The embedded texts.
+            vectors (list): The embedding of every text.
+        """
+        self._store([self._key(text) for text in texts], vectors)
+
+    def embed_documents(self, texts):
+        """
+        Embeds the given texts, calling the wrapped model only for texts that are not cached yet.
+
+        Args:
+            texts (list): The texts to be embedded.
+
+        Returns:
+            list: The embedding of every text, in the same order.
+        """
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(keys)
+
+        # Embedding every distinct missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        counting("embedding_cache_hit", len(cached))
+        # The cached texts are embedded at once, the missing ones are reported by the wrapped model batch by batch
+        reporting_embedded(sum(1 for key in keys if key in cached))
+        if missing:
+            counting("embedding_cache_miss", len(missing))
+            logging_event("embedding_cache", hits=len(cached), misses=len(missing))
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            # A wrapped model storing its batches into this cache as they complete already stored the missing vectors
+            if getattr(self.embeddings, "on_batch_embedded", None) != self.store:
+                self._store(list(missing), vectors)
+            cached.update(zip(missing, vectors))
+
+        return [list(cached[key]) for key in keys]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,213 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+
+from langchain_core.embeddings import Embeddings
+
+from utils.telemetry import counting, logging_event, timing
+
+
+# HTTP status codes of temporary server errors
+TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+
+# The progress callback of the ingestion running in the current context, which the embedding models shared by every
+# ingestion report the chunks they embed to
+embedding_progress = ContextVar("embedding_progress", default=None)
+
+
+def reporting_embedded(count, progress=None):
+    """
+    Reports embedded chunks as "chunks_embedded" to the progress callback of the current ingestion, if any.
+
+    Args:
+        count (int): The number of chunks embedded.
+        progress (callable, optional): The callback to report to, read from the calling context when the chunks were
+            embedded by another thread. Default is None, the callback of the current context.
+    """
+    progress = progress or embedding_progress.get()
+    if progress and count:
+        progress("chunks_embedded", count)
+
+
+def _chain(error):
+    """
+    Yields an exception and the exceptions it was raised from, e.g. the `google.api_core` error wrapped by
+    LangChain's GoogleGenerativeAIError.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def _status_codes(error):
+    """
+    Yields the HTTP status codes carried by an exception and by the exceptions it was raised from.
+    """
+    for cause in _chain(error):
+        for code in (getattr(cause, "code", None), getattr(cause, "status_code", None),
+                     getattr(getattr(cause, "response", None), "status_code", None)):
+            # `google.api_core` errors carry an HTTPStatus, which is an int
+            if isinstance(code, int):
+                yield int(code)
+
+
+def is_rate_limit_error(error):
+    """
+    Tells whether an exception raised by the embedding API is a rate limit or quota response.
+
+    The Gemini client wraps the HTTP error in its own exception types, so the check relies on the status code of the
+    exception or of the exceptions it was raised from, never on its message.
+
+    Args:
+        error (Exception): The raised exception.
+
+    Returns:
+        bool: True if the request was rejected for exceeding the rate limit.
+    """
+    return 429 in _status_codes(error)
+
+
+def is_transient_error(error):
+    """
+    Tells whether an exception raised by the embedding API is worth retrying.
+
+    Args:
+        error (Exception): The raised exception.
+
+    Returns:
+        bool: True for rate limits, timeouts, connection failures and temporary server errors.
+    """
+    if any(code == 429 or code in TRANSIENT_STATUS_CODES for code in _status_codes(error)):
+        return True
+    # Timeouts and connection failures of the standard library, requests, httpx and gRPC
+    return any(isinstance(cause, (TimeoutError, ConnectionError)) or "Timeout" in type(cause).__name__
+               or type(cause).__name__ in ("ConnectError", "ConnectionError", "DeadlineExceeded", "ServiceUnavailable")
+               for cause in _chain(error))
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model to embed large lists of texts in fixed size batches, several of them in flight at once.
+
+    Rate limit responses raise a delay shared by all in-flight batches, which doubles on every 429 and shrinks again
+    as requests succeed, so the client settles close to the provider quota instead of failing the whole upload.
+    Every successful batch is handed to `on_batch_embedded`, which lets a cache keep the finished part of an upload
+    when a later batch fails for good.
+
+    Attributes:
+        embeddings (Embeddings): The wrapped embedding model.
+        batch_size (int): The number of texts sent in one request.
+        max_concurrency (int): The number of batches in flight at the same time.
+        max_retries (int): The number of retries of a batch on transient errors before giving up.
+        on_batch_embedded (callable): Called with the texts and vectors of every successfully embedded batch.
+    """
+
+    def __init__(self, embeddings, batch_size=100, max_concurrency=4, max_retries=6, max_backoff=60.0, on_batch_embedded=None):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.on_batch_embedded = on_batch_embedded
+
+        self._delay = 0.0
+        self._delay_lock = threading.Lock()
+
+    @property
+    def model(self):
+        return getattr(self.embeddings, "model", type(self.embeddings).__name__)
+
+    def _adjusting_delay(self, rate_limited):
+        """
+        Doubles the shared delay after a rate limit response and shrinks it after a successful request.
+
+        Args:
+            rate_limited (bool): Whether the last request was rejected for exceeding the rate limit.
+
+        Returns:
+            float: The new shared delay in seconds.
+        """
+        with self._delay_lock:
+            if rate_limited:
+                self._delay = min(max(1.0, self._delay * 2), self.max_backoff)
+            else:
+                self._delay = self._delay / 2 if self._delay > 0.1 else 0.0
+            return self._delay
+
+    def _calling_with_retries(self, function, *args):
+        """
+        Calls the embedding API, backing off and retrying on transient errors.
+
+        Args:
+            function (callable): The embedding method of the wrapped model.
+
+        Returns:
+            list: The value returned by the embedding method.
+        """
+        for attempt in range(self.max_retries + 1):
+            # Honouring the shared delay so concurrent batches slow down together after a rate limit
+            if self._delay:
+                time.sleep(self._delay * random.uniform(0.5, 1.0))
+
+            try:
+                result = function(*args)
+                self._adjusting_delay(rate_limited=False)
+                return result
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient_error(e):
+                    raise
+
+                delay = self._adjusting_delay(rate_limited=is_rate_limit_error(e))
+                counting("embedding_retry")
+                logging_event("embedding_retry", level=logging.WARNING, error=str(e), attempt=attempt + 1, max_retries=self.max_retries, delay=round(delay, 1))
+                if not delay:
+                    time.sleep(min(2 ** attempt, self.max_backoff) * random.uniform(0.5, 1.0))
+
+    def _embedding_batch(self, texts, progress=None):
+        with timing("embedding_batch"):
+            vectors = self._calling_with_retries(self.embeddings.embed_documents, texts)
+        if self.on_batch_embedded:
+            self.on_batch_embedded(texts, vectors)
+        reporting_embedded(len(texts), progress)
+        return vectors
+
+    def embed_documents(self, texts):
+        """
+        Embeds the given texts in batches, with up to `max_concurrency` batches in flight.
+
+        Args:
+            texts (list): The texts to be embedded.
+
+        Returns:
+            list: The embedding of every text, in the same order.
+
+        Raises:
+            Exception: The error of the first batch that failed for good. Batches still queued are cancelled.
+        """
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1:
+            return self._embedding_batch(texts) if texts else []
+
+        # The batches run in other threads, which do not see the progress callback of the caller's context
+        progress = embedding_progress.get()
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+            futures = [executor.submit(self._embedding_batch, batch, progress) for batch in batches]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+
+            failed = [future for future in done if future.exception() is not None]
+            if failed:
+                # Dropping the queued batches, the ones already running still finish and reach `on_batch_embedded`
+                for future in not_done:
+                    future.cancel()
+                raise failed[0].exception()
+
+        return [vector for future in futures for vector in future.result()]
+
+    def embed_query(self, text):
+        with timing("query_embedding"):
+            return self._calling_with_retries(self.embeddings.embed_query, text)
@@ -1,45 +1,111 @@
-import requests
-from bs4 import BeautifulSoup
-
-def extract_text_from_web(url):
-    # Send an HTTP request to get the webpage content
-    response = requests.get(url)
-    
-    # Parse the HTML content with BeautifulSoup
-    soup = BeautifulSoup(response.content, 'html.parser')
-    
-    tags_to_avoid = [
-        "script", "style", "header", "footer", "nav", 
-        "aside", "form", "button", "iframe", "noscript", 
-        "input", "select", "option", "link", "meta", 
-        "img", "video", "audio", "advertising", "noscript"
-    ]
-
-    # Remove script, style, and other irrelevant tags
-    for script in soup(tags_to_avoid):
-        script.extract()  # Remove these tags from the soup
-    
-    # Extract the article body by identifying important sections
-    text = ''
-    
-    # Try to find the main content
-    if soup.body:
-        # Finding the main content, usually within <article>, <div> tags with relevant class
-        article = soup.find_all(['article', 'div', 'section', 'p'])
-        for section in article:
-            text += section.get_text(separator=" ", strip=True) + " "
+from lxml import etree
+
+# Elements whose content is never part of the article text
+TAGS_TO_AVOID = {
+    "script", "style", "header", "footer", "nav",
+    "aside", "form", "button", "iframe", "noscript",
+    "input", "select", "option", "link", "meta",
+    "img", "video", "audio", "svg", "canvas",
+    "template", "figure", "menu", "dialog",
+}
+
+# Elements starting a new paragraph of text, so that words of consecutive blocks are never glued together
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "br", "li", "ul", "ol", "dl", "dt", "dd",
+    "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "table", "tr", "td", "th",
+}
+
+# Containers whose class names and ID are checked against the usual page furniture
+CONTAINER_TAGS = {"div", "section", "span", "ul", "ol"}
+
+# Marks the boundaries of blocks in the extracted pieces, the newlines of the HTML source being mere whitespace
+BLOCK_BREAK = "\x00"
+
+# Whole class names and IDs of the usual page furniture: cookie banners, share buttons, comments, related links...
+BOILERPLATE_NAMES = {
+    "cookie", "cookies", "cookie-banner", "cookie-consent", "consent", "banner", "advert", "advertisement", "ad",
+    "ads", "sponsor", "sponsored", "promo", "newsletter", "subscribe", "share", "sharing", "social", "social-share",
+    "comments", "comment-list", "related", "related-posts", "recommended", "breadcrumb", "breadcrumbs", "sidebar",
+    "navbar", "menu", "popup", "modal", "footer", "site-footer", "header", "site-header",
+}
+
+
+def _is_boilerplate(element):
+    if not isinstance(element.tag, str) or element.tag.lower() in TAGS_TO_AVOID:
+        return True
+    if element.get("hidden") is not None or element.get("aria-hidden") == "true":
+        return True
+    if element.tag.lower() not in CONTAINER_TAGS:
+        return False
+
+    # Matching whole names only, wrappers such as "has-sidebar" or "ad-free" hold the article itself
+    names = element.get("class", "").lower().split() + [element.get("id", "").lower()]
+    return any(name in BOILERPLATE_NAMES for name in names)
 
-    # Clean the text further, remove excess whitespace
-    cleaned_text = ' '.join(text.split())
-    
-    return cleaned_text
 
-# Example URL to extract text from
-# url = 'https://www.geeksforgeeks.org/get-all-text-of-the-page-using-selenium-in-python/'
-# extracted_text = extract_text_from_web(url)
+def _content_root(document):
+    """
+    Returns the element holding the main content of the page: its <main> element, its only <article> element, or
+    its body.
+    """
+    main = document.find(".//main")
+    if main is not None:
+        return main
 
-# with open("web_text.txt", 'w') as f:
-#     f.write(extracted_text)
+    articles = document.findall(".//article")
+    if len(articles) == 1:
+        return articles[0]
 
-# # Display the extracted text
-# print(len(extracted_text))
+    body = document.find(".//body")
+    return body if body is not None else document
+
+
+def extract_text_from_html(chunks, links=None):
+    """
+    Extracts the readable text of an HTML page.
+
+    The page is parsed incrementally as its chunks arrive and the tree is then walked once, emitting every text node
+    exactly once, so the work and the output are linear in the size of the page. Scripts, styles, navigation and
+    other boilerplate subtrees are skipped without being visited.
+
+    Args:
+        chunks (iterable): The bytes of the page, in one or more pieces.
+        links (list, optional): When given, the href of every link of the page, navigation included, is appended to
+            it. Default is None.
+
+    Returns:
+        str: The text of the page, one paragraph per block of text with its whitespace collapsed, separated by blank
+        lines.
+    """
+    parser = etree.HTMLParser(remove_comments=True, remove_pis=True, no_network=True, huge_tree=True)
+    for chunk in chunks:
+        parser.feed(chunk)
+    document = parser.close()
+    if document is None:
+        return ""
+
+    if links is not None:
+        links.extend(anchor.get("href") for anchor in document.iterfind(".//a[@href]"))
+
+    pieces = []
+    root = _content_root(document)
+    walker = etree.iterwalk(root, events=("start", "end"))
+    for event, element in walker:
+        if event == "start":
+            if element is not root and _is_boilerplate(element):
+                walker.skip_subtree()
+                continue
+            if isinstance(element.tag, str) and element.tag.lower() in BLOCK_TAGS:
+                pieces.append(BLOCK_BREAK)
+            if element.text:
+                pieces.append(element.text)
+        else:
+            if isinstance(element.tag, str) and element.tag.lower() in BLOCK_TAGS:
+                pieces.append(BLOCK_BREAK)
+            # The text following an element belongs to its parent, even when the element itself was skipped
+            if element.tail and element is not root:
+                pieces.append(element.tail)
+
+    # Clean the text further, remove excess whitespace
+    blocks = (" ".join(block.split()) for block in "".join(pieces).split(BLOCK_BREAK))
+    return "\n\n".join(block for block in blocks if block)
@@ -0,0 +1,255 @@
+import hashlib
+import itertools
+import json
+import os
+import logging
+import time
+
+from utils.embedding_cache import normalizing_text
+from utils.embedding_client import embedding_progress
+from utils.telemetry import logging_event, timing
+
+
+def chunk_id(text):
+    """
+    Derives a stable ID for a chunk from its normalized content, so the same chunk always maps to the same vector.
+
+    Args:
+        text (str): The chunk text.
+
+    Returns:
+        str: A hex digest identifying the chunk.
+    """
+    return hashlib.sha256(normalizing_text(text).encode("utf-8")).hexdigest()[:32]
+
+
+def content_version(ids):
+    """
+    Derives a version tag of a document from the IDs of its chunks, so it only changes when the content changes.
+
+    Args:
+        ids (iterable): The chunk IDs of the document.
+
+    Returns:
+        str: A hex digest identifying this version of the document.
+    """
+    return hashlib.sha256("\n".join(sorted(ids)).encode("utf-8")).hexdigest()[:16]
+
+
+def loading_manifest(manifest_path):
+    """
+    Loads the set of chunk IDs currently stored in the index.
+
+    Args:
+        manifest_path (str): The path of the JSON manifest file.
+
+    Returns:
+        set | None: The stored chunk IDs, or None if no manifest was written yet.
+    """
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "r") as f:
+        return set(json.load(f)["ids"])
+
+
+def loading_sources(manifest_path):
+    """
+    Loads the chunk IDs of every source of the document, e.g. of every page of a crawled site.
+
+    Args:
+        manifest_path (str): The path of the JSON manifest file.
+
+    Returns:
+        dict: The list of chunk IDs of every source, empty if no manifest was written yet.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path, "r") as f:
+        return json.load(f).get("sources", {})
+
+
+def saving_manifest(manifest_path, ids, sources=None):
+    """
+    Persists the set of chunk IDs currently stored in the index.
+
+    Args:
+        manifest_path (str): The path of the JSON manifest file.
+        ids (set): The stored chunk IDs.
+        sources (dict, optional): The list of chunk IDs of every source of the document. Default is None.
+    """
+    manifest_directory = os.path.dirname(manifest_path)
+    if manifest_directory:
+        os.makedirs(manifest_directory, exist_ok=True)
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({"ids": sorted(ids), "sources": sources or {}}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def counting_vectors(vector_store, namespace=None):
+    """
+    Returns the number of vectors stored in a namespace of the index.
+
+    Args:
+        vector_store (PineconeVectorStore | LocalVectorStore): The vector store to inspect.
+        namespace (str, optional): The namespace to count. Default is None, the default namespace.
+
+    Returns:
+        int: The number of stored vectors.
+    """
+    if hasattr(vector_store, "vector_count"):
+        return vector_store.vector_count(namespace=namespace)
+
+    summary = vector_store.index.describe_index_stats().namespaces.get(namespace or "")
+    return summary.vector_count if summary else 0
+
+
+def waiting_for_vector_count(vector_store, expected_count, namespace=None, timeout=30.0, interval=0.5):
+    """
+    Polls the index until it reports the expected number of vectors, instead of sleeping for a fixed time.
+
+    Args:
+        vector_store (PineconeVectorStore | LocalVectorStore): The vector store to poll.
+        expected_count (int): The number of vectors the namespace should hold once all writes are visible.
+        namespace (str, optional): The namespace to poll. Default is None, the default namespace.
+        timeout (float, optional): The maximum number of seconds to wait. Default is 30.
+        interval (float, optional): The initial delay between polls in seconds, doubled up to 4 seconds. Default is 0.5.
+
+    Returns:
+        bool: True if the index reached the expected count before the timeout.
+    """
+    deadline = time.monotonic() + timeout
+
+    while True:
+        if counting_vectors(vector_store, namespace=namespace) == expected_count:
+            return True
+        if time.monotonic() >= deadline:
+            logging_event("index_wait_timeout", level=logging.WARNING, namespace=namespace, expected_count=expected_count, timeout=timeout)
+            return False
+
+        time.sleep(interval)
+        interval = min(interval * 2, 4.0)
+
+
+def syncing_chunks_to_index(vector_store, chunks, manifest_path, namespace=None, batch_size=64, progress=None, keyword_index=None,
+                            unchanged_sources=None):
+    """
+    Brings a namespace of the index in line with the given chunks: new chunks are upserted, chunks which are no
+    longer part of the document are deleted and unchanged chunks are left alone.
+
+    Args:
+        vector_store (PineconeVectorStore | LocalVectorStore): The vector store holding the document.
+        chunks (iterable): The Document chunks of the new version of the document.
+        manifest_path (str): The path of the JSON manifest listing the chunk IDs stored in the namespace.
+        namespace (str, optional): The namespace holding the document. Default is None, the default namespace.
+        batch_size (int, optional): The number of chunks upserted per call. Default is 64.
+        progress (callable, optional): Called with "chunks_upserted" and a count after every upserted batch, and with
+            "chunks_embedded" by the embedding models as they embed the chunks. Default is None.
+        keyword_index (BM25Index, optional): A keyword index kept in line with the vector store. Default is None.
+        unchanged_sources (dict, optional): The sources whose content did not change since the last sync, mapped to a
+            function returning their chunks. The chunk IDs the manifest records for a source are kept as they are, its
+            chunks are only computed if the manifest does not know them. Default is None.
+
+    Returns:
+        dict: The number of chunks "added", "deleted" and "unchanged", the "total" count now in the namespace and the
+        content "version" of the document.
+    """
+    stored_ids = loading_manifest(manifest_path)
+    stored_sources = loading_sources(manifest_path)
+
+    if stored_ids is None:
+        # Without a manifest the content of the index is unknown, so it is rebuilt from scratch
+        try:
+            vector_store.delete(delete_all=True, namespace=namespace)
+        except Exception:
+            logging_event("namespace_already_empty", namespace=namespace)
+        stored_ids = set()
+
+    # A keyword index out of step with the manifest (e.g. created after the document was first ingested) is rebuilt
+    # from every chunk of the document, not only from the new ones
+    rebuilding_keywords = keyword_index is not None and keyword_index.size(namespace) != len(stored_ids)
+    if rebuilding_keywords:
+        keyword_index.delete(delete_all=True, namespace=namespace)
+
+    seen_ids = set()
+    sources = {}
+    added = 0
+    batch, batch_ids = [], []
+
+    # Keeping the chunks of the unchanged sources without chunking them again, unless the manifest does not record
+    # them all or the keyword index needs their text
+    for source, chunking in (unchanged_sources or {}).items():
+        ids = stored_sources.get(source)
+        if ids and not rebuilding_keywords and stored_ids.issuperset(ids):
+            sources[source] = dict.fromkeys(ids)
+            seen_ids.update(ids)
+        else:
+            chunks = itertools.chain(chunks, chunking())
+
+    def upserting_batch():
+        # Vectors are embedded by the vector store as part of the upsert call, so the span covers both, and the
+        # embedding models report the chunks they embed along the way
+        token = embedding_progress.set(progress)
+        try:
+            with timing("upsert_batch"):
+                vector_store.add_documents(batch, ids=batch_ids, namespace=namespace)
+        finally:
+            embedding_progress.reset(token)
+
+        # Recording the upserted vectors at once, so that if the sync fails later on, the next one still knows about
+        # them and deletes them unless they are part of the document
+        stored_ids.update(batch_ids)
+        saving_manifest(manifest_path, stored_ids, stored_sources)
+        if keyword_index is not None and not rebuilding_keywords:
+            keyword_index.add_documents(batch, ids=batch_ids, namespace=namespace)
+        if progress:
+            progress("chunks_upserted", len(batch))
+
+    for chunk in chunks:
+        identifier = chunk_id(chunk.page_content)
+
+        # Every source lists all of its chunks, including the ones another source repeats, so it can be kept alone
+        source = chunk.metadata.get("source")
+        if source is not None:
+            sources.setdefault(source, {})[identifier] = None
+
+        # Skipping chunks which are already indexed or repeat within the document
+        if identifier in seen_ids:
+            continue
+        seen_ids.add(identifier)
+        if rebuilding_keywords:
+            keyword_index.add_documents([chunk], ids=[identifier], namespace=namespace)
+        if identifier in stored_ids:
+            continue
+
+        batch.append(chunk)
+        batch_ids.append(identifier)
+        if len(batch) == batch_size:
+            upserting_batch()
+            added += len(batch)
+            batch, batch_ids = [], []
+
+    if batch:
+        upserting_batch()
+        added += len(batch)
+
+    stale_ids = sorted(stored_ids - seen_ids)
+    # Deleting in slices, Pinecone accepts at most 1000 IDs per delete call
+    for start in range(0, len(stale_ids), 1000):
+        vector_store.delete(ids=stale_ids[start:start + 1000], namespace=namespace)
+
+    if keyword_index is not None:
+        keyword_index.delete(ids=stale_ids, namespace=namespace)
+        keyword_index.save(namespace=namespace)
+
+    saving_manifest(manifest_path, seen_ids, {source: list(ids) for source, ids in sources.items()})
+
+    return {
+        "added": added,
+        "deleted": len(stale_ids),
+        "unchanged": len(seen_ids) - added,
+        "total": len(seen_ids),
+        "version": content_version(seen_ids),
+    }
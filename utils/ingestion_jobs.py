@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.shared_state import SharedStore
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the queue already holds its maximum number of pending jobs.
+    """
+
+
+class IngestionJobQueue:
+    """
+    Runs ingestion jobs on a bounded pool of worker threads and keeps track of their status and progress.
+
+    Jobs are tracked in a `SharedStore`, so when the service runs several worker processes sharing the same store,
+    a job queued by one of them can be polled on any of them. Every queue records that it is alive every
+    `heartbeat_interval` seconds, and the jobs of a queue not seen for `stale_after` seconds, e.g. of a worker that
+    crashed or restarted, are marked as failed.
+
+    Attributes:
+        max_workers (int): The number of jobs processed at the same time.
+        max_pending (int): The maximum number of queued or running jobs, further submissions are rejected.
+        max_finished (int): The number of finished jobs whose status is kept around for polling.
+        store (SharedStore): Where the status and progress of the jobs are kept. Default is a store private to the process.
+        heartbeat_interval (float): The number of seconds between two records that the queue is alive.
+        stale_after (float): The number of seconds after which the jobs of a queue not seen are marked as failed.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32, max_finished=1000, store=None, heartbeat_interval=10.0, stale_after=60.0):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.store = store or SharedStore(":memory:")
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+
+        # Unique even when a restarted worker gets the process ID of the previous one
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+
+        self.store.reaping_jobs(stale_after)
+        threading.Thread(target=self._beating, name="ingestion-heartbeat", daemon=True).start()
+
+    def _beating(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                self.store.beating(self._owner)
+            except Exception:
+                traceback.print_exc()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues a job. The function is called with the given arguments and a `progress` keyword argument, a callable
+        taking a stage name and a count to add to that stage.
+
+        Args:
+            function (callable): The ingestion function to run in the background.
+
+        Returns:
+            str: The ID of the queued job.
+
+        Raises:
+            QueueFullError: If `max_pending` jobs are already queued or running.
+        """
+        job_id = uuid.uuid4().hex
+
+        self.store.reaping_jobs(self.stale_after)
+        pending = self.store.adding_job(job_id, max_pending=self.max_pending, max_finished=self.max_finished, owner=self._owner)
+        if pending is not None:
+            raise QueueFullError(f"{pending} ingestion jobs are already pending, try again later")
+
+        self._executor.submit(self._run, job_id, function, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, function, args, kwargs):
+        self.store.updating_job(job_id, status="running")
+
+        def progress(stage, count=1):
+            self.store.adding_progress(job_id, stage, count)
+
+        try:
+            result = function(*args, progress=progress, **kwargs)
+            self.store.updating_job(job_id, status="done", result=result, finished_at=time.time())
+        except Exception as e:
+            traceback.print_exc()
+            self.store.updating_job(job_id, status="failed", error=str(e), finished_at=time.time())
+
+    def get(self, job_id):
+        """
+        Returns a snapshot of the job's status, progress and result.
+
+        Args:
+            job_id (str): The ID returned by `submit`.
+
+        Returns:
+            dict | None: The job snapshot, or None if the job is unknown.
+        """
+        self.store.reaping_jobs(self.stale_after)
+        return self.store.job(job_id)
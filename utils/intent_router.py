@@ -0,0 +1,87 @@
+import re
+
+import numpy as np
+
+from utils.shared_state import SharedStore
+
+# Messages made only of a greeting (or thanks), optionally addressed to someone and punctuated
+GREETING_PATTERN = re.compile(
+    r"^\s*(hi+|hello+|hey+|hiya|howdy|namaste|greetings|yo|good\s+(morning|afternoon|evening|day)|"
+    r"what'?s\s+up|how\s+are\s+you(\s+doing)?|thanks?(\s+you)?|thank\s+you(\s+so\s+much)?)"
+    r"[\s!.,?]*(there|everyone|all|buddy|friend|bot|chatbot)?[\s!.,?]*$",
+    re.IGNORECASE,
+)
+
+GREETING_REPLY = (
+    "Hello! I am your RAG ChatBOT. Upload a PDF from the sidebar and ask me anything about it, "
+    "I will answer from its content or point you to useful resources."
+)
+
+
+class IntentRouter:
+    """
+    Classifies obvious queries without calling the llm, so they skip the ReAct agent.
+
+    Greetings are recognized by a pattern. Other queries are embedded and compared with the embedding of the
+    document description: a query very close to the document goes straight to the Vector Database, one far from it
+    straight to the web search. Everything in between is left to the agent.
+
+    Attributes:
+        embeddings (Embeddings): The embedding model used for queries and descriptions.
+        document_threshold (float): The cosine similarity above which a query is about the document.
+        web_threshold (float): The cosine similarity below which a query is unrelated to the document.
+        store (SharedStore): Where the embeddings of the descriptions are kept, so that every worker process of the
+            agent routes with them. Default is a store private to the process.
+    """
+
+    def __init__(self, embeddings, document_threshold=0.75, web_threshold=0.45, store=None):
+        self.embeddings = embeddings
+        self.document_threshold = document_threshold
+        self.web_threshold = web_threshold
+        self.store = store or SharedStore(":memory:")
+
+    def setting_document(self, document_id, description):
+        """
+        Embeds the description of a document, which later queries about it are compared with.
+
+        Args:
+            document_id (str | None): The document the description belongs to.
+            description (str): The description of the document.
+        """
+        vector = np.asarray(self.embeddings.embed_query(description), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        self.store.setting_anchor(document_id, vector)
+
+    async def routing(self, query, document_id):
+        """
+        Picks the tool answering the query, if the choice is obvious.
+
+        Args:
+            query (str): The user's input query.
+            document_id (str | None): The document the query is about.
+
+        Returns:
+            str | None: "Greetings", "Database Call" or "Web Searching", or None to let the agent decide.
+        """
+        if GREETING_PATTERN.match(query):
+            return "Greetings"
+
+        anchor = self.store.anchor(document_id)
+        if anchor is None:
+            # Embedding the description on first use when it was stored without its embedding, e.g. by the API
+            description = self.store.description(document_id)
+            if not description:
+                return None
+            anchor = np.asarray(await self.embeddings.aembed_query(description), dtype=np.float32)
+            anchor /= np.linalg.norm(anchor) or 1.0
+            self.store.setting_anchor(document_id, anchor)
+
+        vector = np.asarray(await self.embeddings.aembed_query(query), dtype=np.float32)
+        similarity = float(anchor @ vector) / (float(np.linalg.norm(vector)) or 1.0)
+
+        if similarity >= self.document_threshold:
+            return "Database Call"
+        if similarity <= self.web_threshold:
+            return "Web Searching"
+        return None
@@ -0,0 +1,225 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from langchain_core.documents import Document
+
+from utils.shared_state import DEFAULT_NAMESPACE
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenizing(text):
+    """
+    Splits a text into lowercase word tokens, keeping numbers and identifiers such as "3.2" as separate tokens.
+
+    Args:
+        text (str): The text to be tokenized.
+
+    Returns:
+        list: The tokens of the text.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class _KeywordNamespace:
+    """
+    The chunks of a single namespace along with the inverted index BM25 scores them with.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.chunks = {}
+        self.postings = {}
+        self.total_length = 0
+        self.signature = self._signature()
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for chunk_id, chunk in json.load(f).items():
+                    self.adding(chunk_id, chunk["text"], chunk["metadata"])
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def changed_on_disk(self):
+        """
+        Tells whether another process saved the namespace since it was loaded or saved by this one.
+        """
+        return self._signature() != self.signature
+
+    def adding(self, chunk_id, text, metadata):
+        if chunk_id in self.chunks:
+            self.removing(chunk_id)
+
+        frequencies = Counter(tokenizing(text))
+        length = sum(frequencies.values())
+        self.chunks[chunk_id] = {"text": text, "metadata": metadata, "length": length, "frequencies": frequencies}
+        self.total_length += length
+
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[chunk_id] = frequency
+
+    def removing(self, chunk_id):
+        chunk = self.chunks.pop(chunk_id, None)
+        if chunk is None:
+            return
+
+        self.total_length -= chunk["length"]
+        for term in chunk["frequencies"]:
+            postings = self.postings[term]
+            del postings[chunk_id]
+            if not postings:
+                del self.postings[term]
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({chunk_id: {"text": chunk["text"], "metadata": chunk["metadata"]} for chunk_id, chunk in self.chunks.items()}, f)
+        os.replace(self.path + ".tmp", self.path)
+        self.signature = self._signature()
+
+
+class BM25Index:
+    """
+    A local inverted index scoring chunks with Okapi BM25, kept next to the vector store so that exact terms such as
+    identifiers, section numbers and rare words are matched even when the embeddings miss them.
+
+    Chunks are partitioned into namespaces like the vector store, and every namespace is persisted as a JSON file
+    which is re-indexed in memory the first time the namespace is used, and again when another process saved it.
+
+    Attributes:
+        directory (str): The folder where the namespaces are persisted.
+        k1 (float): The BM25 term frequency saturation.
+        b (float): The BM25 document length normalization.
+    """
+
+    def __init__(self, directory="/tmp/rag-bm25-index", k1=1.5, b=0.75):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+
+        self._namespaces = {}
+        self._lock = threading.RLock()
+
+    def _namespace(self, namespace):
+        with self._lock:
+            # Re-indexing a namespace saved by another process since it was loaded, e.g. by another worker of the API
+            if namespace not in self._namespaces or self._namespaces[namespace].changed_on_disk():
+                self._namespaces[namespace] = _KeywordNamespace(os.path.join(self.directory, f"{namespace or DEFAULT_NAMESPACE}.json"))
+            return self._namespaces[namespace]
+
+    def add_documents(self, documents, ids, namespace=None):
+        """
+        Indexes the given chunks, replacing the ones already stored under the same IDs.
+
+        Args:
+            documents (list): The Document chunks to be indexed.
+            ids (list): The ID of every chunk.
+            namespace (str, optional): The namespace the chunks are stored in. Default is None.
+        """
+        with self._lock:
+            storage = self._namespace(namespace)
+            for chunk_id, document in zip(ids, documents):
+                storage.adding(chunk_id, document.page_content, dict(document.metadata))
+
+    def delete(self, ids=None, delete_all=None, namespace=None):
+        """
+        Removes chunks from the index, mirroring the `delete` signature of the vector stores.
+
+        Args:
+            ids (list, optional): The IDs of the chunks to be removed. Default is None.
+            delete_all (bool, optional): Removes every chunk of the namespace when True. Default is None.
+            namespace (str, optional): The namespace to remove from. Default is None.
+        """
+        with self._lock:
+            storage = self._namespace(namespace)
+            for chunk_id in list(storage.chunks) if delete_all else ids or []:
+                storage.removing(chunk_id)
+
+    def save(self, namespace=None):
+        """
+        Persists a namespace, to be called once a batch of changes is complete.
+        """
+        with self._lock:
+            self._namespace(namespace).save()
+
+    def size(self, namespace=None):
+        """
+        Returns the number of chunks indexed in a namespace.
+        """
+        return len(self._namespace(namespace).chunks)
+
+    def search(self, query, k=5, namespace=None):
+        """
+        Retrieves the chunks of a namespace with the highest BM25 score for the query.
+
+        Args:
+            query (str): The input query.
+            k (int, optional): Indicates top results to choose. Default is 5.
+            namespace (str, optional): The namespace to search. Default is None.
+
+        Returns:
+            list: A list of Documents ordered from the highest to the lowest score, chunks sharing no term with the
+            query are left out.
+        """
+        with self._lock:
+            storage = self._namespace(namespace)
+            count = len(storage.chunks)
+            if not count:
+                return []
+            average_length = storage.total_length / count
+
+            # Only the chunks containing a query term are ever scored
+            scores = Counter()
+            for term in set(tokenizing(query)):
+                postings = storage.postings.get(term)
+                if not postings:
+                    continue
+
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, frequency in postings.items():
+                    length = storage.chunks[chunk_id]["length"]
+                    scores[chunk_id] += idf * frequency * (self.k1 + 1) / (
+                        frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                    )
+
+            return [
+                Document(id=chunk_id, page_content=storage.chunks[chunk_id]["text"], metadata=storage.chunks[chunk_id]["metadata"])
+                for chunk_id, _ in scores.most_common(k)
+            ]
+
+
+def reciprocal_rank_fusion(rankings, k=5, constant=60):
+    """
+    Merges several rankings of Documents into one, scoring every Document by the sum of 1 / (constant + rank) over
+    the rankings it appears in.
+
+    Args:
+        rankings (list): The rankings to merge, each a list of Documents ordered from the most to the least relevant.
+        k (int, optional): Indicates top results to choose. Default is 5.
+        constant (int, optional): Dampens the weight of the top ranks. Default is 60.
+
+    Returns:
+        list: The top k Documents of the merged ranking.
+    """
+    scores = Counter()
+    documents = {}
+
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = document.id or document.page_content
+            scores[key] += 1 / (constant + rank)
+            documents.setdefault(key, document)
+
+    return [documents[key] for key, _ in scores.most_common(k)]
@@ -0,0 +1,610 @@
+import json
+import os
+import re
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+QUANTIZATIONS = ("int8", "binary")
+
+# Rows converted or compared at once by the quantized scans, few enough for their temporary copies to stay in cache
+BLOCK_ROWS = 2048
+
+# The number of bits set in every byte value, for NumPy versions without `bitwise_count`
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+class _LocalNamespace:
+    """
+    The vectors of a single namespace, persisted in its own folder: the L2 normalized embeddings as raw float32 rows,
+    the ID, text and metadata of every row as JSON lines and, optionally, the quantized rows. Every file is only ever
+    appended to and is opened memory-mapped, so storing a batch writes that batch alone and the embeddings are read
+    from disk as they are needed.
+
+    A small state file, replaced last on every write, tells how many rows of the files are committed, so the rows of
+    a write interrupted by a crash are ignored and overwritten by the next one. Deleting rows rewrites the files
+    under a new generation name, which the state then points to.
+    """
+
+    def __init__(self, directory, quantization=None):
+        self.directory = directory
+        self.quantization = quantization
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        self.positions = {}
+        self.matrix = None
+        self.quantized = None
+        self.state = None
+        self.signature = None
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Retrying when a concurrent rewrite removes the files of the generation being loaded
+        for attempt in range(3):
+            try:
+                self._load()
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+
+    @property
+    def _state_path(self):
+        return os.path.join(self.directory, "state.json")
+
+    def _path(self, name, state=None):
+        return os.path.join(self.directory, f"{name}-{(state or self.state)['generation']}")
+
+    def _signature(self):
+        """
+        Identifies the persisted version of the namespace by the inode, size and modification time of its state file,
+        which every write replaces last.
+        """
+        try:
+            stat = os.stat(self._state_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def changed_on_disk(self):
+        """
+        Tells whether another process saved the namespace since it was loaded or saved by this one.
+        """
+        return self._signature() != self.signature
+
+    def _load(self):
+        """
+        Loads the committed chunks and memory-maps the committed embeddings and quantized rows, if there are any.
+        """
+        self.signature = self._signature()
+        if self.signature is None:
+            self._migrating()
+            return
+
+        with open(self._state_path, "r") as f:
+            state = json.load(f)
+
+        with open(self._path("chunks.jsonl", state), "rb") as f:
+            lines = f.read(state["chunks_bytes"]).splitlines()
+
+        self.ids, self.texts, self.metadatas = [], [], []
+        for line in lines:
+            chunk = json.loads(line)
+            self.ids.append(chunk["id"])
+            self.texts.append(chunk["text"])
+            self.metadatas.append(chunk["metadata"])
+        self.positions = {identifier: position for position, identifier in enumerate(self.ids)}
+        self.state = state
+        self._mapping()
+
+    def _migrating(self):
+        """
+        Converts a namespace saved as a single `.npy` matrix and `chunks.json` file, the earlier layout.
+        """
+        matrix_path, chunks_path = os.path.join(self.directory, "embeddings.npy"), os.path.join(self.directory, "chunks.json")
+        if not (os.path.exists(matrix_path) and os.path.exists(chunks_path)):
+            return
+
+        with open(chunks_path, "r") as f:
+            chunks = json.load(f)
+        matrix = np.load(matrix_path, mmap_mode="r") if chunks["ids"] else None
+        self.rewriting(chunks["ids"], chunks["texts"], chunks["metadatas"], matrix)
+        for path in (matrix_path, chunks_path):
+            os.remove(path)
+
+    def _mapping(self):
+        """
+        Memory-maps the committed rows of the embeddings and of the quantized embeddings.
+        """
+        count, dimension = self.state["count"], self.state["dimension"]
+        self.matrix = np.memmap(self._path("embeddings.f32"), dtype=np.float32, mode="r", shape=(count, dimension)) if count else None
+
+        self.quantized = None
+        if self.quantization is None or not count:
+            return
+
+        if self.state.get("quantization") == self.quantization:
+            self.quantized = {name: np.memmap(self._path(f"{self.quantization}-{name}"), dtype=dtype, mode="r",
+                                              shape=(self.state["quantized_count"], *shape))
+                              for name, dtype, shape in _quantized_files(self.quantization, dimension)}
+            if self.quantization == "binary":
+                self.quantized["center"] = np.fromfile(self._path("binary-center"), dtype=np.float32)
+            quantized_count = self.state["quantized_count"]
+        else:
+            self.quantized, quantized_count = None, 0
+
+        # Quantizing in memory the rows stored by a process with quantization disabled or set otherwise
+        if quantized_count < count:
+            center = self.quantized.get("center") if self.quantized else None
+            missing = _quantizing(self.matrix[quantized_count:], self.quantization, center=center)
+            self.quantized = missing if self.quantized is None else {
+                name: array if name == "center" else np.concatenate([array, missing[name]]) for name, array in self.quantized.items()
+            }
+
+    def _committing(self, state):
+        """
+        Replaces the state file, which makes the rows it counts visible to every process.
+        """
+        with open(self._state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self._state_path + ".tmp", self._state_path)
+        self.state = state
+        self.signature = self._signature()
+
+    def appending(self, ids, texts, metadatas, vectors):
+        """
+        Stores new rows after the committed ones, quantizing only the new rows.
+
+        Args:
+            ids (list): The IDs of the rows, none of them stored yet.
+            texts (list): The chunk texts of the rows.
+            metadatas (list): The metadata dictionaries of the rows.
+            vectors (numpy.ndarray): The L2 normalized embeddings of the rows.
+        """
+        if self.state is None or not self.ids:
+            self.rewriting(ids, texts, metadatas, vectors)
+            return
+        if vectors.shape[1] != self.state["dimension"]:
+            raise ValueError(f"Can not store embeddings of {vectors.shape[1]} dimensions with embeddings of {self.state['dimension']}")
+        if self.quantization and (self.state.get("quantization") != self.quantization or self.state["quantized_count"] != len(self.ids)):
+            # Quantizing every row once, the stored quantized rows being of another kind or missing some rows
+            self.rewriting(self.ids + list(ids), self.texts + list(texts), self.metadatas + list(metadatas),
+                           np.concatenate([self.matrix, vectors]))
+            return
+
+        count = len(self.ids)
+        state = dict(self.state)
+        lines = "".join(json.dumps({"id": identifier, "text": text, "metadata": metadata}) + "\n"
+                        for identifier, text, metadata in zip(ids, texts, metadatas)).encode("utf-8")
+
+        _appending_bytes(self._path("embeddings.f32"), count * vectors.shape[1] * 4, vectors.tobytes())
+        _appending_bytes(self._path("chunks.jsonl"), state["chunks_bytes"], lines)
+        state["chunks_bytes"] += len(lines)
+
+        if self.quantization:
+            quantized = _quantizing(vectors, self.quantization, center=self.quantized.get("center"))
+            for name, dtype, shape in _quantized_files(self.quantization, vectors.shape[1]):
+                row_bytes = int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+                _appending_bytes(self._path(f"{self.quantization}-{name}"), count * row_bytes, quantized[name].tobytes())
+            state["quantized_count"] = count + len(ids)
+
+        state["count"] = count + len(ids)
+        self._committing(state)
+
+        self.ids.extend(ids)
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+        self.positions.update((identifier, count + offset) for offset, identifier in enumerate(ids))
+        self._mapping()
+
+    def rewriting(self, ids, texts, metadatas, matrix, centering=False):
+        """
+        Writes the given rows as a new generation of the files, replacing every stored row.
+
+        Args:
+            ids (list): The IDs of the rows.
+            texts (list): The chunk texts of the rows.
+            metadatas (list): The metadata dictionaries of the rows.
+            matrix (numpy.ndarray | None): The L2 normalized embeddings of the rows, possibly memory-mapped.
+            centering (bool, optional): Computes the center of the binary codes again, instead of keeping the one
+                computed when the namespace was first written. Default is False.
+        """
+        previous = self.state
+        count = len(ids)
+        state = {"generation": os.urandom(8).hex(), "count": count, "dimension": matrix.shape[1] if count else 0,
+                 "chunks_bytes": 0, "quantization": self.quantization, "quantized_count": 0}
+
+        with open(self._path("embeddings.f32", state), "wb") as f:
+            for start in range(0, count, BLOCK_ROWS):
+                f.write(np.ascontiguousarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32).tobytes())
+
+        with open(self._path("chunks.jsonl", state), "wb") as f:
+            for identifier, text, metadata in zip(ids, texts, metadatas):
+                state["chunks_bytes"] += f.write((json.dumps({"id": identifier, "text": text, "metadata": metadata}) + "\n").encode("utf-8"))
+
+        if self.quantization and count:
+            center = None
+            if self.quantization == "binary":
+                kept = self.quantized.get("center") if self.quantized and not centering else None
+                center = kept if kept is not None and len(kept) == matrix.shape[1] else _centering(matrix)
+                center.astype(np.float32).tofile(self._path("binary-center", state))
+
+            files = {name: open(self._path(f"{self.quantization}-{name}", state), "wb")
+                     for name, _, _ in _quantized_files(self.quantization, matrix.shape[1])}
+            try:
+                for start in range(0, count, BLOCK_ROWS):
+                    quantized = _quantizing(matrix[start:start + BLOCK_ROWS], self.quantization, center=center)
+                    for name, f in files.items():
+                        f.write(quantized[name].tobytes())
+            finally:
+                for f in files.values():
+                    f.close()
+            state["quantized_count"] = count
+
+        self._committing(state)
+        self.ids, self.texts, self.metadatas = list(ids), list(texts), [dict(metadata) for metadata in metadatas]
+        self.positions = {identifier: position for position, identifier in enumerate(self.ids)}
+        self._mapping()
+
+        # Processes which mapped the previous files keep reading them until they reload
+        if previous is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(f"-{previous['generation']}"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def keeping(self, positions):
+        """
+        Keeps only the rows at the given positions, rewriting the files.
+
+        Args:
+            positions (list): The positions of the rows to keep, in order.
+        """
+        self.rewriting([self.ids[position] for position in positions], [self.texts[position] for position in positions],
+                       [self.metadatas[position] for position in positions],
+                       _SelectedRows(self.matrix, np.asarray(positions, dtype=np.int64)) if positions else None)
+
+
+class _SelectedRows:
+    """
+    Some rows of a memory-mapped matrix, read block by block as they are sliced instead of all at once.
+    """
+
+    def __init__(self, matrix, positions):
+        self.matrix = matrix
+        self.positions = positions
+        self.shape = (len(positions), matrix.shape[1])
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, rows):
+        return self.matrix[self.positions[rows]]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    An in-process vector store that keeps chunk embeddings in a NumPy matrix and answers queries with a
+    vectorized cosine top-k. The matrix is persisted as a file of raw rows, appended to batch by batch and opened
+    memory-mapped, so a restarted server can serve queries without embedding the document again.
+
+    Like Pinecone, vectors are partitioned into namespaces; every namespace lives in its own sub-folder and
+    searches only ever scan the requested one.
+
+    For large corpora the embeddings can be quantized: searches then scan a compact copy of the matrix held in
+    memory, int8 codes (4x smaller) or binary codes compared by Hamming distance (32x smaller), and rescore their
+    best `k * rescore_factor` candidates with the exact embeddings, of which only these rows are read from the
+    memory-mapped matrix. Only the rows of every new batch are quantized; the center of the binary codes is computed
+    from the first rows written, until `requantizing` computes it again from every row.
+
+    Attributes:
+        directory (str): The folder where the embeddings matrices and chunk texts are persisted.
+        quantization (str | None): "int8", "binary", or None to scan the exact embeddings.
+        rescore_factor (int): The number of candidates rescored per result when the embeddings are quantized.
+    """
+
+    def __init__(self, embedding, directory="/tmp/rag-local-index", quantization=None, rescore_factor=10):
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization!r}, expected one of {', '.join(QUANTIZATIONS)}")
+
+        self._embedding = embedding
+        self.directory = directory
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self._lock = threading.RLock()
+        self._namespaces = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def _namespace(self, namespace):
+        """
+        Returns the storage of the given namespace, loading it from disk the first time it is used and again whenever
+        another process, e.g. another worker of the API, saved it since.
+
+        Args:
+            namespace (str | None): The namespace name, None for the default namespace.
+
+        Returns:
+            _LocalNamespace: The storage of the namespace.
+        """
+        if namespace and not re.fullmatch(r"[A-Za-z0-9_-]+", namespace):
+            raise ValueError(f"Invalid namespace: {namespace!r}")
+
+        with self._lock:
+            if namespace not in self._namespaces or self._namespaces[namespace].changed_on_disk():
+                # The default namespace lives at the root of the folder, the named ones in sub-folders
+                directory = os.path.join(self.directory, "namespaces", namespace) if namespace else self.directory
+                self._namespaces[namespace] = _LocalNamespace(directory, quantization=self.quantization)
+            return self._namespaces[namespace]
+
+    def add_texts(self, texts, metadatas=None, ids=None, namespace=None, **kwargs):
+        """
+        Embeds the given texts and stores them in the index.
+
+        Args:
+            texts (iterable): The texts to be embedded and stored.
+            metadatas (list, optional): A metadata dictionary for every text. Default is None.
+            ids (list, optional): An ID for every text. Texts with an already stored ID replace the stored one. Default is None.
+            namespace (str, optional): The namespace the texts are stored in. Default is None.
+
+        Returns:
+            list: The IDs of the stored texts.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids, namespace=namespace)
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, namespace=None):
+        """
+        Stores already embedded texts in the index.
+
+        Args:
+            text_embeddings (list): A list of (text, embedding) pairs.
+            metadatas (list, optional): A metadata dictionary for every text. Default is None.
+            ids (list, optional): An ID for every text. Texts with an already stored ID replace the stored one. Default is None.
+            namespace (str, optional): The namespace the texts are stored in. Default is None.
+
+        Returns:
+            list: The IDs of the stored texts.
+        """
+        texts = [text for text, _ in text_embeddings]
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [os.urandom(16).hex() for _ in texts]
+
+        vectors = np.asarray([vector for _, vector in text_embeddings], dtype=np.float32)
+        vectors = _normalizing_rows(vectors)
+
+        with self._lock:
+            storage = self._namespace(namespace)
+
+            # Dropping the stored rows which are going to be replaced by the new ones
+            replaced = set(ids)
+            if any(identifier in storage.positions for identifier in replaced):
+                storage.keeping([position for position, identifier in enumerate(storage.ids) if identifier not in replaced])
+
+            storage.appending(list(ids), texts, [dict(metadata) for metadata in metadatas], vectors)
+
+        return list(ids)
+
+    def delete(self, ids=None, delete_all=None, namespace=None, **kwargs):
+        """
+        Deletes vectors from the index, mirroring the `delete` signature of PineconeVectorStore.
+
+        Args:
+            ids (list, optional): The IDs of the vectors to be deleted. Default is None.
+            delete_all (bool, optional): Deletes every vector of the namespace when True. Default is None.
+            namespace (str, optional): The namespace to delete from. Default is None.
+        """
+        with self._lock:
+            storage = self._namespace(namespace)
+            if delete_all:
+                storage.rewriting([], [], [], None)
+            elif ids and any(identifier in storage.positions for identifier in ids):
+                deleted = set(ids)
+                storage.keeping([position for position, identifier in enumerate(storage.ids) if identifier not in deleted])
+
+    def requantizing(self, namespace=None):
+        """
+        Quantizes every row of a namespace again, computing the center of the binary codes from all of them, e.g. once
+        a namespace was loaded in bulk. The center is otherwise the one computed from the first rows written.
+        """
+        with self._lock:
+            storage = self._namespace(namespace)
+            if storage.ids:
+                storage.rewriting(storage.ids, storage.texts, storage.metadatas, storage.matrix, centering=True)
+
+    def vector_count(self, namespace=None):
+        """
+        Returns the number of vectors currently stored in the given namespace.
+        """
+        return len(self._namespace(namespace).ids)
+
+    def scanned_bytes(self, namespace=None):
+        """
+        Returns the size of the matrix every search of the given namespace scans, the quantized one if any.
+        """
+        storage = self._namespace(namespace)
+        if storage.quantized is not None:
+            return sum(array.nbytes for array in storage.quantized.values())
+        return storage.matrix.nbytes if storage.matrix is not None else 0
+
+    def similarity_search(self, query, k=4, **kwargs):
+        """
+        Retrieves the stored chunks most similar to the given query.
+
+        Args:
+            query (str): The input query used to search the index.
+            k (int, optional): Indicates top results to choose. Default is 4.
+
+        Returns:
+            list: A list of Documents ordered from the most to the least similar.
+        """
+        return [document for document, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        query_vector = self._embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(query_vector, k=k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k=k, **kwargs)]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, namespace=None, **kwargs):
+        """
+        Scores every chunk of the namespace against the query vector in one matrix product and keeps the top k. With
+        quantized embeddings, the quantized matrix is scanned instead and the best candidates are rescored exactly.
+
+        Args:
+            embedding (list): The query embedding.
+            k (int, optional): Indicates top results to choose. Default is 4.
+            namespace (str, optional): The namespace to search. Default is None.
+
+        Returns:
+            list: A list of (Document, cosine similarity) pairs ordered from the most to the least similar.
+        """
+        with self._lock:
+            storage = self._namespace(namespace)
+            matrix, ids, texts, metadatas = storage.matrix, storage.ids, storage.texts, storage.metadatas
+            quantized = storage.quantized
+
+        if matrix is None or not len(matrix):
+            return []
+
+        query_vector = _normalizing_rows(np.asarray([embedding], dtype=np.float32))[0]
+
+        if quantized is None:
+            positions = np.arange(len(matrix))
+            scores = matrix @ query_vector
+        else:
+            # Rescoring the best candidates of the quantized scan, reading them in file order
+            count = min(k * self.rescore_factor, len(matrix))
+            approximate = _approximate_scores(quantized, self.quantization, query_vector)
+            positions = np.sort(np.argpartition(-approximate, count - 1)[:count])
+            scores = np.asarray(matrix[positions]) @ query_vector
+
+        # Selecting the top k rows in linear time and sorting only those
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            (Document(id=ids[position], page_content=texts[position], metadata=metadatas[position]), float(score))
+            for position, score in zip(positions[top], scores[top])
+        ]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, directory="/tmp/rag-local-index", **kwargs):
+        store = cls(embedding=embedding, directory=directory)
+        store.add_texts(texts, metadatas=metadatas, ids=ids, **kwargs)
+        return store
+
+
+def _quantized_files(quantization, dimension):
+    """
+    Returns the (name, dtype, row shape) of every array of quantized rows.
+    """
+    if quantization == "int8":
+        return [("codes", np.int8, (dimension,)), ("scales", np.float32, ())]
+    return [("codes", np.uint64, ((dimension + 63) // 64,))]
+
+
+def _centering(matrix):
+    """
+    Returns the mean of every dimension over the rows of a matrix, possibly memory-mapped.
+    """
+    center = np.zeros(matrix.shape[1], dtype=np.float64)
+    for start in range(0, len(matrix), BLOCK_ROWS):
+        center += np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32).sum(axis=0)
+    return (center / max(len(matrix), 1)).astype(np.float32)
+
+
+def _appending_bytes(path, offset, data):
+    """
+    Writes data at an offset of a file, dropping what follows the offset, e.g. the rows of an interrupted write.
+    """
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(data)
+
+
+def _quantizing(matrix, quantization, center=None):
+    """
+    Quantizes the rows of an L2 normalized matrix.
+
+    "int8" maps every row to integers from -127 to 127 along with its scale. "binary" keeps one bit per dimension,
+    whether the value is above the center of its dimension, packed into 64-bit words.
+
+    Args:
+        matrix (numpy.ndarray): The L2 normalized embeddings matrix.
+        quantization (str): "int8" or "binary".
+        center (numpy.ndarray, optional): The center of the binary codes. Default is None, the mean of the rows.
+
+    Returns:
+        dict: The arrays of the quantized matrix, along with the "center" of binary codes.
+    """
+    if quantization == "int8":
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        scales = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            maxima = np.abs(block).max(axis=1)
+            maxima[maxima == 0] = 1.0
+            scales[start:start + len(block)] = maxima / 127
+            codes[start:start + len(block)] = np.rint(block * (127 / maxima)[:, None])
+        return {"codes": codes, "scales": scales}
+
+    # Centering the dimensions first, so that every bit splits the rows in two
+    center = _centering(matrix) if center is None else center
+
+    # Padding the bits of a row with zeros to whole words, which do not change the Hamming distances
+    codes = np.zeros((len(matrix), (matrix.shape[1] + 63) // 64 * 8), dtype=np.uint8)
+    for start in range(0, len(matrix), BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+        packed = np.packbits(block > center, axis=1)
+        codes[start:start + len(block), :packed.shape[1]] = packed
+    return {"codes": codes.view(np.uint64), "center": center}
+
+
+def _approximate_scores(quantized, quantization, query_vector):
+    """
+    Scores every row of a quantized matrix against a normalized query vector, higher is more similar: the dot
+    products of the int8 rows, or the number of bits the binary rows have in common with the query.
+    """
+    codes = quantized["codes"]
+    if quantization == "int8":
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_ROWS):
+            scores[start:start + BLOCK_ROWS] = codes[start:start + BLOCK_ROWS].astype(np.float32) @ query_vector
+        return scores * quantized["scales"]
+
+    query_bits = np.zeros(codes.shape[1] * 8, dtype=np.uint8)
+    packed = np.packbits(query_vector > quantized["center"])
+    query_bits[:len(packed)] = packed
+    query_bits = query_bits.view(np.uint64)
+
+    distances = np.empty(len(codes), dtype=np.int32)
+    for start in range(0, len(codes), BLOCK_ROWS):
+        different = codes[start:start + BLOCK_ROWS] ^ query_bits
+        if hasattr(np, "bitwise_count"):
+            distances[start:start + BLOCK_ROWS] = np.bitwise_count(different).sum(axis=1, dtype=np.int32)
+        else:
+            distances[start:start + BLOCK_ROWS] = _POPCOUNT[different.view(np.uint8)].sum(axis=1, dtype=np.int32)
+    return -distances
+
+
+def _normalizing_rows(matrix):
+    """
+    Scales every row of the matrix to unit length, so a dot product equals the cosine similarity.
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
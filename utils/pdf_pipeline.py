@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+# The end of a line closing a sentence, after '.', '!', '?' or ':' and any closing quote or bracket
+SENTENCE_END_PATTERN = re.compile(r"[.!?:][\"'”’)\]]*$")
+
+
+def _joining_lines(text):
+    """
+    Joins the lines a page was wrapped into back into paragraphs, separated by a blank line so that the chunker cuts
+    between them. A line ends its paragraph when an empty line follows it, or when it closes a sentence well before
+    the width of the longest lines of the page.
+
+    Args:
+        text (str): The text of a page, one line per line of the layout.
+
+    Returns:
+        str: The paragraphs of the page, one per line, separated by blank lines.
+    """
+    lines = [" ".join(line.split()) for line in text.split("\n")]
+    width = max((len(line) for line in lines), default=0)
+
+    paragraphs, current = [], []
+    for line in lines:
+        if line:
+            current.append(line)
+        if current and (not line or (SENTENCE_END_PATTERN.search(line) and len(line) < 0.8 * width)):
+            paragraphs.append(" ".join(current))
+            current = []
+    if current:
+        paragraphs.append(" ".join(current))
+    return "\n\n".join(paragraphs)
+
+
+def _extracting_pages(path, start, stop):
+    """
+    Extracts and normalizes the text of a range of pages. Runs inside a worker process.
+
+    Args:
+        path (str): The file path of the PDF document.
+        start (int): The index of the first page to extract.
+        stop (int): The index after the last page to extract.
+
+    Returns:
+        list: The normalized text of every page in the range, see `_joining_lines`.
+    """
+    reader = PdfReader(path)
+    return [_joining_lines(reader.pages[number].extract_text()) for number in range(start, stop)]
+
+
+# The pool of worker processes shared by the extractions of every upload, see `_extraction_pool`
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _extraction_pool(max_workers):
+    """
+    Returns the pool of worker processes shared by every extraction, creating it the first time with `max_workers`
+    workers at most.
+
+    Workers are started from a fork server rather than forked from the threaded server, and only as tasks are
+    submitted, so a small document never starts more of them than it has page ranges.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _discarding_pool(pool):
+    """
+    Forgets a pool whose worker died, so that the next extraction creates a new one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def streaming_pdf_pages(path, max_workers=None, pages_per_task=8):
+    """
+    Yields the pages of a PDF document as they are extracted by a pool of worker processes.
+
+    Only a bounded window of page ranges is in flight at any time, so the whole document is never held in memory
+    and extraction keeps running ahead while the caller is busy with the pages already yielded.
+
+    Args:
+        path (str): The file path of the PDF document.
+        max_workers (int, optional): The number of worker processes of the pool shared by every extraction, when it
+            is created. Default is None, one per CPU core.
+        pages_per_task (int, optional): The number of pages extracted by a worker in one task. Default is 8.
+
+    Yields:
+        Document: One Document per page, in page order, with the "source", "page" and "total_pages" metadata.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    total_pages = len(PdfReader(path).pages)
+    ranges = deque((start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task))
+
+    executor = _extraction_pool(max_workers)
+    window = min(2 * max_workers, len(ranges))
+    in_flight = deque()
+    try:
+        while ranges or in_flight:
+            # Keeping the workers busy with the next page ranges while earlier ones are being consumed
+            while ranges and len(in_flight) < window:
+                start, stop = ranges.popleft()
+                in_flight.append((start, executor.submit(_extracting_pages, path, start, stop)))
+
+            start, future = in_flight.popleft()
+            for offset, text in enumerate(future.result()):
+                yield Document(page_content=text, metadata={"source": path, "page": start + offset, "total_pages": total_pages})
+    except BrokenProcessPool:
+        _discarding_pool(executor)
+        raise
+    finally:
+        # The pool outlives the extraction, the ranges of an abandoned one are not extracted for nothing
+        for _, future in in_flight:
+            future.cancel()
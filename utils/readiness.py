@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+
+from fastapi import HTTPException
+
+from utils.telemetry import logging_event, observing
+
+
+class Readiness:
+    """
+    Tracks the startup of a service, so that it accepts connections at once while its clients are created and warmed
+    up in the background, and tells probes and clients when it can serve requests.
+
+    The startup goes through the "starting", "warming_up" and "ready" states, or ends in "failed" if the clients can
+    not be created. A failed warm-up only delays the first requests, the service becomes ready anyway.
+
+    Attributes:
+        state (str): The current state of the startup.
+        error (str | None): Why the startup failed, if it did.
+    """
+
+    def __init__(self):
+        self.state = "starting"
+        self.error = None
+        self._started_at = time.perf_counter()
+        self._ready = threading.Event()
+
+    def starting(self, initializing, warming_up=None):
+        """
+        Initializes the service, then warms it up, on a background thread.
+
+        Args:
+            initializing (callable): Creates the clients of the service.
+            warming_up (callable, optional): Opens the connections of the clients, e.g. with a tiny embedding and llm
+                call. Default is None.
+
+        Returns:
+            threading.Thread: The startup thread.
+        """
+        thread = threading.Thread(target=self._running, args=(initializing, warming_up), name="startup", daemon=True)
+        thread.start()
+        return thread
+
+    def _running(self, initializing, warming_up):
+        try:
+            initializing()
+        except Exception as e:
+            self.state, self.error = "failed", str(e)
+            logging_event("startup_failed", level=logging.ERROR, error=str(e))
+            return
+
+        if warming_up is not None:
+            self.state = "warming_up"
+            started = time.perf_counter()
+            try:
+                warming_up()
+            except Exception as e:
+                logging_event("warm_up_failed", level=logging.WARNING, error=str(e))
+            observing("warm_up", time.perf_counter() - started)
+
+        self.marking_ready()
+
+    def marking_ready(self):
+        """
+        Lets the service serve requests, e.g. once its clients were set up by other means than `starting`.
+        """
+        self.state = "ready"
+        self._ready.set()
+        observing("startup", time.perf_counter() - self._started_at)
+        logging_event("ready", seconds=round(time.perf_counter() - self._started_at, 3))
+
+    @property
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def status(self):
+        """
+        Returns the state of the startup, with the error if it failed.
+        """
+        return {"status": self.state, **({"error": self.error} if self.error else {})}
+
+    def requiring(self):
+        """
+        FastAPI dependency rejecting requests with a "503 Service Unavailable" until the service is ready.
+
+        Raises:
+            HTTPException: If the service is not ready yet.
+        """
+        if not self._ready.is_set():
+            raise HTTPException(status_code=503, detail=f"The service is {self.state.replace('_', ' ')}, try again shortly",
+                                headers={"Retry-After": "1"})
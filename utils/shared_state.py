@@ -0,0 +1,293 @@
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# The name under which the files of the default namespace are stored, one no document ID may take
+DEFAULT_NAMESPACE = "__default__"
+
+
+class SharedStore:
+    """
+    The state every worker process of a service reads and writes, kept in a SQLite file so that a request may be
+    served by any worker: the description of every document, the content version of every document, the content
+    hash of every uploaded file and the status of every ingestion job.
+
+    The database runs in WAL mode, so readers never wait for a writer. A path of ":memory:" keeps the state private to
+    the process, for a single worker.
+
+    Attributes:
+        path (str): The path of the SQLite file.
+    """
+
+    def __init__(self, path="/tmp/rag-shared-state.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS descriptions (
+                document_id TEXT PRIMARY KEY, description TEXT, anchor BLOB, updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS document_versions (document_id TEXT PRIMARY KEY, version TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS uploads (
+                sha256 TEXT NOT NULL, document_id TEXT NOT NULL, version TEXT NOT NULL, description TEXT,
+                uploaded_at REAL NOT NULL, PRIMARY KEY (sha256, document_id)
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, error TEXT,
+                created_at REAL NOT NULL, finished_at REAL, owner TEXT, heartbeat_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS job_progress (
+                job_id TEXT NOT NULL, stage TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (job_id, stage)
+            );
+        """)
+
+        # Adding the columns tracking the worker of a job to files created before they existed
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                self._connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._connection.commit()
+
+    def _executing(self, statement, parameters=()):
+        with self._lock:
+            cursor = self._connection.execute(statement, parameters)
+            self._connection.commit()
+            return cursor
+
+    def _fetching(self, statement, parameters=()):
+        with self._lock:
+            return self._connection.execute(statement, parameters).fetchone()
+
+    def setting_description(self, document_id, description):
+        """
+        Stores the description of a document, replacing the previous one and dropping the embedding of the previous
+        one, see `setting_anchor`.
+
+        Args:
+            document_id (str | None): The document the description belongs to, None for the default namespace.
+            description (str): The description of the document.
+        """
+        self._executing(
+            "INSERT INTO descriptions (document_id, description, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (document_id) DO UPDATE SET description = excluded.description, anchor = NULL, updated_at = excluded.updated_at",
+            (_key(document_id), description, time.time()),
+        )
+
+    def description(self, document_id):
+        """
+        Returns the description of a document, or None if it has none.
+        """
+        row = self._fetching("SELECT description FROM descriptions WHERE document_id = ?", (_key(document_id),))
+        return row[0] if row else None
+
+    def setting_anchor(self, document_id, vector):
+        """
+        Stores the normalized embedding of a document description, which the intent router compares queries with.
+
+        Args:
+            document_id (str | None): The document the embedding belongs to.
+            vector (numpy.ndarray): The L2 normalized embedding of the description.
+        """
+        self._executing(
+            "INSERT INTO descriptions (document_id, anchor, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (document_id) DO UPDATE SET anchor = excluded.anchor, updated_at = excluded.updated_at",
+            (_key(document_id), np.asarray(vector, dtype=np.float32).tobytes(), time.time()),
+        )
+
+    def anchor(self, document_id):
+        """
+        Returns the normalized embedding of a document description, or None if it was never embedded.
+        """
+        row = self._fetching("SELECT anchor FROM descriptions WHERE document_id = ?", (_key(document_id),))
+        return np.frombuffer(row[0], dtype=np.float32) if row and row[0] is not None else None
+
+    def setting_document_version(self, document_id, version):
+        """
+        Stores the content version of a document, see `utils.incremental_index.content_version`.
+        """
+        self._executing(
+            "INSERT OR REPLACE INTO document_versions (document_id, version) VALUES (?, ?)", (_key(document_id), version)
+        )
+
+    def document_version(self, document_id):
+        """
+        Returns the content version of a document, or None if it was never stored.
+        """
+        row = self._fetching("SELECT version FROM document_versions WHERE document_id = ?", (_key(document_id),))
+        return row[0] if row else None
+
+    def setting_upload(self, sha256, document_id, version, description):
+        """
+        Records that an uploaded file is indexed in a document's namespace.
+
+        Args:
+            sha256 (str): The SHA-256 of the uploaded file.
+            document_id (str | None): The namespace the file was indexed in.
+            version (str): The content version of the namespace once the file was indexed.
+            description (str): The generated description of the file.
+        """
+        self._executing(
+            "INSERT OR REPLACE INTO uploads (sha256, document_id, version, description, uploaded_at) VALUES (?, ?, ?, ?, ?)",
+            (sha256, _key(document_id), version, description, time.time()),
+        )
+
+    def uploads(self, sha256):
+        """
+        Returns the namespaces an uploaded file was indexed in, most recent first.
+
+        Args:
+            sha256 (str): The SHA-256 of the uploaded file.
+
+        Returns:
+            list: A dictionary with the "document_id", "version" and "description" of every upload of the file.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT document_id, version, description FROM uploads WHERE sha256 = ? ORDER BY uploaded_at DESC", (sha256,)
+            ).fetchall()
+        return [{"document_id": document_id or None, "version": version, "description": description} for document_id, version, description in rows]
+
+    def adding_job(self, job_id, max_pending, max_finished, owner=None):
+        """
+        Records a new queued job, unless `max_pending` jobs are already queued or running over all the workers, and
+        forgets the oldest finished jobs once more than `max_finished` of them are kept.
+
+        Args:
+            job_id (str): The ID of the job.
+            max_pending (int): The maximum number of queued or running jobs.
+            max_finished (int): The number of finished jobs kept for polling.
+            owner (str, optional): Identifies the worker running the job, see `beating`. Default is None.
+
+        Returns:
+            int | None: The number of jobs already pending if the queue is full, None if the job was added.
+        """
+        with self._lock:
+            # Counting and inserting in one write transaction, so two workers can not both take the last free slot
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                pending = self._connection.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+                if pending >= max_pending:
+                    return pending
+
+                now = time.time()
+                self._connection.execute(
+                    "INSERT INTO jobs (job_id, status, created_at, owner, heartbeat_at) VALUES (?, 'queued', ?, ?, ?)",
+                    (job_id, now, owner, now),
+                )
+                expired = [row[0] for row in self._connection.execute(
+                    "SELECT job_id FROM jobs WHERE status IN ('done', 'failed') ORDER BY created_at DESC LIMIT -1 OFFSET ?",
+                    (max_finished,),
+                )]
+                for start in range(0, len(expired), 500):
+                    batch = expired[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    self._connection.execute(f"DELETE FROM jobs WHERE job_id IN ({placeholders})", batch)
+                    self._connection.execute(f"DELETE FROM job_progress WHERE job_id IN ({placeholders})", batch)
+        return None
+
+    def beating(self, owner):
+        """
+        Records that the worker identified by `owner` is alive, for every job it has queued or is running.
+        """
+        self._executing(
+            "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('queued', 'running')", (time.time(), owner)
+        )
+
+    def reaping_jobs(self, stale_after):
+        """
+        Marks as failed the queued or running jobs whose worker was not seen for `stale_after` seconds, e.g. because
+        it crashed or was restarted, so they neither count as pending nor stay pending for their clients.
+
+        Args:
+            stale_after (float): The number of seconds after which the worker of a job is considered gone.
+
+        Returns:
+            int: The number of jobs marked as failed.
+        """
+        now = time.time()
+        cursor = self._executing(
+            "UPDATE jobs SET status = 'failed', error = 'The worker running the job stopped', finished_at = ? "
+            "WHERE status IN ('queued', 'running') AND COALESCE(heartbeat_at, created_at) < ?",
+            (now, now - stale_after),
+        )
+        return cursor.rowcount
+
+    def updating_job(self, job_id, **fields):
+        """
+        Updates the "status", "result", "error" or "finished_at" of a job.
+        """
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        self._executing(f"UPDATE jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def adding_progress(self, job_id, stage, count=1):
+        """
+        Adds `count` to the progress counter of a job's stage.
+        """
+        self._executing(
+            "INSERT INTO job_progress (job_id, stage, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (job_id, stage) DO UPDATE SET count = count + excluded.count",
+            (job_id, stage, count),
+        )
+
+    def job(self, job_id):
+        """
+        Returns a snapshot of a job's status, progress and result, or None if the job is unknown.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT job_id, status, result, error, created_at, finished_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            progress = dict(self._connection.execute("SELECT stage, count FROM job_progress WHERE job_id = ?", (job_id,)).fetchall())
+
+        job_id, status, result, error, created_at, finished_at = row
+        return {"job_id": job_id, "status": status, "progress": progress, "result": result, "error": error,
+                "created_at": created_at, "finished_at": finished_at}
+
+
+class FileLock:
+    """
+    An exclusive lock held on a file, serializing a critical section between the threads and the worker processes of
+    a service, e.g. the updates of a namespace of the index.
+
+    Attributes:
+        path (str): The path of the lock file, created if missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Every acquisition opens its own file description, so threads of the same process exclude each other too
+        self._file = open(self.path, "a")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+def _key(document_id):
+    """
+    Maps the default namespace, None, to a key SQLite compares as equal to itself.
+    """
+    return document_id if document_id is not None else ""
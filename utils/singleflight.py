@@ -0,0 +1,308 @@
+import asyncio
+import contextvars
+import threading
+
+from utils.embedding_cache import normalizing_text
+from utils.telemetry import counting
+
+
+def query_key(query, profession, document_id, version):
+    """
+    Identifies a question to coalesce: the same query up to case, unicode forms and spacing, asked by the same
+    profession about the same version of the same document.
+
+    Args:
+        query (str): The user's query.
+        profession (str): The user's profession.
+        document_id (str | None): The document the query is about.
+        version (str | None): The content version of the document.
+
+    Returns:
+        tuple: The key of the query.
+    """
+    return normalizing_text(query).lower(), profession, document_id, version
+
+
+class _Flight:
+    """
+    A computation in flight and what its callers wait for: its result, or the pieces it yielded so far.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pieces = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.followers = 0
+        self.consumers = 0
+        self.abandoned = False
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls between the threads of a process: while a call with a given key is in
+    flight, the calls with the same key wait for it and share its result instead of computing it again. A call
+    arriving once the first one finished computes it again, results are not cached.
+
+    Attributes:
+        name (str): The name of the coalesced calls, counted as "<name>_coalesced" events.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _joining(self, key):
+        """
+        Returns the flight of a key and whether the caller leads it, i.e. has to compute it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                flight.consumers += 1
+                return flight, True
+            flight.followers += 1
+            flight.consumers += 1
+
+        counting(f"{self.name}_coalesced")
+        return flight, False
+
+    def _landing(self, key, flight):
+        # Forgetting the flight first, so later calls compute the result again
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.condition:
+            flight.done = True
+            flight.condition.notify_all()
+
+    def doing(self, key, function):
+        """
+        Calls a function, unless a call with the same key is in flight, in which case its result is waited for.
+
+        Args:
+            key (hashable): Identifies the calls sharing a result.
+            function (callable): Computes the result, without arguments.
+
+        Returns:
+            object: The result of the function, the same object for every coalesced call.
+
+        Raises:
+            Exception: Whatever the function raised, in every coalesced call.
+        """
+        flight, leading = self._joining(key)
+        if not leading:
+            with flight.condition:
+                flight.condition.wait_for(lambda: flight.done)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._landing(key, flight)
+        return flight.result
+
+    def streaming(self, key, function):
+        """
+        Iterates over what a function returns, unless a call with the same key is in flight, in which case the pieces
+        it yielded are replayed and the next ones are yielded as they come.
+
+        The iterable is consumed by a thread of its own, which every caller reads from. A caller that stops iterating
+        early, e.g. because its client disconnected, only stops reading, whichever thread closes it: the iterable goes
+        on for the other callers and is closed once none is left.
+
+        Args:
+            key (hashable): Identifies the calls sharing their pieces.
+            function (callable): Returns the iterable, without arguments.
+
+        Yields:
+            object: The pieces, in order.
+
+        Raises:
+            Exception: Whatever the iterable raised, in every coalesced call.
+        """
+        flight, leading = self._joining(key)
+        if leading:
+            # The producer runs in the context of the first caller, e.g. with its telemetry spans
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._producing, key, flight, function), daemon=True,
+                             name=f"{self.name}-producer").start()
+
+        position = 0
+        try:
+            while True:
+                with flight.condition:
+                    flight.condition.wait_for(lambda: len(flight.pieces) > position or flight.done)
+                    pieces, done = flight.pieces[position:], flight.done
+                position += len(pieces)
+                yield from pieces
+                if done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            with self._lock:
+                flight.consumers -= 1
+                if flight.consumers == 0 and not flight.done:
+                    # Forgetting the flight nobody reads any more, so that no caller joins it, the producer closes
+                    # the iterable after its next piece
+                    flight.abandoned = True
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+
+    def _producing(self, key, flight, function):
+        """
+        Consumes the iterable of a flight, appending its pieces to the flight until it ends or every caller left.
+        """
+        iterator = None
+        try:
+            iterator = iter(function())
+            for piece in iterator:
+                with flight.condition:
+                    flight.pieces.append(piece)
+                    flight.condition.notify_all()
+                if flight.abandoned:
+                    break
+        except Exception as e:
+            flight.error = e
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            self._landing(key, flight)
+
+
+class _AsyncFlight:
+    """
+    A task in flight and what its callers wait for, see `_Flight`.
+    """
+
+    def __init__(self):
+        self.task = None
+        self.pieces = []
+        self.error = None
+        self.done = False
+        self.changed = asyncio.Event()
+        self.waiters = 0
+
+    def notifying(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces identical concurrent calls between the coroutines of an event loop, see `SingleFlight`.
+
+    The shared computation runs in its own task, so it goes on when the caller that started it is cancelled, and is
+    cancelled once every caller waiting for it is.
+
+    Attributes:
+        name (str): The name of the coalesced calls, counted as "<name>_coalesced" events.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+
+    def _joining(self, key, starting):
+        """
+        Returns the flight of a key, starting it with `starting(flight)` if none is in flight.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _AsyncFlight()
+            flight.task = asyncio.ensure_future(starting(flight))
+            flight.task.add_done_callback(lambda task: self._landing(key, flight))
+        else:
+            counting(f"{self.name}_coalesced")
+        flight.waiters += 1
+        return flight
+
+    def _landing(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        flight.done = True
+        flight.notifying()
+
+        # Retrieving the error of a task no caller waits for any more, which asyncio would log otherwise
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def _leaving(self, flight):
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.done:
+            flight.task.cancel()
+
+    async def doing(self, key, function):
+        """
+        Awaits a coroutine function, unless a call with the same key is in flight, in which case its result is
+        awaited instead.
+
+        Args:
+            key (hashable): Identifies the calls sharing a result.
+            function (callable): Returns the coroutine computing the result, without arguments.
+
+        Returns:
+            object: The result of the coroutine, the same object for every coalesced call.
+
+        Raises:
+            Exception: Whatever the coroutine raised, in every coalesced call.
+        """
+        async def starting(flight):
+            return await function()
+
+        flight = self._joining(key, starting)
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leaving(flight)
+
+    async def streaming(self, key, function):
+        """
+        Iterates over an asynchronous iterable, unless a call with the same key is in flight, in which case the
+        pieces it yielded are replayed and the next ones are yielded as they come.
+
+        Args:
+            key (hashable): Identifies the calls sharing their pieces.
+            function (callable): Returns the asynchronous iterable, without arguments.
+
+        Yields:
+            object: The pieces, in order.
+
+        Raises:
+            Exception: Whatever the iterable raised, in every coalesced call.
+        """
+        async def starting(flight):
+            try:
+                async for piece in function():
+                    flight.pieces.append(piece)
+                    flight.notifying()
+            except Exception as e:
+                flight.error = e
+
+        flight = self._joining(key, starting)
+        position = 0
+        try:
+            while True:
+                # Nothing is awaited between reading the flight and waiting for its next change, so none is missed
+                pieces, done, changed = flight.pieces[position:], flight.done, flight.changed
+                position += len(pieces)
+                for piece in pieces:
+                    yield piece
+                if pieces:
+                    continue
+                if done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await changed.wait()
+        finally:
+            self._leaving(flight)
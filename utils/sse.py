@@ -0,0 +1,92 @@
+import json
+
+
+def formatting_event(event, data):
+    """
+    Formats a Server-Sent Event whose data is JSON encoded.
+
+    Args:
+        event (str): The event type, e.g. "token", "resources", "error" or "done".
+        data (dict): The event payload.
+
+    Returns:
+        str: The event, ready to be written to a `text/event-stream` response.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class _EventParser:
+    """
+    Accumulates Server-Sent Events lines and returns every event once its terminating blank line is read.
+    """
+
+    def __init__(self):
+        self.event, self.data = "message", []
+
+    def feed(self, line):
+        """
+        Reads one line of the stream.
+
+        Args:
+            line (str): The decoded line, without its line ending.
+
+        Returns:
+            tuple | None: The (event, data) pair of the event the line completes, or None.
+        """
+        if not line:
+            # A blank line ends the current event
+            return self.flush()
+        if line.startswith("event:"):
+            self.event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            self.data.append(line[len("data:"):].strip())
+        return None
+
+    def flush(self):
+        completed = (self.event, json.loads("\n".join(self.data))) if self.data else None
+        self.event, self.data = "message", []
+        return completed
+
+
+def parsing_events(lines):
+    """
+    Parses a stream of Server-Sent Events lines, as produced by `formatting_event`.
+
+    Args:
+        lines (iterable): The decoded lines of the response body, without their line endings.
+
+    Yields:
+        tuple: An (event, data) pair for every complete event, with the JSON payload decoded.
+    """
+    parser = _EventParser()
+
+    for line in lines:
+        completed = parser.feed(line)
+        if completed:
+            yield completed
+
+    completed = parser.flush()
+    if completed:
+        yield completed
+
+
+async def aparsing_events(lines):
+    """
+    Parses an asynchronous stream of Server-Sent Events lines, see `parsing_events`.
+
+    Args:
+        lines (async iterable): The decoded lines of the response body, without their line endings.
+
+    Yields:
+        tuple: An (event, data) pair for every complete event, with the JSON payload decoded.
+    """
+    parser = _EventParser()
+
+    async for line in lines:
+        completed = parser.feed(line)
+        if completed:
+            yield completed
+
+    completed = parser.flush()
+    if completed:
+        yield completed
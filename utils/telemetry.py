@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+# Spans from sub-millisecond cache lookups up to slow llm generations and document ingestions
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "Duration of every pipeline stage.", ["stage"], buckets=BUCKETS)
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Pipeline stages which raised an exception.", ["stage"])
+EVENTS = Counter("rag_events_total", "Notable events: cache hits and misses, routes, fallbacks...", ["event"])
+REQUEST_SECONDS = Histogram("rag_request_duration_seconds", "Duration of every HTTP request.", ["method", "endpoint", "status"], buckets=BUCKETS)
+
+logger = logging.getLogger("rag")
+
+
+@contextmanager
+def timing(stage):
+    """
+    Measures the duration of a pipeline stage into the `rag_stage_duration_seconds` histogram, counting the stage in
+    `rag_stage_errors_total` as well if it raises.
+
+    Args:
+        stage (str): The name of the stage, e.g. "vector_search".
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def observing(stage, seconds):
+    """
+    Records a duration measured by the caller into the `rag_stage_duration_seconds` histogram, e.g. the time to the
+    first token of a streamed answer.
+    """
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def counting(event, count=1):
+    """
+    Counts an event in the `rag_events_total` counter.
+
+    Args:
+        event (str): The name of the event, e.g. "answer_cache_hit".
+        count (int, optional): The number of occurrences. Default is 1.
+    """
+    EVENTS.labels(event).inc(count)
+
+
+def logging_event(event, sampled=False, level=logging.INFO, **fields):
+    """
+    Logs an event as a single JSON line.
+
+    Events of the request path are sampled: only a `LOG_SAMPLE_RATE` share of them (default 0.1) is logged, so logging
+    stays cheap under load. Warnings and errors are always logged.
+
+    Args:
+        event (str): The name of the event.
+        sampled (bool, optional): Whether the event is only logged for a sample of the calls. Default is False.
+        level (int, optional): The logging level. Default is logging.INFO.
+        **fields: The fields of the event, anything JSON serializable or printable.
+    """
+    if sampled and level < logging.WARNING and random.random() >= float(os.getenv("LOG_SAMPLE_RATE", "0.1")):
+        return
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({"time": round(time.time(), 3), "level": logging.getLevelName(level).lower(), "event": event, **fields}, default=str))
+
+
+def configuring_logging():
+    """
+    Writes the structured logs to the standard error, at the `LOG_LEVEL` level (default INFO).
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+def preparing_worker_metrics(workers):
+    """
+    Lets the worker processes of a service share their metrics, so that `/metrics` reports every worker whichever
+    of them answers it. Must be called before the workers are started.
+
+    With more than one worker, the workers write their metrics to files in `PROMETHEUS_MULTIPROC_DIR`, a fresh
+    temporary folder unless set, which is emptied of the files of earlier runs.
+
+    Args:
+        workers (int): The number of worker processes of the service.
+    """
+    if workers <= 1:
+        return
+
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+    else:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="rag-metrics-")
+
+
+def exporting_metrics():
+    """
+    Renders every metric of the service in the Prometheus text format, aggregated over its worker processes when
+    `PROMETHEUS_MULTIPROC_DIR` is set.
+
+    Returns:
+        tuple: The body of the response and its content type.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+async def timing_requests(request, call_next):
+    """
+    HTTP middleware measuring every request into `rag_request_duration_seconds`, labelled by route template so that
+    paths carrying IDs share a single series.
+    """
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        REQUEST_SECONDS.labels(request.method, endpoint, str(status)).observe(time.perf_counter() - started)
+
+
+class TimingCallbackHandler(BaseCallbackHandler):
+    """
+    Times langchain runs into the stage histogram: every llm call as `llm_stage`, and every chain run whose name is
+    one of `chain_stages` as a stage of that name, e.g. a ReAct iteration.
+
+    Attributes:
+        llm_stage (str): The stage name of llm calls.
+        chain_stages (set): The run names of the chains to be timed.
+    """
+
+    run_inline = True
+
+    def __init__(self, llm_stage="llm", chain_stages=()):
+        self.llm_stage = llm_stage
+        self.chain_stages = set(chain_stages)
+        self._started = {}
+
+    def _starting(self, run_id, stage):
+        self._started[run_id] = (stage, time.perf_counter())
+
+    def _ending(self, run_id, error=False):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        stage, started_at = started
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started_at)
+        if error:
+            STAGE_ERRORS.labels(stage).inc()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starting(run_id, self.llm_stage)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._ending(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._ending(run_id, error=True)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        if kwargs.get("name") in self.chain_stages:
+            self._starting(run_id, kwargs["name"])
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._ending(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._ending(run_id, error=True)
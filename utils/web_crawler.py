@@ -0,0 +1,351 @@
+import hashlib
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from utils.getting_web_text import extract_text_from_html
+from utils.telemetry import counting, timing
+
+# Links to files which are never HTML pages, not worth a request when following links
+SKIPPED_EXTENSIONS = (
+    ".pdf", ".zip", ".gz", ".tar", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico",
+    ".css", ".js", ".json", ".xml", ".mp3", ".mp4", ".webm", ".woff", ".woff2", ".ttf",
+)
+
+
+def checking_address(address):
+    """
+    Refuses an IP address which is not a public one: loopback, private, link-local, reserved or multicast.
+
+    Args:
+        address (str): The IPv4 or IPv6 address.
+
+    Raises:
+        ValueError: If the address is not public.
+    """
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    if not ip.is_global or ip.is_multicast:
+        raise ValueError(f"{address} is not a public address")
+
+
+def checking_url(url):
+    """
+    Resolves the host of a URL and refuses it unless every address it resolves to is public, so that users can not
+    make the server fetch its own services, the cloud metadata endpoint or hosts of the private network.
+
+    Args:
+        url (str): The http or https URL.
+
+    Raises:
+        ValueError: If the URL is not an http(s) URL, its host can not be resolved or is not public.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError(f"{url} is not an http or https URL")
+
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80), type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ValueError(f"{parsed.hostname} can not be resolved") from e
+
+    for *_, sockaddr in addresses:
+        try:
+            checking_address(sockaddr[0])
+        except ValueError as e:
+            raise ValueError(f"{url} is not a public host: {e}") from None
+
+
+class _PublicConnection:
+    """
+    Checks the address a connection is actually made to, since the host may resolve to another address than when it
+    was checked.
+    """
+
+    def _new_conn(self):
+        sock = super()._new_conn()
+        try:
+            checking_address(sock.getpeername()[0])
+        except ValueError:
+            sock.close()
+            raise
+        return sock
+
+
+class _PublicHTTPConnection(_PublicConnection, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicConnection, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class _PublicHTTPAdapter(HTTPAdapter):
+    """
+    A transport adapter whose connections are only made to public addresses.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _PublicHTTPConnectionPool, "https": _PublicHTTPSConnectionPool}
+
+
+class HttpPageCache:
+    """
+    Persists the extracted text of every fetched page along with its ETag and Last-Modified validators, so the next
+    fetch of the page is a conditional request which the server answers with "304 Not Modified" if it is unchanged.
+
+    Attributes:
+        directory (str): The folder where one JSON file per URL is stored.
+    """
+
+    def __init__(self, directory="/tmp/rag-http-cache"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        """
+        Returns the cached entry of a URL, a dictionary with "etag", "last_modified", "text" and "links" keys, or None.
+        """
+        try:
+            with open(self._path(url), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, url, etag, last_modified, text, links):
+        path = self._path(url)
+        # Every process writes its own temporary file, workers fetching the same page never mix their writes
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified, "text": text, "links": links}, f)
+        os.replace(tmp_path, path)
+
+
+class _HostLimiter:
+    """
+    Bounds the number of concurrent requests to a host and spaces out their starts by at least `interval` seconds.
+    """
+
+    def __init__(self, concurrency, interval):
+        self.semaphore = threading.Semaphore(concurrency)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def waiting(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class WebCrawler:
+    """
+    Fetches many web pages concurrently and extracts their text, being polite with every host and revalidating the
+    pages it already knows instead of downloading them again.
+
+    Attributes:
+        cache (HttpPageCache): The on-disk cache of fetched pages.
+        max_workers (int): The maximum number of pages fetched at once, over all hosts.
+        per_host_concurrency (int): The maximum number of pages fetched at once from a single host.
+        per_host_interval (float): The minimum number of seconds between two requests to the same host.
+        timeout (float): The number of seconds to wait for a server to connect and to send data.
+        max_bytes (int): The size above which the rest of a page is ignored.
+        allow_private_hosts (bool): Whether pages of loopback, private and link-local hosts may be fetched, refused
+            by default, including through redirects and links.
+    """
+
+    def __init__(self, cache, max_workers=8, per_host_concurrency=2, per_host_interval=0.5, timeout=10.0, max_bytes=5 * 1024 * 1024,
+                 allow_private_hosts=False):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_interval = per_host_interval
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.allow_private_hosts = allow_private_hosts
+
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+        # One pooled session for every fetch, so connections to a host are reused between its pages
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = "Mozilla/5.0 (compatible; RAG-ChatBOT)"
+        adapter_class = HTTPAdapter if allow_private_hosts else _PublicHTTPAdapter
+        adapter = adapter_class(pool_connections=max_workers, pool_maxsize=max_workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.hooks["response"].append(self._checking_redirect)
+
+    def _limiter(self, host):
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = _HostLimiter(self.per_host_concurrency, self.per_host_interval)
+            return self._limiters[host]
+
+    def validating_url(self, url):
+        """
+        Refuses a URL the crawler may not fetch, see `checking_url`.
+
+        Args:
+            url (str): The URL of the page.
+
+        Raises:
+            ValueError: If the URL is not an http(s) URL of a public host, unless private hosts are allowed.
+        """
+        if not self.allow_private_hosts:
+            checking_url(url)
+
+    def _checking_redirect(self, response, *args, **kwargs):
+        # Called before a redirect is followed, the target is refused like the URL itself
+        if response.is_redirect:
+            self.validating_url(urljoin(response.url, response.headers["Location"]))
+
+    def fetching(self, url):
+        """
+        Fetches a page and extracts its text, sending the cached validators of the page along with the request.
+
+        Args:
+            url (str): The URL of the page.
+
+        Returns:
+            dict: The "url", its "status" ("fetched" or "not_modified"), the extracted "text" and the "links" of the page.
+
+        Raises:
+            requests.RequestException: If the page can not be downloaded.
+            ValueError: If the URL is not an HTML page, or it or a redirect is not on a public host.
+        """
+        self.validating_url(url)
+        cached = self.cache.get(url)
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        limiter = self._limiter(urlparse(url).netloc)
+        with limiter.semaphore, timing("page_fetch"):
+            limiter.waiting()
+
+            with self._session.get(url, headers=headers, timeout=(min(self.timeout, 5.0), self.timeout), stream=True) as response:
+                if response.status_code == 304 and cached:
+                    counting("page_not_modified")
+                    return {"url": url, "status": "not_modified", "text": cached["text"], "links": cached["links"]}
+                response.raise_for_status()
+
+                content_type = response.headers.get("Content-Type", "text/html")
+                if "html" not in content_type:
+                    raise ValueError(f"{url} is not an HTML page ({content_type})")
+
+                def reading_chunks():
+                    received = 0
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        yield chunk
+                        received += len(chunk)
+                        if received >= self.max_bytes:
+                            break
+
+                links = []
+                text = extract_text_from_html(reading_chunks(), links=links)
+
+        # Links are resolved against the final URL, after any redirect
+        links = _normalizing_links(response.url, links)
+        self.cache.store(url, response.headers.get("ETag"), response.headers.get("Last-Modified"), text, links)
+        return {"url": url, "status": "fetched", "text": text, "links": links}
+
+    def crawling(self, urls, max_pages=None, progress=None):
+        """
+        Fetches the given pages concurrently and, when `max_pages` allows more pages than given, the pages they link
+        to under the same site section, until `max_pages` pages are fetched.
+
+        A link is followed when it is on the same host as the page it was found on and under the folder of one of
+        the given URLs, e.g. every page under https://docs.example.com/guide/ for https://docs.example.com/guide/.
+
+        Args:
+            urls (list): The URLs of the pages to be fetched.
+            max_pages (int, optional): The maximum number of pages to fetch. Default is None, only the given pages
+                are fetched.
+            progress (callable, optional): Called with "pages_fetched", "pages_not_modified" or "pages_failed" and a
+                count as pages are done. Default is None.
+
+        Returns:
+            list: A dictionary per page, see `fetching`, in the order the pages were discovered. Pages which could
+            not be fetched have a "failed" status and an "error" instead of a text.
+        """
+        urls = list(dict.fromkeys(urldefrag(url)[0] for url in urls))
+        max_pages = max(max_pages or len(urls), len(urls))
+        prefixes = [_section_prefix(url) for url in urls]
+
+        seen = set(urls)
+        order = {url: position for position, url in enumerate(urls)}
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="crawler") as executor:
+            pending = {executor.submit(self.fetching, url): url for url in urls}
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {"url": url, "status": "failed", "error": str(e)}
+
+                    results[url] = result
+                    if progress:
+                        progress(f"pages_{result['status']}", 1)
+
+                    for link in result.get("links", []):
+                        if len(seen) >= max_pages:
+                            break
+                        if link not in seen and any(link.startswith(prefix) for prefix in prefixes):
+                            seen.add(link)
+                            order[link] = len(order)
+                            pending[executor.submit(self.fetching, link)] = link
+
+        return sorted(results.values(), key=lambda result: order[result["url"]])
+
+
+def _section_prefix(url):
+    """
+    Returns the URL of the folder of a page, e.g. https://example.com/guide/ for https://example.com/guide/intro.html.
+    """
+    return url[:url.rfind("/") + 1] if urlparse(url).path else url + "/"
+
+
+def _normalizing_links(base_url, links):
+    """
+    Resolves the links of a page into absolute http(s) URLs without fragment, dropping duplicates and links to files.
+    """
+    normalized = []
+    for link in links:
+        url = urldefrag(urljoin(base_url, link.strip()))[0]
+        if urlparse(url).scheme in ("http", "https") and not urlparse(url).path.lower().endswith(SKIPPED_EXTENSIONS):
+            normalized.append(url)
+    return list(dict.fromkeys(normalized))
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from urllib.parse import quote_plus
+
+from utils.embedding_cache import normalizing_text
+from utils.telemetry import counting, logging_event, timing
+
+
+def normalizing_query(query):
+    """
+    Normalizes a search query so that differences in case, unicode forms and spacing map to the same cache key.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        str: The normalized query.
+    """
+    return normalizing_text(query).lower()
+
+
+class DuckDuckGoBackend:
+    """
+    Searches the web with DuckDuckGo through a single API wrapper, created on first use and reused by every search.
+
+    Attributes:
+        safesearch (str): The DuckDuckGo safe search level, "strict", "moderate" or "off".
+    """
+
+    def __init__(self, safesearch="strict"):
+        self.safesearch = safesearch
+        self._wrapper = None
+
+    def results(self, query, max_results):
+        """
+        Runs a text search.
+
+        Args:
+            query (str): The search query.
+            max_results (int): The maximum number of results.
+
+        Returns:
+            list: The results as dictionaries with "title", "link" and "snippet" keys, in ranking order.
+        """
+        if self._wrapper is None:
+            from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+            self._wrapper = DuckDuckGoSearchAPIWrapper(safesearch=self.safesearch, max_results=max_results)
+        return self._wrapper.results(query, max_results=max_results)
+
+
+class StubSearchBackend:
+    """
+    A local backend answering every query with made up results, without any network call. Used for tests and
+    benchmarks, or when no search engine can be reached.
+
+    Attributes:
+        delay (float): The number of seconds every search takes, to simulate the latency of a real backend.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def results(self, query, max_results):
+        if self.delay:
+            time.sleep(self.delay)
+        return [
+            {"title": f"Result {rank} for {query}", "link": f"https://example.com/search?q={quote_plus(query)}&rank={rank}", "snippet": ""}
+            for rank in range(1, max_results + 1)
+        ]
+
+
+def creating_search_backend(name):
+    """
+    Creates the search backend with the given name.
+
+    Args:
+        name (str): "duckduckgo" or "stub".
+
+    Returns:
+        DuckDuckGoBackend | StubSearchBackend: The search backend.
+    """
+    if name.lower() == "stub":
+        return StubSearchBackend()
+    return DuckDuckGoBackend()
+
+
+class WebSearcher:
+    """
+    Searches the web for resources on queries unrelated to the document, within a latency budget.
+
+    Results are cached by normalized query, so hot queries never reach the backend again until they expire. A search
+    taking longer than `timeout` seconds, or failing, falls back on the expired cached results of the query if there
+    are any, and on no results otherwise.
+
+    Attributes:
+        backend (DuckDuckGoBackend | StubSearchBackend): The search backend, any object with a
+            `results(query, max_results)` method.
+        max_results (int): The number of resources returned for a query.
+        timeout (float): The maximum number of seconds a search may take.
+        ttl (float): The number of seconds cached results stay valid.
+        max_entries (int): The maximum number of cached queries.
+    """
+
+    def __init__(self, backend, max_results=4, timeout=5.0, ttl=3600.0, max_entries=1024, max_workers=8):
+        self.backend = backend
+        self.max_results = max_results
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # Cached results of every normalized query, as (results, creation time), in least recently used order
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="web-search")
+
+    def _cached(self, key, allow_expired=False):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or (not allow_expired and time.monotonic() - entry[1] > self.ttl):
+                return None
+            self._cache.move_to_end(key)
+            return entry[0]
+
+    def _storing(self, key, results):
+        with self._lock:
+            self._cache[key] = (results, time.monotonic())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _searching_backend(self, query):
+        """
+        Runs the search on the backend and keeps the (title, link) pair of every well formed result.
+        """
+        with timing("web_search"):
+            found = self.backend.results(query, max_results=self.max_results)
+
+        results = []
+        for result in found:
+            title, link = (result.get("title") or "").strip(), (result.get("link") or "").strip()
+            if title and link.startswith(("http://", "https://")):
+                results.append((title, link))
+        return results[:self.max_results]
+
+    def _falling_back(self, key, error):
+        counting("web_search_fallback")
+        logging_event("web_search_failed", level=logging.WARNING, query=key, error=str(error))
+        return self._cached(key, allow_expired=True) or []
+
+    def searching(self, query):
+        """
+        Searches the web for the given query.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            list: Up to `max_results` (title, link) pairs, in the ranking order of the backend.
+        """
+        key = normalizing_query(query)
+        results = self._cached(key)
+        if results is not None:
+            counting("web_search_cache_hit")
+            return results
+
+        future = self._executor.submit(self._searching_backend, key)
+        try:
+            results = future.result(timeout=self.timeout)
+        except TimeoutError:
+            return self._falling_back(key, f"no results after {self.timeout} seconds")
+        except Exception as e:
+            return self._falling_back(key, e)
+
+        self._storing(key, results)
+        return results
+
+    async def asearching(self, query):
+        """
+        Asynchronous version of `searching`, waiting for the backend without blocking the event loop.
+        """
+        key = normalizing_query(query)
+        results = self._cached(key)
+        if results is not None:
+            counting("web_search_cache_hit")
+            return results
+
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._searching_backend, key)
+        try:
+            results = await asyncio.wait_for(future, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return self._falling_back(key, f"no results after {self.timeout} seconds")
+        except Exception as e:
+            return self._falling_back(key, e)
+
+        self._storing(key, results)
+        return results
@@ -1,57 +1,272 @@
-import requests
-import streamlit as st
 import base64
+import hashlib
 import io
+import json
 import os
+import re
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
-def generating_audio(text):
+# Loading environment variables from the .env file
+load_dotenv()
+
+# API endpoint for Sarvam AI Text-to-Speech service
+TTS_URL = "https://api.sarvam.ai/text-to-speech"
+
+# Voice of the synthesized audio, part of the cache key of every clip
+VOICE_SETTINGS = {
+    "target_language_code": "hi-IN",  # Target language code (Hindi - India)
+    "speaker": "meera",  # Specify the speaker's voice (Meera)
+    "pitch": 0,  # Pitch of the voice (0 is default)
+    "pace": 1.00,  # Speed of the speech (1.00 is normal speed)
+    "loudness": 1.5,  # Volume/loudness adjustment (1.5 is amplified)
+    "speech_sample_rate": 16000,  # Sample rate for the audio in Hz
+    "enable_preprocessing": True,  # Preprocess text to clean or normalize it
+    "model": "bulbul:v1",  # Model used for speech synthesis
+}
+
+# The API rejects inputs longer than this
+MAX_INPUT_CHARACTERS = 500
+
+SENTENCE_END = re.compile(r"(?<=[.!?।])\s+|\n+")
+
+# Pooled session and worker threads shared by every synthesis, created on first use
+_session = None
+_executor = None
+_lock = threading.Lock()
+
+
+def _getting_session():
+    global _session, _executor
+    with _lock:
+        if _session is None:
+            concurrency = int(os.getenv("TTS_CONCURRENCY", "4"))
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+            _session.mount("https://", adapter)
+            _executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="tts")
+        return _session, _executor
+
+
+def cleaning_text(text):
     """
-    Generates audio from text using the Sarvam AI Text-to-Speech API.
+    Keeps only the words of an answer: HTML tags, markdown symbols and the '\\' newlines of the llm are dropped.
 
     Args:
-    text (str): The input text that will be inferences into an audio.
+        text (str): The answer as displayed in the app.
 
     Returns:
-    BytesIO: An in-memory file-like object containing the audio data in WAV format.
+        str: The text to be read aloud.
     """
+    text = re.sub(r"<[^>]+>", " ", text).replace("\\", "\n")
+    text = re.sub(r"[*_#`>|]+", " ", text)
+    return re.sub(r"[ \t]+", " ", text).strip()
 
-    # Loading environment variables from the .env file
-    load_dotenv()
 
-    # API endpoint for Sarvam AI Text-to-Speech service
-    url = "https://api.sarvam.ai/text-to-speech"
+def splitting_text(text, max_characters=MAX_INPUT_CHARACTERS):
+    """
+    Splits a text into pieces of at most `max_characters` characters on sentence boundaries, grouping short
+    sentences together. Sentences longer than a piece are split on commas, then on spaces.
 
-    # Preparing the payload with the necessary parameters for the API request
-    payload = {
-        "inputs": [text],  # text inputs to convert to speech
-        "target_language_code": "hi-IN",  # Target language code (Hindi - India)
-        "speaker": "meera",  # Specify the speaker's voice (Meera)
-        "pitch": 0,  # Pitch of the voice (0 is default)
-        "pace": 1.00,  # Speed of the speech (1.00 is normal speed)
-        "loudness": 1.5,  # Volume/loudness adjustment (1.5 is amplified)
-        "speech_sample_rate": 16000,  # Sample rate for the audio in Hz
-        "enable_preprocessing": True,  # Preprocess text to clean or normalize it
-        "model": "bulbul:v1"  # Model used for speech synthesis
-    }
+    Args:
+        text (str): The text to be split.
+        max_characters (int, optional): The maximum length of a piece. Default is 500, the limit of the API.
+
+    Returns:
+        list: The pieces of the text, in order.
+    """
+    sentences = []
+    for sentence in SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        while len(sentence) > max_characters:
+            cut = sentence.rfind(", ", 0, max_characters)
+            cut = cut + 1 if cut > 0 else sentence.rfind(" ", 0, max_characters)
+            cut = cut if cut > 0 else max_characters
+            sentences.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            sentences.append(sentence)
+
+    pieces = []
+    for sentence in sentences:
+        if pieces and len(pieces[-1]) + 1 + len(sentence) <= max_characters:
+            pieces[-1] += " " + sentence
+        else:
+            pieces.append(sentence)
+    return pieces
+
+
+def _cache_path(text, settings):
+    key = hashlib.sha256(json.dumps({"text": text, **settings}, sort_keys=True).encode("utf-8")).hexdigest()
+    return os.path.join(os.getenv("TTS_CACHE_DIR", "/tmp/rag-tts-cache"), key + ".wav")
+
+
+def synthesizing_clip(text, settings=VOICE_SETTINGS):
+    """
+    Synthesizes a piece of text into a WAV clip, reading it from the on-disk cache when the same text was already
+    synthesized with the same voice and settings.
+
+    Args:
+        text (str): The text, at most 500 characters long.
+        settings (dict, optional): The voice settings of the API. Default is `VOICE_SETTINGS`.
+
+    Returns:
+        bytes: The WAV clip.
 
-    # Set the request headers, including the API key from the environment variables
+    Raises:
+        requests.RequestException: If the API fails or does not answer within `TTS_TIMEOUT` seconds.
+    """
+    path = _cache_path(text, settings)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        pass
+
+    session, _ = _getting_session()
     headers = {
         "Content-Type": "application/json",  # Specifying content type as JSON
-        "API-Subscription-Key": os.environ['SARVAM_API_KEY']  # API key loaded from .env
+        "API-Subscription-Key": os.environ["SARVAM_API_KEY"],  # API key loaded from .env
     }
+    response = session.post(TTS_URL, json={"inputs": [text], **settings}, headers=headers,
+                            timeout=(5.0, float(os.getenv("TTS_TIMEOUT", "15"))))
+    response.raise_for_status()
+
+    # The API answers with one base64-encoded WAV file per input
+    clip = base64.b64decode(response.json()["audios"][0])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(clip)
+    os.replace(tmp_path, path)
+    return clip
 
-    # A POST request to the Text-to-Speech API with the provided payload and headers
-    response = requests.request("POST", url, json=payload, headers=headers).json()
 
-    # The API response contains a list of base64-encoded audio segments
-    audio_raw = ''.join(response['audios'])  # Concatenate all audio segments
+def merging_wav(clips):
+    """
+    Concatenates WAV clips into a single WAV file: the audio frames are appended one after the other under a single
+    header, instead of concatenating whole files.
+
+    Args:
+        clips (iterable): The WAV clips, all with the same channels, sample width and rate.
+
+    Returns:
+        BytesIO: An in-memory file-like object containing the merged audio in WAV format.
+
+    Raises:
+        ValueError: If the clips do not share the same audio format.
+    """
+    buffer = io.BytesIO()
+    output = None
+
+    for clip in clips:
+        with wave.open(io.BytesIO(clip), "rb") as clip_wav:
+            params = clip_wav.getparams()[:3]
+            if output is None:
+                output = wave.open(buffer, "wb")
+                output.setnchannels(params[0])
+                output.setsampwidth(params[1])
+                output.setframerate(params[2])
+                output_params = params
+            elif params != output_params:
+                raise ValueError(f"Can not merge WAV clips of different formats: {params} and {output_params}")
+            output.writeframes(clip_wav.readframes(clip_wav.getnframes()))
+
+    if output is not None:
+        output.close()
+    buffer.seek(0)
+    return buffer
+
+
+class SpeechStream:
+    """
+    Synthesizes an answer while it is being written: every sentence is sent to the API as soon as it is complete,
+    and the pieces are synthesized concurrently, so most of the audio is ready by the time the answer is.
+
+    The first sentence is synthesized alone, so the first clip comes back quickly. The next ones are grouped into
+    pieces of about `group_characters` characters to send fewer requests.
+
+    Attributes:
+        settings (dict): The voice settings of the API.
+        group_characters (int): The length from which the pending sentences are sent as one piece.
+    """
+
+    def __init__(self, settings=VOICE_SETTINGS, group_characters=200):
+        self.settings = settings
+        self.group_characters = group_characters
+
+        self._buffer = ""
+        self._pending = ""
+        self._futures = []
+
+    def feeding(self, text):
+        """
+        Adds the next piece of the answer, synthesizing the sentences it completes.
 
-    # Decode the base64 audio data into binary WAV format
-    decoded_audio = base64.b64decode(audio_raw)
+        Args:
+            text (str): The next piece of the answer, as displayed in the app.
+        """
+        self._buffer += text
 
-    # Create an in-memory file-like object (BytesIO) to hold the decoded audio data
-    audio_buffer = io.BytesIO(decoded_audio)
+        # Only the sentences followed by a space or a newline are complete, "3." may still become "3.5"
+        boundaries = list(SENTENCE_END.finditer(self._buffer))
+        if not boundaries:
+            return
 
-    # Return the in-memory audio buffer to be used in the app
-    return audio_buffer
+        end = boundaries[-1].end()
+        self._pending = f"{self._pending} {self._buffer[:end]}"
+        self._buffer = self._buffer[end:]
+
+        if not self._futures or len(cleaning_text(self._pending)) >= self.group_characters:
+            self._submitting()
+
+    def closing(self):
+        """
+        Synthesizes the rest of the answer, once it is complete.
+        """
+        self._pending = f"{self._pending} {self._buffer}"
+        self._buffer = ""
+        self._submitting()
+
+    def _submitting(self):
+        _, executor = _getting_session()
+        for piece in splitting_text(cleaning_text(self._pending)):
+            self._futures.append(executor.submit(synthesizing_clip, piece, self.settings))
+        self._pending = ""
+
+    def clips(self):
+        """
+        Yields the WAV clips of the answer in order, each one as soon as it and the ones before it are synthesized.
+        """
+        for future in self._futures:
+            yield future.result()
+
+    def merging(self):
+        """
+        Waits for every clip and merges them, see `merging_wav`.
+        """
+        return merging_wav(self.clips())
+
+
+def generating_audio(text):
+    """
+    Generates audio from text using the Sarvam AI Text-to-Speech API.
+
+    The text is split on sentence boundaries and the pieces are synthesized concurrently, then merged in order.
+
+    Args:
+    text (str): The input text that will be inferences into an audio.
+
+    Returns:
+    BytesIO: An in-memory file-like object containing the audio data in WAV format.
+    """
+    stream = SpeechStream()
+    stream.feeding(text)
+    stream.closing()
+    return stream.merging()